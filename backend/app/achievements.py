@@ -0,0 +1,141 @@
+"""Event-driven achievement awards.
+
+Endpoints describe what changed as typed events carrying the old and new
+value of a counter (XP, completed steps, streak, completed stories). For each
+event the engine bisects the registry's per-type thresholds (achievements
+sorted by `requirement_value`) and considers only the achievements whose
+threshold lies in `(old, new]`, so nothing is rescanned or recounted.
+
+Awards are claimed with `INSERT ... ON CONFLICT DO NOTHING` against the
+unique (user_id, achievement_id) index; rewards are only granted when the
+insert went through, which makes concurrent requests crossing the same
+threshold award it once. XP rewards feed back in as another `xp_changed`
+event. `check_all` re-evaluates every threshold from the current counters
+(POST /progress/check-achievements) to pick up anything missed.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.leaderboard import award_xp
+from app.models import User, UserAchievement, StepProgress
+from app.registry import ReferenceData, AchievementRef
+from app.story_progress import count_completed_stories
+
+XP_CHANGED = "xp_changed"
+STEP_COMPLETED = "step_completed"
+STREAK_CHANGED = "streak_changed"
+STORY_COMPLETED = "story_completed"
+
+# Event type -> Achievement.requirement_type it advances
+REQUIREMENT_TYPES = {
+    XP_CHANGED: "xp",
+    STEP_COMPLETED: "steps",
+    STREAK_CHANGED: "streak",
+    STORY_COMPLETED: "stories",
+}
+
+
+@dataclass(frozen=True)
+class AchievementEvent:
+    type: str
+    new: int
+    # None considers every threshold up to `new`
+    old: Optional[int] = None
+
+
+def crossed(registry: ReferenceData, requirement_type: str, old: Optional[int], new: int) -> tuple[AchievementRef, ...]:
+    """Achievements of a type whose requirement_value lies in (old, new]."""
+    values = registry.achievement_thresholds.get(requirement_type, ())
+    lo = 0 if old is None else bisect_right(values, old)
+    hi = bisect_right(values, new)
+    if hi <= lo:
+        return ()
+    return registry.achievements_by_type[requirement_type][lo:hi]
+
+
+async def _claim(db: AsyncSession, user_id: int, achievement_id: int) -> bool:
+    """Insert the user_achievements row; False if it already existed."""
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(UserAchievement).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(UserAchievement).on_conflict_do_nothing()
+    else:
+        exists = await db.execute(
+            select(UserAchievement.id).where(
+                UserAchievement.user_id == user_id, UserAchievement.achievement_id == achievement_id
+            )
+        )
+        if exists.first():
+            return False
+        db.add(UserAchievement(user_id=user_id, achievement_id=achievement_id))
+        return True
+    result = await db.execute(stmt.values(user_id=user_id, achievement_id=achievement_id))
+    return result.rowcount == 1
+
+
+async def process_events(
+    db: AsyncSession,
+    user: User,
+    events: Iterable[AchievementEvent],
+    registry: ReferenceData,
+    earned: Optional[set[int]] = None,
+) -> list[dict]:
+    """Award achievements crossed by `events`. Caller commits.
+
+    `earned` (already earned ids), when given, skips claims that would be no-ops.
+    """
+    newly_earned = []
+    pending = list(events)
+    while pending:
+        event = pending.pop(0)
+        for ach in crossed(registry, REQUIREMENT_TYPES[event.type], event.old, event.new):
+            if earned is not None and ach.id in earned:
+                continue
+            if not await _claim(db, user.id, ach.id):
+                continue
+            if earned is not None:
+                earned.add(ach.id)
+            xp_before = user.xp or 0
+            award_xp(db, user, ach.xp_reward, "achievement")
+            user.coins = (user.coins or 0) + ach.coin_reward
+            newly_earned.append({
+                "id": ach.id,
+                "title": ach.title,
+                "icon": ach.icon,
+                "rarity": ach.rarity,
+                "xp_reward": ach.xp_reward,
+                "coin_reward": ach.coin_reward,
+            })
+            if ach.xp_reward:
+                pending.append(AchievementEvent(XP_CHANGED, user.xp, xp_before))
+    return newly_earned
+
+
+async def count_completed_steps(db: AsyncSession, user_id: int) -> int:
+    result = await db.execute(
+        select(func.count(StepProgress.id)).where(
+            StepProgress.user_id == user_id,
+            StepProgress.is_completed == True
+        )
+    )
+    return result.scalar() or 0
+
+
+async def check_all(db: AsyncSession, user: User, registry: ReferenceData) -> list[dict]:
+    """Evaluate every threshold against the user's current counters. Caller commits."""
+    earned_res = await db.execute(
+        select(UserAchievement.achievement_id).where(UserAchievement.user_id == user.id)
+    )
+    events = [
+        AchievementEvent(XP_CHANGED, user.xp or 0),
+        AchievementEvent(STEP_COMPLETED, await count_completed_steps(db, user.id)),
+        AchievementEvent(STREAK_CHANGED, user.current_streak or 0),
+        AchievementEvent(STORY_COMPLETED, await count_completed_stories(db, user.id)),
+    ]
+    return await process_events(db, user, events, registry, earned=set(earned_res.scalars().all()))
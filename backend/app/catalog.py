@@ -0,0 +1,301 @@
+"""In-memory content catalog (Story → Chapter → Step → Slide).
+
+Course content only changes when `sync_data.py` or `seed_from_json` runs, so the
+whole tree is loaded once into immutable nodes and shared by every request.
+Writers bump the `content` row in `content_versions`; readers probe that row at
+most every `catalog_refresh_seconds` and rebuild + swap the catalog atomically
+when it moves. User-specific state (enrollment, progress, is_current) is never
+stored here — routers overlay it on top.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, joinedload
+
+from app.config import settings
+from app.database import get_db, async_session
+from app.models import Story, Chapter, Step, ContentVersion, StoryStats, ChapterStats
+from app.content_stats import count_blocks, step_content_hash, story_content_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_VERSION_KEY = "content"
+
+
+@dataclass(frozen=True)
+class ContentStats:
+    chapter_count: int = 0
+    step_count: int = 0
+    slide_count: int = 0
+    quiz_count: int = 0
+    interaction_count: int = 0
+
+
+@dataclass(frozen=True)
+class SlideNode:
+    id: int
+    step_id: int
+    order_index: int
+    blocks: list
+
+
+@dataclass(frozen=True)
+class StepNode:
+    id: int
+    chapter_id: int
+    story_id: int
+    story_slug: str
+    chapter_title: str
+    title: str
+    description: Optional[str]
+    xp_reward: int
+    coin_reward: int
+    order_index: int
+    slides: tuple[SlideNode, ...] = ()
+    content_hash: str = ""
+
+
+@dataclass(frozen=True)
+class ChapterNode:
+    id: int
+    story_id: int
+    title: str
+    description: Optional[str]
+    order_index: int
+    steps: tuple[StepNode, ...] = ()
+    stats: ContentStats = ContentStats()
+
+
+@dataclass(frozen=True)
+class StoryNode:
+    id: int
+    slug: str
+    title: str
+    description: Optional[str]
+    thumbnail_url: Optional[str]
+    illustration: Optional[str]
+    icon: Optional[str]
+    color: Optional[str]
+    category_name: Optional[str]
+    difficulty: Optional[str]
+    is_published: bool
+    is_featured: bool
+    order_index: int
+    chapters: tuple[ChapterNode, ...] = ()
+    stats: ContentStats = ContentStats()
+    content_hash: str = ""
+
+    @property
+    def step_ids(self) -> frozenset[int]:
+        return frozenset(st.id for ch in self.chapters for st in ch.steps)
+
+
+@dataclass(frozen=True)
+class ContentCatalog:
+    version: int
+    stories: tuple[StoryNode, ...] = ()  # ordered by order_index
+    stories_by_id: Mapping[int, StoryNode] = field(default_factory=dict)
+    stories_by_slug: Mapping[str, StoryNode] = field(default_factory=dict)
+    chapters_by_id: Mapping[int, ChapterNode] = field(default_factory=dict)
+    steps_by_id: Mapping[int, StepNode] = field(default_factory=dict)
+    next_step_ids: Mapping[int, Optional[int]] = field(default_factory=dict)  # across chapters, within a story
+
+
+_catalog: ContentCatalog | None = None
+_last_probe: float = 0.0
+_lock = asyncio.Lock()
+
+
+async def _read_version(db: AsyncSession, key: str = CONTENT_VERSION_KEY) -> int:
+    result = await db.execute(select(ContentVersion.version).where(ContentVersion.key == key))
+    return result.scalar() or 0
+
+
+async def bump_content_version(db: AsyncSession, key: str = CONTENT_VERSION_KEY) -> int:
+    """Increment the stored version for `key`. Caller must commit."""
+    result = await db.execute(select(ContentVersion).where(ContentVersion.key == key))
+    row = result.scalar_one_or_none()
+    if row is None:
+        row = ContentVersion(key=key, version=1)
+        db.add(row)
+    else:
+        row.version = (row.version or 0) + 1
+    await db.flush()
+    return row.version
+
+
+def _stats_from_steps(steps: list[StepNode], chapter_count: int = 0) -> ContentStats:
+    """Fallback when no materialized stats row exists (e.g. a DB synced before story_stats)."""
+    quizzes = interactions = slides = 0
+    for st in steps:
+        for sl in st.slides:
+            q, i = count_blocks(sl.blocks)
+            quizzes += q
+            interactions += i
+            slides += 1
+    return ContentStats(
+        chapter_count=chapter_count,
+        step_count=len(steps),
+        slide_count=slides,
+        quiz_count=quizzes,
+        interaction_count=interactions,
+    )
+
+
+async def build_catalog(db: AsyncSession) -> ContentCatalog:
+    """Load the whole content tree in one eager query and freeze it."""
+    version = await _read_version(db)
+    story_stats_res = await db.execute(select(StoryStats))
+    story_stats = {row.story_id: row for row in story_stats_res.scalars().all()}
+    chapter_stats_res = await db.execute(select(ChapterStats))
+    chapter_stats = {row.chapter_id: row for row in chapter_stats_res.scalars().all()}
+
+    result = await db.execute(
+        select(Story)
+        .options(
+            joinedload(Story.category),
+            selectinload(Story.chapters).selectinload(Chapter.steps).selectinload(Step.slides)
+        )
+        .order_by(Story.order_index, Story.id)
+    )
+    stories = []
+    chapters_by_id = {}
+    steps_by_id = {}
+    for story in result.unique().scalars().all():
+        chapters = []
+        for chapter in sorted(story.chapters, key=lambda c: c.order_index or 0):
+            steps = []
+            for step in sorted(chapter.steps, key=lambda s: s.order_index or 0):
+                slides = tuple(
+                    SlideNode(
+                        id=sl.id,
+                        step_id=step.id,
+                        order_index=sl.order_index or 0,
+                        blocks=sl.blocks or [],
+                    )
+                    for sl in sorted(step.slides, key=lambda s: s.order_index or 0)
+                )
+                node = StepNode(
+                    id=step.id,
+                    chapter_id=chapter.id,
+                    story_id=story.id,
+                    story_slug=story.slug,
+                    chapter_title=chapter.title,
+                    title=step.title,
+                    description=step.description,
+                    xp_reward=step.xp_reward or 0,
+                    coin_reward=step.coin_reward or 0,
+                    order_index=step.order_index or 0,
+                    slides=slides,
+                    content_hash=step.content_hash or step_content_hash(slides),
+                )
+                steps.append(node)
+                steps_by_id[node.id] = node
+            cs = chapter_stats.get(chapter.id)
+            ch_node = ChapterNode(
+                id=chapter.id,
+                story_id=story.id,
+                title=chapter.title,
+                description=chapter.description,
+                order_index=chapter.order_index or 0,
+                steps=tuple(steps),
+                stats=ContentStats(
+                    step_count=cs.step_count or 0,
+                    slide_count=cs.slide_count or 0,
+                    quiz_count=cs.quiz_count or 0,
+                    interaction_count=cs.interaction_count or 0,
+                ) if cs else _stats_from_steps(steps),
+            )
+            chapters.append(ch_node)
+            chapters_by_id[ch_node.id] = ch_node
+        ss = story_stats.get(story.id)
+        story_stats_node = ContentStats(
+            chapter_count=ss.chapter_count or 0,
+            step_count=ss.step_count or 0,
+            slide_count=ss.slide_count or 0,
+            quiz_count=ss.quiz_count or 0,
+            interaction_count=ss.interaction_count or 0,
+        ) if ss else _stats_from_steps([st for ch in chapters for st in ch.steps], len(chapters))
+        category_name = story.category.name if story.category else None
+        content_hash = story.content_hash or story_content_hash(
+            story, category_name, [(ch, ch.steps) for ch in chapters], story_stats_node.quiz_count
+        )
+        stories.append(StoryNode(
+            id=story.id,
+            slug=story.slug,
+            title=story.title,
+            description=story.description,
+            thumbnail_url=story.thumbnail_url,
+            illustration=story.illustration,
+            icon=story.icon,
+            color=story.color,
+            category_name=category_name,
+            difficulty=story.difficulty,
+            is_published=bool(story.is_published),
+            is_featured=bool(story.is_featured),
+            order_index=story.order_index or 0,
+            chapters=tuple(chapters),
+            stats=story_stats_node,
+            content_hash=content_hash,
+        ))
+
+    next_step_ids = {}
+    for story_node in stories:
+        ordered = [st.id for ch in story_node.chapters for st in ch.steps]
+        for idx, step_id in enumerate(ordered):
+            next_step_ids[step_id] = ordered[idx + 1] if idx + 1 < len(ordered) else None
+
+    return ContentCatalog(
+        version=version,
+        stories=tuple(stories),
+        stories_by_id=MappingProxyType({s.id: s for s in stories}),
+        stories_by_slug=MappingProxyType({s.slug: s for s in stories}),
+        chapters_by_id=MappingProxyType(chapters_by_id),
+        steps_by_id=MappingProxyType(steps_by_id),
+        next_step_ids=MappingProxyType(next_step_ids),
+    )
+
+
+async def refresh_catalog(db: AsyncSession | None = None, stale: ContentCatalog | None = None) -> ContentCatalog:
+    """Rebuild the catalog and swap it in. Readers keep the old one until the swap.
+
+    When `stale` is given and another request already replaced it while we waited
+    on the lock, the fresh catalog is returned without rebuilding again.
+    """
+    global _catalog, _last_probe
+    async with _lock:
+        if stale is not None and _catalog is not None and _catalog is not stale:
+            return _catalog
+        if db is None:
+            async with async_session() as session:
+                catalog = await build_catalog(session)
+        else:
+            catalog = await build_catalog(db)
+        _catalog = catalog
+        _last_probe = time.monotonic()
+    logger.info("Content catalog loaded: version=%s stories=%s steps=%s",
+                catalog.version, len(catalog.stories), len(catalog.steps_by_id))
+    return catalog
+
+
+async def get_catalog(db: AsyncSession = Depends(get_db)) -> ContentCatalog:
+    """FastAPI dependency returning the current catalog, reloading it if a sync moved the version."""
+    global _last_probe
+    catalog = _catalog
+    if catalog is None:
+        return await refresh_catalog(db)
+
+    now = time.monotonic()
+    if now - _last_probe < settings.catalog_refresh_seconds:
+        return catalog
+    _last_probe = now
+    if await _read_version(db) != catalog.version:
+        return await refresh_catalog(db, stale=catalog)
+    return catalog
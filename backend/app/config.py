@@ -26,6 +26,33 @@ class Settings(BaseSettings):
     # URLs used in emails
     backend_base_url: str = "http://localhost:8000"
 
+    # How often (seconds) cached content checks whether a sync bumped its version
+    catalog_refresh_seconds: int = 30
+
+    # Cache-Control for user-independent content (slides, anonymous story detail)
+    content_cache_control: str = "public, max-age=60, s-maxage=600"
+
+    # Max steps whose encoded slides response is kept in memory
+    slide_cache_max_entries: int = 256
+
+    # Slide.blocks storage: "json" (plain column) or "zlib" (compressed with a per-course dictionary)
+    slide_compression: str = Field(default="json", alias="SLIDE_COMPRESSION")
+
+    # How often (seconds) the in-memory leaderboard rank index is re-checked against SQL
+    leaderboard_verify_seconds: int = 300
+    # Interval (seconds) of the background all-time/weekly leaderboard snapshot job; 0 disables it
+    leaderboard_snapshot_seconds: int = 300
+
+    # Per-user GET /progress/stats cache: max users kept, and entry lifetime (seconds; 0 disables)
+    progress_stats_cache_max_entries: int = 10000
+    progress_stats_cache_seconds: int = 60
+
+    # Quest pre-assignment job: run interval (seconds; 0 disables), how long before a user's
+    # local midnight the next period is assigned (keep above the interval), and which users count as active
+    quest_schedule_seconds: int = 300
+    quest_preassign_minutes: int = 60
+    quest_active_user_days: int = 14
+
     # CORS
     cors_origins: list[str] = [
         "http://localhost:3000",
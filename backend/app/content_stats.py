@@ -0,0 +1,236 @@
+"""Per-story / per-chapter content aggregates materialized at sync time.
+
+`sync_data.process_course` and `main.seed_from_json` call these after writing
+content so list/detail endpoints can read counts (chapters, steps, slides,
+quiz and interaction blocks) without walking slide blocks per request.
+
+The same pass stores a content hash per step (its slides payload) and per
+story (its metadata + chapter/step tree), used as ETags by the content endpoints.
+
+`store_story_slides` rewrites a story's slide blocks into the storage mode set
+by `settings.slide_compression` (plain JSON, or zlib with a per-course
+dictionary); running it over existing rows is the migration path between modes.
+"""
+import hashlib
+import json
+
+from sqlalchemy import select, delete, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, joinedload
+
+from app.config import settings
+from app.models import Story, Chapter, Step, Slide, StoryStats, ChapterStats, SlideDictionary
+from app.slide_codec import CODEC_ZLIB, build_dictionary, compress_blocks, encode_json
+
+
+def count_blocks(blocks) -> tuple[int, int]:
+    """Return (quiz_count, interaction_count) for one slide's blocks."""
+    quizzes = 0
+    interactions = 0
+    if not isinstance(blocks, list):
+        return 0, 0
+    for b in blocks:
+        if not isinstance(b, dict):
+            continue
+        block_type = b.get('type') or b.get('block_type')
+        if block_type == 'quiz':
+            quizzes += 1
+        elif block_type == 'interaction':
+            interactions += 1
+    return quizzes, interactions
+
+
+def _digest(payload) -> str:
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def step_content_hash(slides) -> str:
+    """Hash of a step's slides as served by GET /steps/{id}/slides.
+
+    Accepts ORM slides or catalog nodes (anything with id/order_index/blocks),
+    already sorted by order_index.
+    """
+    return _digest([
+        {"id": sl.id, "order_index": sl.order_index or 0, "blocks": sl.blocks or []}
+        for sl in slides
+    ])
+
+
+def story_content_hash(story, category_name, chapters, quiz_count: int) -> str:
+    """Hash of the user-independent part of GET /stories/{slug}.
+
+    `chapters` is a sorted list of (chapter, steps) pairs; steps are sorted and
+    already carry their own `content_hash`.
+    """
+    return _digest({
+        "id": story.id,
+        "slug": story.slug,
+        "title": story.title,
+        "description": story.description,
+        "thumbnail_url": story.thumbnail_url,
+        "illustration": story.illustration,
+        "icon": story.icon,
+        "color": story.color,
+        "category_name": category_name,
+        "exercises": quiz_count,
+        "chapters": [
+            {
+                "id": ch.id,
+                "title": ch.title,
+                "description": ch.description,
+                "steps": [
+                    {
+                        "id": st.id,
+                        "title": st.title,
+                        "description": st.description,
+                        "xp_reward": st.xp_reward,
+                        "content_hash": st.content_hash,
+                    }
+                    for st in steps
+                ],
+            }
+            for ch, steps in chapters
+        ],
+    })
+
+
+async def materialize_story_stats(db: AsyncSession, story_id: int) -> StoryStats:
+    """Recompute and store stats + content hashes for one story. Caller must commit."""
+    result = await db.execute(
+        select(Story)
+        .options(
+            joinedload(Story.category),
+            selectinload(Story.chapters).selectinload(Chapter.steps).selectinload(Step.slides)
+        )
+        .where(Story.id == story_id)
+        .execution_options(populate_existing=True)
+    )
+    story = result.unique().scalar_one()
+
+    await db.execute(delete(ChapterStats).where(ChapterStats.story_id == story_id))
+    await db.execute(delete(StoryStats).where(StoryStats.story_id == story_id))
+
+    chapters = sorted(story.chapters, key=lambda c: c.order_index or 0)
+    tree = []
+    totals = {"steps": 0, "slides": 0, "quizzes": 0, "interactions": 0}
+    for chapter in chapters:
+        steps = sorted(chapter.steps, key=lambda s: s.order_index or 0)
+        tree.append((chapter, steps))
+        ch_slides = ch_quizzes = ch_interactions = 0
+        for step in steps:
+            slides = sorted(step.slides, key=lambda s: s.order_index or 0)
+            step.content_hash = step_content_hash(slides)
+            for slide in slides:
+                quizzes, interactions = count_blocks(slide.blocks)
+                ch_quizzes += quizzes
+                ch_interactions += interactions
+            ch_slides += len(slides)
+
+        db.add(ChapterStats(
+            chapter_id=chapter.id,
+            story_id=story_id,
+            step_count=len(steps),
+            slide_count=ch_slides,
+            quiz_count=ch_quizzes,
+            interaction_count=ch_interactions,
+        ))
+        totals["steps"] += len(steps)
+        totals["slides"] += ch_slides
+        totals["quizzes"] += ch_quizzes
+        totals["interactions"] += ch_interactions
+
+    story.content_hash = story_content_hash(
+        story,
+        story.category.name if story.category else None,
+        tree,
+        totals["quizzes"],
+    )
+
+    stats = StoryStats(
+        story_id=story_id,
+        chapter_count=len(chapters),
+        step_count=totals["steps"],
+        slide_count=totals["slides"],
+        quiz_count=totals["quizzes"],
+        interaction_count=totals["interactions"],
+    )
+    db.add(stats)
+    await db.flush()
+    return stats
+
+
+async def materialize_all_story_stats(db: AsyncSession, only_missing: bool = False) -> int:
+    """Recompute stats for every story (or only those missing stats/hash). Returns stories touched."""
+    query = select(Story.id)
+    if only_missing:
+        query = query.where(or_(
+            Story.id.notin_(select(StoryStats.story_id)),
+            Story.content_hash.is_(None),
+        ))
+    result = await db.execute(query)
+    story_ids = list(result.scalars().all())
+    for story_id in story_ids:
+        await materialize_story_stats(db, story_id)
+    return len(story_ids)
+
+
+async def store_story_slides(db: AsyncSession, story_id: int, mode: str | None = None) -> int:
+    """Rewrite a story's slide blocks as plain JSON or dictionary-compressed blobs.
+
+    A fresh dictionary is trained from the story's own slides on every call and
+    the previous one is dropped. Caller must commit. Returns slides rewritten.
+    """
+    mode = mode or settings.slide_compression
+    result = await db.execute(
+        select(Slide)
+        .join(Step, Slide.step_id == Step.id)
+        .join(Chapter, Step.chapter_id == Chapter.id)
+        .where(Chapter.story_id == story_id)
+        .order_by(Slide.id)
+    )
+    slides = list(result.scalars().all())
+    decoded = [(slide, slide.blocks or []) for slide in slides]
+
+    zdict = None
+    if mode == CODEC_ZLIB and slides:
+        zdict = SlideDictionary(
+            story_id=story_id,
+            codec=CODEC_ZLIB,
+            data=build_dictionary([encode_json(blocks) for _, blocks in decoded]),
+        )
+        db.add(zdict)
+        await db.flush()
+
+    for slide, blocks in decoded:
+        if zdict is None:
+            slide.blocks = blocks
+        else:
+            slide.blocks_json = None
+            slide.blocks_z = compress_blocks(blocks, zdict.data)
+            slide.dictionary = zdict
+    await db.flush()
+
+    stale = delete(SlideDictionary).where(SlideDictionary.story_id == story_id)
+    if zdict is not None:
+        stale = stale.where(SlideDictionary.id != zdict.id)
+    await db.execute(stale)
+    return len(slides)
+
+
+async def store_all_story_slides(db: AsyncSession, mode: str | None = None) -> int:
+    """Bring every story whose slides are not in `mode` into it. Returns stories touched."""
+    mode = mode or settings.slide_compression
+    compressed = Slide.blocks_z.is_not(None)
+    query = (
+        select(Chapter.story_id)
+        .join(Step, Step.chapter_id == Chapter.id)
+        .join(Slide, Slide.step_id == Step.id)
+        .where(~compressed if mode == CODEC_ZLIB else compressed)
+        .distinct()
+    )
+    result = await db.execute(query)
+    story_ids = list(result.scalars().all())
+    for story_id in story_ids:
+        await store_story_slides(db, story_id, mode)
+    return len(story_ids)
@@ -0,0 +1,95 @@
+"""Per-user, per-day activity rollup (`daily_activity`).
+
+Step and slide completions add to the row of the user's local day with
+`INSERT ... ON CONFLICT DO UPDATE`, so `GET /progress/heatmap` reads a year
+as one range scan of the (user_id, day) primary key instead of aggregating
+step_progress, slide_progress and xp_events. `rebuild_daily_activity`
+recomputes the table from those (UTC days, since the original timezone is
+not stored; XP granted by admin commands is left out) for existing
+databases (migration 10) and `sync_data.py --repair activity`.
+"""
+from datetime import date
+
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import DailyActivity, StepProgress, SlideProgress, XpEvent
+
+COUNTERS = ("steps", "slides", "xp", "seconds")
+
+
+async def record_activity(
+    db: AsyncSession, user_id: int, day: date, steps: int = 0, slides: int = 0, xp: int = 0, seconds: int = 0
+) -> None:
+    """Add to the user's counters for `day`. Caller commits."""
+    values = {"steps": steps, "slides": slides, "xp": xp, "seconds": seconds}
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(DailyActivity).values(user_id=user_id, day=day, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyActivity.user_id, DailyActivity.day],
+            set_={name: getattr(DailyActivity, name) + getattr(stmt.excluded, name) for name in COUNTERS},
+        )
+        await db.execute(stmt)
+        return
+    row = await db.get(DailyActivity, (user_id, day))
+    if row is None:
+        db.add(DailyActivity(user_id=user_id, day=day, **values))
+    else:
+        for name, amount in values.items():
+            setattr(row, name, getattr(row, name) + amount)
+
+
+async def activity_between(db: AsyncSession, user_id: int, start: date, end: date) -> list[DailyActivity]:
+    """Rows for start <= day <= end, in day order."""
+    result = await db.execute(
+        select(DailyActivity)
+        .where(DailyActivity.user_id == user_id, DailyActivity.day >= start, DailyActivity.day <= end)
+        .order_by(DailyActivity.day)
+    )
+    return list(result.scalars().all())
+
+
+async def rebuild_daily_activity(db, user_id: int | None = None) -> int:
+    """Recompute rows from completions and XP events. Accepts a session or connection.
+
+    Returns the number of rows written. Caller commits.
+    """
+    step_day = func.date(StepProgress.completed_at)
+    slide_day = func.date(SlideProgress.completed_at)
+    xp_day = func.date(XpEvent.created_at)
+    sources = (
+        (("steps", "seconds"), select(
+            StepProgress.user_id, step_day, func.count(StepProgress.id),
+            func.coalesce(func.sum(StepProgress.time_spent_seconds), 0),
+        ).where(StepProgress.is_completed == True, StepProgress.completed_at.is_not(None))
+         .group_by(StepProgress.user_id, step_day)),
+        (("slides",), select(SlideProgress.user_id, slide_day, func.count(SlideProgress.id))
+         .where(SlideProgress.completed_at.is_not(None))
+         .group_by(SlideProgress.user_id, slide_day)),
+        (("xp",), select(XpEvent.user_id, xp_day, func.sum(XpEvent.amount))
+         .where(XpEvent.source != "admin")
+         .group_by(XpEvent.user_id, xp_day)),
+    )
+
+    rows: dict[tuple[int, date], dict] = {}
+    for names, query in sources:
+        if user_id is not None:
+            query = query.where(query.selected_columns[0] == user_id)
+        for uid, day, *amounts in (await db.execute(query)).all():
+            if day is None:
+                continue
+            day = day if isinstance(day, date) else date.fromisoformat(str(day)[:10])
+            row = rows.setdefault((uid, day), {"user_id": uid, "day": day, **dict.fromkeys(COUNTERS, 0)})
+            for name, amount in zip(names, amounts):
+                row[name] += amount or 0
+
+    clear = delete(DailyActivity)
+    if user_id is not None:
+        clear = clear.where(DailyActivity.user_id == user_id)
+    await db.execute(clear)
+    if rows:
+        await db.execute(insert(DailyActivity), list(rows.values()))
+    return len(rows)
@@ -32,19 +32,11 @@ async def get_db():
 async def init_db():
     # Import all models so they are registered with Base.metadata before create_all
     from app import models  # noqa: F401
-    from sqlalchemy import text
+    from app.migrations import run_migrations
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    # Run each migration in its own transaction so a failure (e.g. column already
-    # exists) cannot roll back the create_all above.
-    _migrations = [
-        "ALTER TABLE users ADD COLUMN hearts INTEGER DEFAULT 5",
-        "ALTER TABLE users ADD COLUMN last_heart_restore_at TIMESTAMP",
-        "ALTER TABLE streak_weeks ADD COLUMN frozen_days JSON",
-    ]
-    for sql in _migrations:
-        try:
-            async with engine.begin() as conn:
-                await conn.execute(text(sql))
-        except Exception:
-            pass  # column already exists
+    # Column additions and indexes for databases created by older releases
+    await run_migrations(engine)
+
+    from app.search import init_search_index
+    await init_search_index(engine)
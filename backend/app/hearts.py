@@ -1,59 +1,77 @@
-"""Heart system utilities."""
+"""Heart system utilities.
+
+Hearts restore lazily: the user row stores an anchor, `hearts` (the count
+at the anchor) and `last_heart_restore_at` (when the anchor was taken; None
+while full), and the current count and countdown are pure functions of it
+and the clock (`heart_state`). Reads never write. Only changes to the count
+(deducting, using a heart item, admin commands) call `set_hearts`, which
+re-anchors at the current count while keeping the countdown running.
+"""
 from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
 from app.models import User
 
 MAX_HEARTS = 5
 RESTORE_HOURS = 6  # 1 heart every 6 hours
+RESTORE_SECONDS = RESTORE_HOURS * 3600
 
 
-def sync_hearts(user: User) -> None:
-    """Auto-restore hearts based on time elapsed (1 per 6 hours, max 5).
-    Mutates user in place; caller must commit."""
-    current = user.hearts if user.hearts is not None else MAX_HEARTS
-
-    if current >= MAX_HEARTS:
-        user.hearts = MAX_HEARTS
-        user.last_heart_restore_at = None
-        return
-
-    if user.last_heart_restore_at is None:
-        # Hearts depleted but timer not set yet — start the timer, no restore yet
-        user.hearts = current
-        user.last_heart_restore_at = datetime.utcnow()
-        return
-
-    elapsed = datetime.utcnow() - user.last_heart_restore_at
-    restores = int(elapsed.total_seconds() // (RESTORE_HOURS * 3600))
-
-    if restores > 0:
-        new_hearts = min(MAX_HEARTS, current + restores)
-        user.hearts = new_hearts
-        if new_hearts >= MAX_HEARTS:
-            user.last_heart_restore_at = None
-        else:
-            # Advance timer by number of completed intervals
-            user.last_heart_restore_at = user.last_heart_restore_at + timedelta(hours=restores * RESTORE_HOURS)
-    else:
-        user.hearts = current
-
-
-def deduct_heart(user: User) -> bool:
-    """Deduct 1 heart after syncing. Returns True if a heart was deducted."""
-    sync_hearts(user)
-    if (user.hearts or 0) > 0:
-        user.hearts = (user.hearts or 0) - 1
-        if user.last_heart_restore_at is None:
-            user.last_heart_restore_at = datetime.utcnow()
-        return True
-    return False
+class HeartState(NamedTuple):
+    hearts: int
+    # None while full
+    seconds_until_restore: Optional[int]
+    # Start of the running restore interval (None while full)
+    interval_start: Optional[datetime]
+
+
+def heart_state(user: User, now: Optional[datetime] = None) -> HeartState:
+    """Current hearts and countdown derived from the stored anchor. Does not modify `user`."""
+    now = now or datetime.utcnow()
+    anchored = user.hearts if user.hearts is not None else MAX_HEARTS
+    if anchored >= MAX_HEARTS:
+        return HeartState(MAX_HEARTS, None, None)
+    anchor = user.last_heart_restore_at
+    if anchor is None:
+        # Below max without an anchor (rows written before anchors were kept): the timer starts now
+        return HeartState(anchored, RESTORE_SECONDS, now)
+
+    restores = max(0, int((now - anchor).total_seconds() // RESTORE_SECONDS))
+    hearts = min(MAX_HEARTS, anchored + restores)
+    if hearts >= MAX_HEARTS:
+        return HeartState(MAX_HEARTS, None, None)
+    interval_start = anchor + timedelta(seconds=restores * RESTORE_SECONDS)
+    remaining = RESTORE_SECONDS - (now - interval_start).total_seconds()
+    return HeartState(hearts, max(0, int(remaining)), interval_start)
+
 
+def current_hearts(user: User, now: Optional[datetime] = None) -> int:
+    return heart_state(user, now).hearts
 
-def seconds_until_next_heart(user: User) -> int | None:
+
+def seconds_until_next_heart(user: User, now: Optional[datetime] = None) -> int | None:
     """Return seconds until next heart restore, or None if already full."""
-    if (user.hearts or 0) >= MAX_HEARTS:
-        return None
-    if user.last_heart_restore_at is None:
-        return RESTORE_HOURS * 3600
-    elapsed = (datetime.utcnow() - user.last_heart_restore_at).total_seconds()
-    remaining = (RESTORE_HOURS * 3600) - (elapsed % (RESTORE_HOURS * 3600))
-    return max(0, int(remaining))
+    return heart_state(user, now).seconds_until_restore
+
+
+def set_hearts(user: User, hearts: int, now: Optional[datetime] = None) -> int:
+    """Re-anchor the user at `hearts` (clamped to 0..MAX_HEARTS). Caller commits.
+
+    A restore interval already running keeps counting; one starts now if the
+    user was full.
+    """
+    now = now or datetime.utcnow()
+    state = heart_state(user, now)
+    hearts = min(MAX_HEARTS, max(0, hearts))
+    user.hearts = hearts
+    user.last_heart_restore_at = None if hearts >= MAX_HEARTS else (state.interval_start or now)
+    return hearts
+
+
+def deduct_heart(user: User, now: Optional[datetime] = None) -> bool:
+    """Deduct 1 heart. Returns True if a heart was deducted."""
+    hearts = current_hearts(user, now)
+    if hearts > 0:
+        set_hearts(user, hearts - 1, now)
+        return True
+    return False
@@ -0,0 +1,54 @@
+"""Conditional-request helpers (ETag / If-None-Match) for content endpoints."""
+import hashlib
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag. A single part is used as-is; several are hashed together."""
+    if len(parts) == 1:
+        return f'"{parts[0]}"'
+    joined = "|".join(str(p) for p in parts)
+    return f'"{hashlib.sha256(joined.encode("utf-8")).hexdigest()}"'
+
+
+# ETag suffix of each content coding: a strong validator must differ between
+# byte-different representations of the same content
+CODING_SUFFIXES = {"gzip": "-gz", "br": "-br"}
+
+
+def coding_etag(etag: str, coding: str | None) -> str:
+    """The ETag of `etag`'s content served with Content-Encoding `coding` (None: identity)."""
+    if coding is None:
+        return etag
+    return f'{etag[:-1]}{CODING_SUFFIXES[coding]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header matches `etag` (or is `*`)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        # If-None-Match uses weak comparison, so W/"x" matches "x"
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def set_cache_headers(response: Response, etag: str, cache_control: str, vary: str | None = None) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    if vary:
+        response.headers["Vary"] = vary
+
+
+def not_modified(etag: str, cache_control: str, vary: str | None = None) -> Response:
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, cache_control, vary)
+    return response
@@ -0,0 +1,279 @@
+"""In-process leaderboard rank index.
+
+Users are kept in leaderboard order — key `(-xp, id)` — in bucketed sorted
+lists, with a Fenwick tree over bucket sizes so that "rank of user", "users
+with more XP than x" and "entries starting at position p" are all O(log n).
+Updates (an XP change) touch one or two buckets.
+
+The index is built from SQL on first use. Routers report XP changes with
+`rank_index.record(user)` after committing. Every
+`leaderboard_verify_seconds` it is re-checked against SQL and rebuilt if it
+drifted (e.g. XP changed by another worker or a script).
+
+XP changes go through `award_xp`, which also appends to the `xp_events`
+ledger. A background task (`run_snapshot_loop`) periodically materializes
+ranked snapshots of the all-time board and of the current week's XP gained
+(summed from that ledger) into `leaderboard_snapshots`/`leaderboard_entries`.
+"""
+import asyncio
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import async_session
+from app.models import User, XpEvent, LeaderboardSnapshot, LeaderboardSnapshotEntry
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bucket size; buckets split at twice this
+LOAD = 256
+
+
+class RankIndex:
+    def __init__(self):
+        self._xp: dict[int, int] = {}
+        self._buckets: list[list[tuple[int, int]]] = []
+        self._maxes: list[tuple[int, int]] = []
+        self._tree: list[int] = [0]
+        self.built = False
+        self.last_verified = 0.0
+
+    def __len__(self) -> int:
+        return len(self._xp)
+
+    # ── Fenwick tree over bucket sizes ──────────────────────────────────
+    def _rebuild_tree(self) -> None:
+        n = len(self._buckets)
+        tree = [0] * (n + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, i: int, delta: int) -> None:
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _before_bucket(self, i: int) -> int:
+        """Number of keys in buckets[:i]."""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _seek(self, pos: int) -> tuple[int, int]:
+        """(bucket, offset) of the 0-based position `pos` in leaderboard order."""
+        i = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = i + step
+            if nxt < len(self._tree) and self._tree[nxt] <= pos:
+                i = nxt
+                pos -= self._tree[nxt]
+            step >>= 1
+        return i, pos
+
+    def _position(self, key: tuple[int, int]) -> int:
+        """Number of keys strictly before `key`."""
+        b = bisect_left(self._maxes, key)
+        if b == len(self._buckets):
+            return len(self._xp)
+        return self._before_bucket(b) + bisect_left(self._buckets[b], key)
+
+    # ── Mutation ────────────────────────────────────────────────────────
+    def _insert(self, key: tuple[int, int]) -> None:
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        b = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[b]
+        insort(bucket, key)
+        self._maxes[b] = bucket[-1]
+        if len(bucket) > 2 * LOAD:
+            self._buckets[b:b + 1] = [bucket[:LOAD], bucket[LOAD:]]
+            self._maxes[b:b + 1] = [bucket[LOAD - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(b, 1)
+
+    def _remove(self, key: tuple[int, int]) -> None:
+        b = bisect_left(self._maxes, key)
+        bucket = self._buckets[b]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[b] = bucket[-1]
+            self._tree_add(b, -1)
+        else:
+            del self._buckets[b]
+            del self._maxes[b]
+            self._rebuild_tree()
+
+    def load(self, rows) -> None:
+        """Replace the contents with `(user_id, xp)` rows."""
+        self._xp = {uid: xp or 0 for uid, xp in rows}
+        keys = sorted((-xp, uid) for uid, xp in self._xp.items())
+        self._buckets = [keys[i:i + LOAD] for i in range(0, len(keys), LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._rebuild_tree()
+        self.built = True
+
+    def set_xp(self, user_id: int, xp: int | None) -> None:
+        xp = xp or 0
+        old = self._xp.get(user_id)
+        if old == xp:
+            return
+        if old is not None:
+            self._remove((-old, user_id))
+        self._xp[user_id] = xp
+        self._insert((-xp, user_id))
+
+    def record(self, user: User) -> None:
+        """Report a committed XP change (or a new user). No-op until the index is built."""
+        if self.built:
+            self.set_xp(user.id, user.xp)
+
+    # ── Queries ─────────────────────────────────────────────────────────
+    def count_above(self, xp: int) -> int:
+        """Users with strictly more XP."""
+        return self._position((-(xp or 0), -1))
+
+    def position(self, user_id: int) -> int | None:
+        """0-based leaderboard position (ties broken by user id)."""
+        xp = self._xp.get(user_id)
+        return None if xp is None else self._position((-xp, user_id))
+
+    def position_after(self, xp: int, user_id: int) -> int:
+        """Position of the first entry after the cursor key (xp, user_id)."""
+        b = bisect_right(self._maxes, (-xp, user_id))
+        if b == len(self._buckets):
+            return len(self._xp)
+        return self._before_bucket(b) + bisect_right(self._buckets[b], (-xp, user_id))
+
+    def slice(self, start: int, limit: int) -> list[tuple[int, int]]:
+        """Up to `limit` (user_id, xp) entries from 0-based position `start`."""
+        if start >= len(self._xp) or limit <= 0:
+            return []
+        b, offset = self._seek(start)
+        out = []
+        while b < len(self._buckets) and len(out) < limit:
+            for neg_xp, uid in self._buckets[b][offset:offset + limit - len(out)]:
+                out.append((uid, -neg_xp))
+            b += 1
+            offset = 0
+        return out
+
+    # ── SQL sync ────────────────────────────────────────────────────────
+    async def ensure_fresh(self, db: AsyncSession) -> "RankIndex":
+        """Build on first use; periodically compare with SQL and rebuild on drift."""
+        now = time.monotonic()
+        if self.built and now - self.last_verified < settings.leaderboard_verify_seconds:
+            return self
+        result = await db.execute(select(User.id, User.xp))
+        rows = {uid: xp or 0 for uid, xp in result.all()}
+        if self.built and rows != self._xp:
+            drift = sum(1 for uid in rows.keys() | self._xp.keys() if rows.get(uid) != self._xp.get(uid))
+            logger.warning("Leaderboard index drifted from SQL (%s users); rebuilding", drift)
+        if not self.built or rows != self._xp:
+            self.load(rows.items())
+        self.last_verified = now
+        return self
+
+
+rank_index = RankIndex()
+
+
+BOARD_ALL_TIME = "all_time"
+BOARD_WEEKLY = "weekly"
+# Snapshots kept per (board, period); older ones are pruned
+SNAPSHOTS_KEPT = 2
+
+
+def award_xp(db: AsyncSession, user: User, amount: int, source: str) -> None:
+    """Change a user's XP and record the event. Caller commits, then calls `rank_index.record`."""
+    if not amount:
+        return
+    user.xp = (user.xp or 0) + amount
+    db.add(XpEvent(user_id=user.id, amount=amount, source=source, created_at=datetime.utcnow()))
+
+
+def week_period(now: datetime | None = None) -> str:
+    """UTC Monday of the week containing `now`, as YYYY-MM-DD."""
+    today = (now or datetime.utcnow()).date()
+    return (today - timedelta(days=today.weekday())).isoformat()
+
+
+async def take_snapshot(db: AsyncSession, board: str, period: str = "") -> LeaderboardSnapshot:
+    """Rank every user for `board` and store it as a new snapshot. Commits."""
+    if board == BOARD_WEEKLY:
+        period = period or week_period()
+        week_start = datetime.fromisoformat(period)
+        gained = func.sum(XpEvent.amount).label("gained")
+        query = (
+            select(XpEvent.user_id, gained)
+            .where(XpEvent.created_at >= week_start, XpEvent.created_at < week_start + timedelta(days=7))
+            .group_by(XpEvent.user_id)
+            .having(gained > 0)
+            .order_by(gained.desc(), XpEvent.user_id)
+        )
+    else:
+        period = ""
+        query = select(User.id, func.coalesce(User.xp, 0)).order_by(User.xp.desc(), User.id)
+    rows = (await db.execute(query)).all()
+
+    snapshot = LeaderboardSnapshot(board=board, period=period, entry_count=len(rows), taken_at=datetime.utcnow())
+    db.add(snapshot)
+    await db.flush()
+    if rows:
+        await db.execute(insert(LeaderboardSnapshotEntry), [
+            {"snapshot_id": snapshot.id, "rank": rank, "user_id": uid, "xp": xp or 0}
+            for rank, (uid, xp) in enumerate(rows, 1)
+        ])
+
+    stale = (await db.execute(
+        select(LeaderboardSnapshot.id)
+        .where(LeaderboardSnapshot.board == board, LeaderboardSnapshot.period == period)
+        .order_by(LeaderboardSnapshot.id.desc())
+        .offset(SNAPSHOTS_KEPT)
+    )).scalars().all()
+    if stale:
+        await db.execute(delete(LeaderboardSnapshotEntry).where(LeaderboardSnapshotEntry.snapshot_id.in_(stale)))
+        await db.execute(delete(LeaderboardSnapshot).where(LeaderboardSnapshot.id.in_(stale)))
+    await db.commit()
+    return snapshot
+
+
+async def latest_snapshot(db: AsyncSession, board: str, period: str = "") -> LeaderboardSnapshot | None:
+    """Newest snapshot for the board/period; None until `run_snapshot_loop` has taken one."""
+    if board == BOARD_WEEKLY:
+        period = period or week_period()
+    result = await db.execute(
+        select(LeaderboardSnapshot)
+        .where(LeaderboardSnapshot.board == board, LeaderboardSnapshot.period == period)
+        .order_by(LeaderboardSnapshot.id.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def run_snapshot_loop() -> None:
+    """Background task: refresh both boards every `leaderboard_snapshot_seconds`."""
+    while True:
+        try:
+            async with async_session() as db:
+                await take_snapshot(db, BOARD_ALL_TIME)
+                await take_snapshot(db, BOARD_WEEKLY)
+        except Exception:
+            logger.exception("Leaderboard snapshot failed")
+        await asyncio.sleep(settings.leaderboard_snapshot_seconds)
@@ -0,0 +1,138 @@
+"""Per-request learning state of the current user.
+
+Endpoints that touch a user's progress keep needing the same user-scoped
+rows: enrollments, inventory (by item type), the activity calendar and the
+quests of the current periods. `LearningContext` (FastAPI dependency
+`get_learning_context`) holds them for the rest of the request once loaded,
+so a request never re-selects them: an endpoint declares the parts it needs
+up front with `load` (one SELECT per part, back to back), and any part it
+did not declare is loaded by its accessor on first use. Handlers and
+pipeline stages mutate the loaded rows in place; `flush` writes everything
+(including the calendar) at once, and the handler's commit persists it.
+"""
+from datetime import date
+from typing import Callable, Optional
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth import get_current_user
+from app.database import get_db
+from app.models import User, Enrollment, ShopItem, UserInventory, UserQuest
+from app.quest_assignment import current_periods, LIFETIME_PERIOD
+from app.streaks import ActivityCalendar, load_calendar
+
+ENROLLMENTS = "enrollments"
+INVENTORY = "inventory"
+CALENDAR = "calendar"
+QUESTS = "quests"
+
+
+class LearningContext:
+    def __init__(self, db: AsyncSession, user: User):
+        self.db = db
+        self.user = user
+        self._enrollments: Optional[dict[int, Enrollment]] = None
+        self._inventory: Optional[dict[str, list[UserInventory]]] = None
+        self._calendar: Optional[ActivityCalendar] = None
+        self._quests: dict[date, list[UserQuest]] = {}
+
+    async def load(self, *parts: str, today: Optional[date] = None) -> "LearningContext":
+        """Load the declared parts not loaded yet. QUESTS needs the user-local `today`."""
+        for part in parts:
+            if part == ENROLLMENTS:
+                await self.enrollments()
+            elif part == INVENTORY:
+                await self.inventory()
+            elif part == CALENDAR:
+                await self.calendar()
+            elif part == QUESTS:
+                await self.active_quests(today)
+            else:
+                raise ValueError(f"Unknown learning context part: {part}")
+        return self
+
+    async def enrollments(self) -> dict[int, Enrollment]:
+        """{story_id: Enrollment}."""
+        if self._enrollments is None:
+            result = await self.db.execute(select(Enrollment).where(Enrollment.user_id == self.user.id))
+            self._enrollments = {e.story_id: e for e in result.scalars().all()}
+        return self._enrollments
+
+    async def is_enrolled(self, story_id: int) -> bool:
+        return story_id in await self.enrollments()
+
+    async def inventory(self) -> dict[str, list[UserInventory]]:
+        """{item_type: [UserInventory, ...]}, including empty and inactive-item rows."""
+        if self._inventory is None:
+            result = await self.db.execute(
+                select(UserInventory, ShopItem.item_type)
+                .join(ShopItem, ShopItem.id == UserInventory.item_id)
+                .where(UserInventory.user_id == self.user.id)
+                .order_by(UserInventory.id)
+            )
+            self._inventory = {}
+            for inv, item_type in result.all():
+                self._inventory.setdefault(item_type, []).append(inv)
+        return self._inventory
+
+    async def inventory_item(
+        self, item_type: str, where: Optional[Callable[[UserInventory], bool]] = None
+    ) -> Optional[UserInventory]:
+        """First row of `item_type` with quantity left (and matching `where`)."""
+        for inv in (await self.inventory()).get(item_type, ()):
+            if (inv.quantity or 0) > 0 and (where is None or where(inv)):
+                return inv
+        return None
+
+    async def add_item(self, item_type: str, item_id: int, quantity: int = 1, pooled: bool = False) -> UserInventory:
+        """Stack `quantity` onto the row of `item_id` (any row of the type if `pooled`), or add one."""
+        rows = (await self.inventory()).setdefault(item_type, [])
+        inv = next((r for r in rows if pooled or r.item_id == item_id), None)
+        if inv is not None:
+            inv.quantity += quantity
+            return inv
+        inv = UserInventory(user_id=self.user.id, item_id=item_id, quantity=quantity, is_active=True)
+        self.db.add(inv)
+        rows.append(inv)
+        return inv
+
+    async def consume_item(self, inv: UserInventory) -> None:
+        """Use one of `inv`; the row is deleted with its last unit."""
+        if inv.quantity > 1:
+            inv.quantity -= 1
+            return
+        for rows in (await self.inventory()).values():
+            if inv in rows:
+                rows.remove(inv)
+        await self.db.delete(inv)
+
+    async def calendar(self) -> ActivityCalendar:
+        if self._calendar is None:
+            self._calendar = await load_calendar(self.db, self.user.id)
+        return self._calendar
+
+    async def active_quests(self, today: date) -> list[UserQuest]:
+        """Quests of the periods containing `today` (user-local) and lifetime quests."""
+        if today not in self._quests:
+            periods = [*current_periods(today).values(), LIFETIME_PERIOD]
+            result = await self.db.execute(
+                select(UserQuest).where(UserQuest.user_id == self.user.id, UserQuest.period_key.in_(periods))
+            )
+            self._quests[today] = list(result.scalars().all())
+        return self._quests[today]
+
+    async def flush(self) -> None:
+        """Write pending changes of the loaded rows. Caller commits."""
+        if self._calendar is not None:
+            self._calendar.save(self.db)
+        await self.db.flush()
+
+
+async def get_learning_context(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> LearningContext:
+    """FastAPI dependency: the request's LearningContext (shares the request's session and user)."""
+    return LearningContext(db, current_user)
@@ -7,7 +7,17 @@ import runpy
 import asyncio
 from app.config import settings
 from app.database import init_db
-from app.routers import auth_router, stories_router, steps_router, progress_router, categories_router, shop_router, quests_router, admin_router, auth
+from app.catalog import refresh_catalog, bump_content_version
+from app.registry import refresh_registry, REFERENCE_VERSION_KEY
+from app.leaderboard import run_snapshot_loop
+from app.quest_assignment import run_quest_schedule_loop
+from app.slide_cache import slide_cache
+from app.content_stats import (
+    materialize_story_stats, materialize_all_story_stats, store_story_slides, store_all_story_slides
+)
+from app.search import index_story, index_all_stories, rebuild_search_index
+from app.story_progress import rebuild_story_progress
+from app.routers import auth_router, stories_router, steps_router, progress_router, categories_router, chapters_router, shop_router, quests_router, admin_router, search_router, auth
 
 # Reduce noisy Uvicorn logs and show only SQL logs
 import logging
@@ -32,8 +42,21 @@ async def lifespan(app: FastAPI):
     await seed_achievements()
     await seed_shop_items()
     await seed_quests()
+    catalog = await refresh_catalog()
+    slide_cache.warm(catalog)
+    await refresh_registry()
+    snapshot_task = None
+    if settings.leaderboard_snapshot_seconds > 0:
+        snapshot_task = asyncio.create_task(run_snapshot_loop())
+    quest_task = None
+    if settings.quest_schedule_seconds > 0:
+        quest_task = asyncio.create_task(run_quest_schedule_loop())
     yield
     # Shutdown
+    if snapshot_task:
+        snapshot_task.cancel()
+    if quest_task:
+        quest_task.cancel()
 
 app = FastAPI(
     title=settings.app_name,
@@ -47,6 +70,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Routers
@@ -55,9 +79,11 @@ app.include_router(stories_router, prefix="/api/v1")
 app.include_router(steps_router, prefix="/api/v1")
 app.include_router(progress_router, prefix="/api/v1")
 app.include_router(categories_router, prefix="/api/v1")
+app.include_router(chapters_router, prefix="/api/v1")
 app.include_router(shop_router, prefix="/api/v1")
 app.include_router(quests_router, prefix="/api/v1")
 app.include_router(admin_router, prefix="/api/v1")
+app.include_router(search_router, prefix="/api/v1")
 app.include_router(auth.router, prefix="/api/v1")
 
 @app.get("/")
@@ -177,6 +203,9 @@ async def seed_from_json():
                 categories_map[cat["slug"]] = category
                 logger.debug(f"  ✅ Category: {cat['name']}")
         
+        # Tracks whether story content changed so cached catalogs get reloaded
+        content_changed = False
+
         # 2. Load courses from folder-based structure (both courses/ and raw_courses/)
         course_source_dirs = [DATA_DIR / "courses", DATA_DIR / "raw_courses"]
         seen_slugs = set()
@@ -241,6 +270,10 @@ async def seed_from_json():
                         existing_story.illustration = course_data.get("illustration")
                         updated = True
                     if updated:
+                        # The media fields are part of the story's content hash (its ETag);
+                        # clearing it makes the only_missing pass below recompute it
+                        existing_story.content_hash = None
+                        content_changed = True
                         logger.debug(f"  ↺ Updated media for course: {course_data['slug']}")
                     else:
                         logger.debug(f"  ↺ Course exists: {course_data['slug']}")
@@ -263,6 +296,7 @@ async def seed_from_json():
                 )
                 db.add(story)
                 await db.flush()
+                content_changed = True
                 logger.debug(f"📚 Course: {course_data['title']}")
 
                 # Create chapters
@@ -297,7 +331,28 @@ async def seed_from_json():
                                 blocks=slide_data.get("blocks", [])
                             )
                             db.add(slide)
-        
+
+                await db.flush()
+                await store_story_slides(db, story.id)
+                await materialize_story_stats(db, story.id)
+                await index_story(db, story.id)
+
+        # Convert slides stored before a SLIDE_COMPRESSION change
+        await store_all_story_slides(db)
+
+        # Backfill aggregates for stories seeded before story_stats existed
+        if await materialize_all_story_stats(db, only_missing=True):
+            content_changed = True
+
+        # Index stories seeded before search existed
+        if await index_all_stories(db, only_missing=True):
+            content_changed = True
+
+        if content_changed:
+            await rebuild_search_index(db)
+            # Step totals changed: recount per-user story progress
+            await rebuild_story_progress(db)
+            await bump_content_version(db)
         await db.commit()
         logger.debug("✅ Data seeded from JSON files!")
 
@@ -322,6 +377,7 @@ async def seed_achievements():
             achievement = Achievement(**ach_data)
             db.add(achievement)
         
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
         await db.commit()
         logger.debug("✅ Achievements seeded!")
 
@@ -379,6 +435,7 @@ async def seed_shop_items():
         for item_data in items:
             db.add(ShopItem(**item_data))
 
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
         await db.commit()
         logger.debug("✅ Shop items seeded!")
 
@@ -417,5 +474,6 @@ async def seed_quests():
             )
             db.add(quest)
 
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
         await db.commit()
         logger.debug("✅ Quests seeded!")
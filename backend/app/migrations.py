@@ -0,0 +1,241 @@
+"""Versioned schema migrations.
+
+`Base.metadata.create_all` builds missing tables from the models but never
+touches existing ones, so column additions and new indexes for databases
+created by an older release are listed here as numbered migrations. Each
+runs once, in its own transaction, and is recorded in `schema_migrations`
+together with how long it took. A failing migration aborts startup instead
+of being ignored.
+
+Operations are idempotent (columns are checked before `ADD COLUMN`, indexes
+use `IF NOT EXISTS`) because a fresh database already has everything
+`create_all` knows about, and older databases may have had some of the
+early statements applied by the previous ad-hoc migration list. Indexes
+declared on the models use the same names so both paths agree.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from sqlalchemy import inspect, select, insert, update, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.models import SchemaMigration, User, Quest, UserQuest
+import logging
+
+logger = logging.getLogger(__name__)
+
+Operation = Callable[[AsyncConnection], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    operations: tuple[Operation, ...]
+
+
+def _binary_type(conn: AsyncConnection) -> str:
+    return "BYTEA" if conn.dialect.name == "postgresql" else "BLOB"
+
+
+async def _columns(conn: AsyncConnection, table: str) -> set[str]:
+    return await conn.run_sync(lambda sync_conn: {c["name"] for c in inspect(sync_conn).get_columns(table)})
+
+
+def add_column(table: str, column: str, ddl: str | Callable[[AsyncConnection], str]) -> Operation:
+    """`ALTER TABLE ... ADD COLUMN` unless the column is already there."""
+    async def op(conn: AsyncConnection) -> None:
+        if column in await _columns(conn, table):
+            return
+        column_ddl = ddl(conn) if callable(ddl) else ddl
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_ddl}"))
+    return op
+
+
+def create_index(
+    name: str, table: str, columns: str, unique: bool = False, keep: str = "id", sum_columns: tuple[str, ...] = ()
+) -> Operation:
+    """`CREATE [UNIQUE] INDEX IF NOT EXISTS`.
+
+    Before a unique index is created, duplicate rows are removed, keeping the
+    first row of each group in `keep` order. `sum_columns` (counts such as a
+    quantity) are first set on that row to the total of its group, so the
+    duplicates are merged rather than lost.
+    """
+    async def op(conn: AsyncConnection) -> None:
+        if unique and sum_columns:
+            same_group = " AND ".join(f"d.{c} = {table}.{c}" for c in (c.strip() for c in columns.split(",")))
+            totals = ", ".join(
+                f"{c} = (SELECT SUM(d.{c}) FROM {table} d WHERE {same_group})" for c in sum_columns
+            )
+            await conn.execute(text(
+                f"UPDATE {table} SET {totals} WHERE id IN ("
+                f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY {columns} ORDER BY {keep}) AS rn, "
+                f"COUNT(*) OVER (PARTITION BY {columns}) AS n FROM {table}) ranked WHERE rn = 1 AND n > 1)"
+            ))
+        if unique:
+            result = await conn.execute(text(
+                f"DELETE FROM {table} WHERE id IN ("
+                f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY {columns} ORDER BY {keep}) AS rn "
+                f"FROM {table}) ranked WHERE rn > 1)"
+            ))
+            if result.rowcount:
+                logger.warning("%s %s duplicate rows from %s before creating %s",
+                               "Merged" if sum_columns else "Removed", result.rowcount, table, name)
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        await conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns})"))
+    return op
+
+
+def drop_index(name: str) -> Operation:
+    """`DROP INDEX IF EXISTS` (superseded indexes)."""
+    async def op(conn: AsyncConnection) -> None:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return op
+
+
+async def backfill_story_progress(conn: AsyncConnection) -> None:
+    from app.story_progress import rebuild_story_progress
+    await rebuild_story_progress(conn)
+
+
+async def backfill_streak_calendars(conn: AsyncConnection) -> None:
+    from app.streaks import rebuild_streak_calendars
+    await rebuild_streak_calendars(conn)
+
+
+async def backfill_daily_activity(conn: AsyncConnection) -> None:
+    from app.daily_activity import rebuild_daily_activity
+    await rebuild_daily_activity(conn)
+
+
+async def backfill_quest_periods(conn: AsyncConnection) -> None:
+    """Derive period_key of existing user quests from their (UTC) assigned_at."""
+    from app.quest_assignment import period_key
+    rows = (await conn.execute(
+        select(UserQuest.id, Quest.quest_type, UserQuest.assigned_at)
+        .join(Quest, Quest.id == UserQuest.quest_id)
+        .where(UserQuest.period_key.is_(None))
+    )).all()
+    params = [
+        {"uq_id": uq_id, "key": period_key(quest_type, (assigned_at or datetime.utcnow()).date())}
+        for uq_id, quest_type, assigned_at in rows
+    ]
+    if params:
+        await conn.execute(
+            update(UserQuest.__table__)
+            .where(UserQuest.__table__.c.id == bindparam("uq_id"))
+            .values(period_key=bindparam("key")),
+            params,
+        )
+
+
+
+async def backfill_heart_anchors(conn: AsyncConnection) -> None:
+    """Start the restore timer of users below max hearts that have none (hearts are computed from it)."""
+    from app.hearts import MAX_HEARTS
+    await conn.execute(
+        update(User.__table__)
+        .where(User.__table__.c.hearts < MAX_HEARTS, User.__table__.c.last_heart_restore_at.is_(None))
+        .values(last_heart_restore_at=datetime.utcnow())
+    )
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "user hearts", (
+        add_column("users", "hearts", "INTEGER DEFAULT 5"),
+        add_column("users", "last_heart_restore_at", "TIMESTAMP"),
+    )),
+    Migration(2, "streak freeze days", (
+        add_column("streak_weeks", "frozen_days", "JSON"),
+    )),
+    Migration(3, "content hashes", (
+        add_column("stories", "content_hash", "VARCHAR(64)"),
+        add_column("steps", "content_hash", "VARCHAR(64)"),
+    )),
+    Migration(4, "compressed slide blocks", (
+        add_column("slides", "blocks_z", _binary_type),
+        add_column("slides", "dictionary_id", "INTEGER REFERENCES slide_dictionaries(id)"),
+    )),
+    Migration(5, "leaderboard and story ordering indexes", (
+        create_index("ix_users_xp_id", "users", "xp DESC, id"),
+        create_index("ix_stories_order_index_id", "stories", "order_index, id"),
+    )),
+    Migration(6, "progress, streak, quest and inventory indexes", (
+        create_index("uq_step_progress_user_step", "step_progress", "user_id, step_id",
+                     unique=True, keep="is_completed DESC, id"),
+        create_index("ix_step_progress_user_completed", "step_progress", "user_id, is_completed, completed_at"),
+        create_index("uq_slide_progress_user_slide", "slide_progress", "user_id, slide_id", unique=True),
+        create_index("uq_streak_weeks_user_week", "streak_weeks", "user_id, week_start", unique=True),
+        create_index("ix_user_quests_user_claimed", "user_quests", "user_id, coins_claimed"),
+        create_index("uq_user_inventory_user_item", "user_inventory", "user_id, item_id", unique=True,
+                     sum_columns=("quantity",)),
+    )),
+    Migration(7, "backfill user_story_progress", (
+        backfill_story_progress,
+    )),
+    Migration(8, "unique user achievements", (
+        create_index("uq_user_achievements_user_achievement", "user_achievements", "user_id, achievement_id",
+                     unique=True),
+    )),
+    Migration(9, "build streak calendars from streak weeks", (
+        backfill_streak_calendars,
+    )),
+    Migration(10, "backfill daily_activity", (
+        backfill_daily_activity,
+    )),
+    Migration(11, "current-period user quest index", (
+        create_index("ix_user_quests_user_claimed_assigned", "user_quests", "user_id, coins_claimed, assigned_at"),
+        drop_index("ix_user_quests_user_claimed"),
+    )),
+    Migration(12, "quest periods and user timezone", (
+        add_column("users", "tz_offset_minutes", "INTEGER"),
+        add_column("user_quests", "period_key", "VARCHAR(12)"),
+        backfill_quest_periods,
+        create_index("uq_user_quests_user_period_quest", "user_quests", "user_id, period_key, quest_id",
+                     unique=True, keep="coins_claimed DESC, is_complete DESC, progress DESC, id"),
+    )),
+    Migration(13, "anchor heart restore timers", (
+        backfill_heart_anchors,
+    )),
+    # Quests are read by period since 12
+    Migration(14, "drop the assigned_at user quest index", (
+        drop_index("ix_user_quests_user_claimed_assigned"),
+    )),
+    # GET /stories pages the in-memory catalog, not the stories table
+    Migration(15, "drop the story ordering index", (
+        drop_index("ix_stories_order_index_id"),
+    )),
+)
+
+
+async def run_migrations(engine: AsyncEngine) -> list[tuple[int, str, float]]:
+    """Apply pending migrations in order. Returns `(version, name, ms)` for each one applied."""
+    async with engine.begin() as conn:
+        await conn.run_sync(SchemaMigration.__table__.create, checkfirst=True)
+        applied = set((await conn.execute(select(SchemaMigration.version))).scalars().all())
+
+    done = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        started = time.perf_counter()
+        try:
+            async with engine.begin() as conn:
+                for operation in migration.operations:
+                    await operation(conn)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                await conn.execute(insert(SchemaMigration).values(
+                    version=migration.version,
+                    name=migration.name,
+                    applied_at=datetime.utcnow(),
+                    duration_ms=round(elapsed_ms, 1),
+                ))
+        except Exception:
+            logger.exception("Migration %s (%s) failed", migration.version, migration.name)
+            raise
+        logger.info("Applied migration %s (%s) in %.1f ms", migration.version, migration.name, elapsed_ms)
+        done.append((migration.version, migration.name, elapsed_ms))
+    return done
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, Text, JSON, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
+from app.slide_codec import decompress_blocks
 
 class User(Base):
     __tablename__ = "users"
@@ -22,6 +23,7 @@ class User(Base):
     current_streak = Column(Integer, default=0)
     longest_streak = Column(Integer, default=0)
     last_activity_date = Column(DateTime)
+    tz_offset_minutes = Column(Integer, nullable=True)  # last X-User-TZ-Offset seen (app.streaks.remember_tz_offset)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -30,6 +32,58 @@ class User(Base):
     progress = relationship("StepProgress", back_populates="user")
     achievements = relationship("UserAchievement", back_populates="user")
 
+    @property
+    def current_hearts(self) -> int:
+        """Hearts including restores since the stored anchor (see app.hearts)."""
+        from app.hearts import current_hearts
+        return current_hearts(self)
+
+    @property
+    def heart_restore_started_at(self):
+        """Start of the running heart restore interval, None while full."""
+        from app.hearts import heart_state
+        return heart_state(self).interval_start
+
+    # Leaderboard order / keyset cursor (xp DESC, id)
+    __table_args__ = (Index("ix_users_xp_id", xp.desc(), id),)
+
+
+class XpEvent(Base):
+    """Ledger of XP changes; weekly leaderboards sum these (see app.leaderboard)."""
+    __tablename__ = "xp_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount = Column(Integer, nullable=False)
+    source = Column(String(30))  # "step", "achievement", "admin"
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (Index("ix_xp_events_created_user", created_at, user_id),)
+
+
+class LeaderboardSnapshot(Base):
+    """A materialized, ranked leaderboard (all-time or one week's XP gained)."""
+    __tablename__ = "leaderboard_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    board = Column(String(20), nullable=False)  # "all_time" | "weekly"
+    period = Column(String(10), nullable=False, default="")  # week start (YYYY-MM-DD) for weekly
+    entry_count = Column(Integer, default=0)
+    taken_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (Index("ix_leaderboard_snapshots_board_period", board, period, id),)
+
+
+class LeaderboardSnapshotEntry(Base):
+    __tablename__ = "leaderboard_entries"
+
+    snapshot_id = Column(Integer, ForeignKey("leaderboard_snapshots.id"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    xp = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_leaderboard_entries_snapshot_user", snapshot_id, user_id),)
+
 
 class StreakWeek(Base):
     __tablename__ = "streak_weeks"
@@ -45,6 +99,52 @@ class StreakWeek(Base):
     # lightweight relationship
     user = relationship("User")
 
+    __table_args__ = (Index("uq_streak_weeks_user_week", user_id, week_start, unique=True),)
+
+
+class StreakCalendar(Base):
+    """One year of a user's activity as bitmaps: bit i is day i of the year (Jan 1 = bit 0).
+
+    Written by app.streaks; supersedes the 7-day lists of `StreakWeek`.
+    """
+    __tablename__ = "streak_calendars"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    active_days = Column(LargeBinary, nullable=False)  # 46-byte little-endian bitmap
+    frozen_days = Column(LargeBinary, nullable=False)  # days covered by a streak freeze
+
+
+class DailyActivity(Base):
+    """Per-user counters for one local day, upserted on each completion (see app.daily_activity)."""
+    __tablename__ = "daily_activity"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    steps = Column(Integer, default=0, nullable=False)
+    slides = Column(Integer, default=0, nullable=False)
+    xp = Column(Integer, default=0, nullable=False)
+    seconds = Column(Integer, default=0, nullable=False)
+
+
+class ContentVersion(Base):
+    """Version stamps bumped by sync/seed so running servers can reload cached content."""
+    __tablename__ = "content_versions"
+
+    key = Column(String(50), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class SchemaMigration(Base):
+    """Applied versions from `app.migrations`, with how long each took."""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Float, default=0)
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -73,6 +173,7 @@ class Story(Base):
     is_published = Column(Boolean, default=False)
     is_featured = Column(Boolean, default=False)
     order_index = Column(Integer, default=0)
+    content_hash = Column(String(64), nullable=True)  # set at sync time, used as ETag
     created_at = Column(DateTime, server_default=func.now())
     
     category = relationship("Category", back_populates="stories")
@@ -103,21 +204,88 @@ class Step(Base):
     xp_reward = Column(Integer, default=10)
     coin_reward = Column(Integer, default=5)
     order_index = Column(Integer, default=0)
+    content_hash = Column(String(64), nullable=True)  # hash of the slides payload, used as ETag
     
     chapter = relationship("Chapter", back_populates="steps")
     slides = relationship("Slide", back_populates="step", order_by="Slide.order_index")
     progress = relationship("StepProgress", back_populates="step")
 
 
+class SlideDictionary(Base):
+    """Per-story zlib preset dictionary for compressed slide blocks (see app.slide_codec)."""
+    __tablename__ = "slide_dictionaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False, index=True)
+    codec = Column(String(20), default="zlib")
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+
 class Slide(Base):
     __tablename__ = "slides"
     
     id = Column(Integer, primary_key=True, index=True)
     step_id = Column(Integer, ForeignKey("steps.id"), nullable=False)
     order_index = Column(Integer, default=0)
-    blocks = Column(JSON, default=list)
+    # Either plain JSON (`blocks` column) or a compressed blob + its dictionary
+    blocks_json = Column("blocks", JSON(none_as_null=True), default=list)
+    blocks_z = Column(LargeBinary, nullable=True)
+    dictionary_id = Column(Integer, ForeignKey("slide_dictionaries.id"), nullable=True)
     
     step = relationship("Step", back_populates="slides")
+    dictionary = relationship("SlideDictionary", lazy="selectin")
+
+    @property
+    def blocks(self) -> list:
+        """Decoded blocks regardless of storage mode."""
+        if self.blocks_z is not None:
+            return decompress_blocks(self.blocks_z, self.dictionary.data if self.dictionary else None)
+        return self.blocks_json
+
+    @blocks.setter
+    def blocks(self, value) -> None:
+        self.blocks_json = value
+        self.blocks_z = None
+        self.dictionary_id = None
+
+
+class StoryStats(Base):
+    """Content aggregates per story, materialized by sync/seed (see app.content_stats)."""
+    __tablename__ = "story_stats"
+
+    story_id = Column(Integer, ForeignKey("stories.id"), primary_key=True)
+    chapter_count = Column(Integer, default=0)
+    step_count = Column(Integer, default=0)
+    slide_count = Column(Integer, default=0)
+    quiz_count = Column(Integer, default=0)
+    interaction_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class ChapterStats(Base):
+    __tablename__ = "chapter_stats"
+
+    chapter_id = Column(Integer, ForeignKey("chapters.id"), primary_key=True)
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False, index=True)
+    step_count = Column(Integer, default=0)
+    slide_count = Column(Integer, default=0)
+    quiz_count = Column(Integer, default=0)
+    interaction_count = Column(Integer, default=0)
+
+
+class SearchDocument(Base):
+    """Denormalized, accent-folded text of a story or step for full-text search (see app.search)."""
+    __tablename__ = "search_documents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(10), nullable=False)  # "story" | "step"
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=False, index=True)
+    step_id = Column(Integer, ForeignKey("steps.id"), nullable=True, index=True)
+    title = Column(String(300))
+    body = Column(Text)
+    title_folded = Column(String(300))
+    body_folded = Column(Text)
 
 
 class Enrollment(Base):
@@ -132,6 +300,19 @@ class Enrollment(Base):
     story = relationship("Story", back_populates="enrollments")
 
 
+class UserStoryProgress(Base):
+    """Completed step count per (user, story), kept in step with StepProgress (see app.story_progress)."""
+    __tablename__ = "user_story_progress"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    story_id = Column(Integer, primary_key=True)  # rows are rebuilt after content syncs
+    completed_steps = Column(Integer, default=0, nullable=False)
+    total_steps = Column(Integer, default=0, nullable=False)
+    completed_at = Column(DateTime, nullable=True)  # set when completed_steps reaches total_steps
+
+    __table_args__ = (Index("ix_user_story_progress_user_completed", user_id, completed_at),)
+
+
 class StepProgress(Base):
     __tablename__ = "step_progress"
     
@@ -146,6 +327,11 @@ class StepProgress(Base):
     user = relationship("User", back_populates="progress")
     step = relationship("Step", back_populates="progress")
 
+    __table_args__ = (
+        Index("uq_step_progress_user_step", user_id, step_id, unique=True),
+        Index("ix_step_progress_user_completed", user_id, is_completed, completed_at),
+    )
+
 
 class SlideProgress(Base):
     __tablename__ = "slide_progress"
@@ -158,6 +344,8 @@ class SlideProgress(Base):
 
     # relationships kept minimal to avoid circular imports
 
+    __table_args__ = (Index("uq_slide_progress_user_slide", user_id, slide_id, unique=True),)
+
 
 class Achievement(Base):
     __tablename__ = "achievements"
@@ -187,6 +375,8 @@ class UserAchievement(Base):
     user = relationship("User", back_populates="achievements")
     achievement = relationship("Achievement", back_populates="user_achievements")
 
+    __table_args__ = (Index("uq_user_achievements_user_achievement", user_id, achievement_id, unique=True),)
+
 
 class ShopItem(Base):
     __tablename__ = "shop_items"
@@ -218,6 +408,8 @@ class UserInventory(Base):
     user = relationship("User")
     item = relationship("ShopItem", back_populates="inventory")
 
+    __table_args__ = (Index("uq_user_inventory_user_item", user_id, item_id, unique=True),)
+
 
 class Quest(Base):
     __tablename__ = "quests"
@@ -246,6 +438,22 @@ class UserQuest(Base):
     assigned_at = Column(DateTime, server_default=func.now())
     completed_at = Column(DateTime, nullable=True)
     coins_claimed = Column(Boolean, default=False)
+    period_key = Column(String(12), nullable=False)  # "D:<day>" / "W:<monday>" in the user's timezone (app.quest_assignment)
 
     user = relationship("User")
     quest = relationship("Quest", back_populates="user_quests")
+
+    __table_args__ = (Index("uq_user_quests_user_period_quest", user_id, period_key, quest_id, unique=True),)
+
+
+class QuestHistory(Base):
+    """Per-period aggregates of archived user quests (see app.quest_assignment.archive_quest_periods)."""
+    __tablename__ = "quest_history"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    period_key = Column(String(12), primary_key=True)
+    assigned = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    claimed = Column(Integer, default=0, nullable=False)
+    coins_claimed = Column(Integer, default=0, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
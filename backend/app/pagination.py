@@ -0,0 +1,29 @@
+"""Opaque keyset-pagination cursors.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and
+base64url'd so clients treat it as an opaque token. The next page starts
+strictly after that key, so it costs the same at any depth and does not shift
+when rows before it change.
+"""
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*key) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> tuple:
+    """Decode a cursor made by `encode_cursor` with `size` integer parts (400 if malformed)."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != size or not all(isinstance(k, int) for k in key):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key)
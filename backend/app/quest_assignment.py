@@ -0,0 +1,233 @@
+"""Daily/weekly quest assignment.
+
+Every `UserQuest` row carries the period it belongs to as a `period_key`:
+`D:<local day>` for daily quests and `W:<local Monday>` for weekly ones, in
+the user's timezone (the last `X-User-TZ-Offset` seen, stored on the user).
+A unique (user_id, period_key, quest_id) index makes assignment idempotent,
+and the quests a user gets for a period are drawn with a RNG seeded by
+(user, period), so every path that assigns the same period picks the same
+rows and concurrent inserts collapse into `ON CONFLICT DO NOTHING`.
+
+`run_quest_schedule_loop` pre-assigns the coming period ahead of local
+midnight: active users are bucketed by timezone offset, and each bucket
+whose midnight is less than `quest_preassign_minutes` away gets its rows in
+one bulk INSERT per period. `ensure_quests` (GET /quests) remains as the
+fallback for users the scheduler skipped (new or long-inactive users, or
+the job being disabled).
+
+Current-period reads select by (user_id, period_key IN (...)) on that index,
+so `user_quests` only has to hold live periods: once a day the same job
+runs `archive_quest_periods`, which folds every period that has ended in
+all timezones into one `quest_history` row per user and period (assigned,
+completed, claimed, coins) and deletes its quest rows.
+"""
+import asyncio
+import random
+from datetime import datetime, date, time, timedelta
+from typing import Optional
+
+from sqlalchemy import select, insert, delete, exists, and_, or_, case, func, literal, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import async_session
+from app.models import User, Quest, UserQuest, QuestHistory
+from app.registry import ReferenceData, QuestRef, get_registry
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Quests drawn per period
+QUESTS_PER_PERIOD = {"daily": 3, "weekly": 2}
+# Period key of quest types that don't reset (e.g. "milestone")
+LIFETIME_PERIOD = "*"
+
+
+def period_key(quest_type: str, day: date) -> str:
+    if quest_type == "daily":
+        return f"D:{day.isoformat()}"
+    if quest_type == "weekly":
+        return f"W:{(day - timedelta(days=day.weekday())).isoformat()}"
+    return LIFETIME_PERIOD
+
+
+def current_periods(today: date) -> dict[str, str]:
+    """{quest_type: period_key} of the assignable periods containing `today`."""
+    return {quest_type: period_key(quest_type, today) for quest_type in QUESTS_PER_PERIOD}
+
+
+def choose_quests(pool: tuple[QuestRef, ...], quest_type: str, seed: str) -> list[QuestRef]:
+    """Quests for one user and period, the same for the same seed."""
+    rng = random.Random(seed)
+    pool = sorted(pool, key=lambda q: q.id)
+    target = min(QUESTS_PER_PERIOD[quest_type], len(pool))
+    chosen = rng.sample(pool, target)
+    if quest_type == "daily":
+        # At least 2 distinct requirement_types
+        for _ in range(20):
+            if len({q.requirement_type for q in chosen}) >= min(2, target):
+                break
+            chosen = rng.sample(pool, target)
+    return chosen
+
+
+def _quest_rows(user_id: int, quest_type: str, key: str, registry: ReferenceData, now: datetime) -> list[dict]:
+    pool = registry.quest_pool.get(quest_type, ())
+    return [
+        {
+            "user_id": user_id,
+            "quest_id": quest.id,
+            "period_key": key,
+            "progress": 0,
+            "is_complete": False,
+            "assigned_at": now,
+            "coins_claimed": False,
+        }
+        for quest in choose_quests(pool, quest_type, f"{user_id}:{key}")
+    ] if pool else []
+
+
+async def _insert_quests(db: AsyncSession, rows: list[dict]) -> None:
+    """Bulk insert, skipping rows that already exist."""
+    if not rows:
+        return
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(UserQuest).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(UserQuest).on_conflict_do_nothing()
+    else:
+        stmt = insert(UserQuest)
+    await db.execute(stmt, rows)
+
+
+async def ensure_quests(db: AsyncSession, user_id: int, today: date) -> dict[str, str]:
+    """Assign the user's quests for the periods containing `today` if missing. Caller commits.
+
+    Returns the current {quest_type: period_key}.
+    """
+    periods = current_periods(today)
+    existing = set((await db.execute(
+        select(UserQuest.period_key).distinct().where(
+            UserQuest.user_id == user_id,
+            UserQuest.period_key.in_(list(periods.values())),
+        )
+    )).scalars().all())
+    missing = {quest_type: key for quest_type, key in periods.items() if key not in existing}
+    if missing:
+        registry = await get_registry(db)
+        now = datetime.utcnow()
+        rows = []
+        for quest_type, key in missing.items():
+            rows += _quest_rows(user_id, quest_type, key, registry, now)
+        await _insert_quests(db, rows)
+    return periods
+
+
+async def preassign_upcoming(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Assign the next day's (and before a Monday, the next week's) quests to active users
+    whose local midnight is less than `quest_preassign_minutes` away. Commits per bucket.
+
+    Returns the number of rows inserted.
+    """
+    now = now or datetime.utcnow()
+    registry = await get_registry(db)
+    active = and_(
+        User.is_active == True,
+        User.last_activity_date >= now - timedelta(days=settings.quest_active_user_days),
+    )
+    offsets = (await db.execute(select(User.tz_offset_minutes).distinct().where(active))).scalars().all()
+    lead = timedelta(minutes=settings.quest_preassign_minutes)
+
+    inserted = 0
+    for offset in offsets:
+        # Users without a known offset follow the server's local date (see app.streaks.local_today)
+        local_now = now + timedelta(minutes=offset) if offset is not None else datetime.now()
+        upcoming = local_now.date() + timedelta(days=1)
+        if datetime.combine(upcoming, time.min) - local_now > lead:
+            continue
+        periods = {"daily": period_key("daily", upcoming)}
+        if upcoming.weekday() == 0:
+            periods["weekly"] = period_key("weekly", upcoming)
+        in_bucket = User.tz_offset_minutes.is_(None) if offset is None else User.tz_offset_minutes == offset
+        for quest_type, key in periods.items():
+            pending = select(User.id).where(
+                active,
+                in_bucket,
+                ~exists().where(UserQuest.user_id == User.id, UserQuest.period_key == key),
+            )
+            rows = []
+            for user_id in (await db.execute(pending)).scalars().all():
+                rows += _quest_rows(user_id, quest_type, key, registry, now)
+            await _insert_quests(db, rows)
+            inserted += len(rows)
+        await db.commit()
+    return inserted
+
+
+async def archive_quest_periods(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Fold user quests of periods that have ended in every timezone into quest_history. Commits.
+
+    Returns the number of user_quests rows archived.
+    """
+    now = now or datetime.utcnow()
+    # UTC offsets span -12h..+14h, so a local day is over everywhere two UTC days later
+    last_day = now.date() - timedelta(days=2)
+    ended = or_(
+        and_(UserQuest.period_key >= "D:", UserQuest.period_key <= period_key("daily", last_day)),
+        and_(UserQuest.period_key >= "W:", UserQuest.period_key <= period_key("weekly", last_day - timedelta(days=6))),
+    )
+    summary = (
+        select(
+            UserQuest.user_id,
+            UserQuest.period_key,
+            func.count(UserQuest.id),
+            func.sum(case((UserQuest.is_complete == True, 1), else_=0)),
+            func.sum(case((UserQuest.coins_claimed == True, 1), else_=0)),
+            func.sum(case((UserQuest.coins_claimed == True, Quest.coin_reward), else_=0)),
+            literal(now, DateTime),
+        )
+        .join(Quest, Quest.id == UserQuest.quest_id)
+        .where(ended)
+        .group_by(UserQuest.user_id, UserQuest.period_key)
+    )
+    columns = ["user_id", "period_key", "assigned", "completed", "claimed", "coins_claimed", "archived_at"]
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(QuestHistory).from_select(columns, summary)
+        # A period archived before (rows that were still pending then) adds up
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[QuestHistory.user_id, QuestHistory.period_key],
+            set_={
+                name: getattr(QuestHistory, name) + getattr(stmt.excluded, name)
+                for name in ("assigned", "completed", "claimed", "coins_claimed")
+            } | {"archived_at": stmt.excluded.archived_at},
+        )
+    else:
+        stmt = insert(QuestHistory).from_select(columns, summary)
+    await db.execute(stmt)
+    result = await db.execute(delete(UserQuest).where(ended))
+    await db.commit()
+    return max(result.rowcount or 0, 0)
+
+
+async def run_quest_schedule_loop() -> None:
+    """Background task: pre-assign upcoming quests every `quest_schedule_seconds`,
+    and archive ended periods once per UTC day."""
+    archived_on = None
+    while True:
+        try:
+            async with async_session() as db:
+                inserted = await preassign_upcoming(db)
+                if inserted:
+                    logger.info("Pre-assigned %s user quests", inserted)
+                if archived_on != datetime.utcnow().date():
+                    archived = await archive_quest_periods(db)
+                    archived_on = datetime.utcnow().date()
+                    if archived:
+                        logger.info("Archived %s user quests into quest_history", archived)
+        except Exception:
+            logger.exception("Quest schedule run failed")
+        await asyncio.sleep(settings.quest_schedule_seconds)
@@ -0,0 +1,111 @@
+"""Batched quest progress.
+
+A request collects its quest events ("lessons", "study_time", ...) in a
+`QuestProgressBatch` and applies them together: one query loads only the
+user's unclaimed quests of the current day/week periods whose requirement
+type has an event (served by the (user_id, period_key, quest_id) index),
+every increment is applied in one pass over those rows, and the changes are
+flushed once.
+
+Event types: "lessons", "slides", "quizzes", "perfect_quiz", "streak",
+"study_time", "shop_buy", "chapter", "course".
+"""
+import math
+from datetime import datetime, date, timedelta
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import UserQuest
+from app.quest_assignment import current_periods, LIFETIME_PERIOD
+from app.registry import get_registry
+from app.streaks import load_calendar
+
+# Events whose amount is the current value rather than an increment
+ABSOLUTE_EVENTS = frozenset({"streak"})
+
+
+class QuestProgressBatch:
+    """Quest events of one request for one user, applied together by `apply`."""
+
+    def __init__(self, user_id: int, events: Optional[dict[str, int]] = None):
+        self.user_id = user_id
+        self.events: dict[str, int] = {}
+        for event_type, amount in (events or {}).items():
+            self.add(event_type, amount)
+
+    def add(self, event_type: str, amount: int = 1) -> "QuestProgressBatch":
+        if event_type in ABSOLUTE_EVENTS:
+            self.events[event_type] = max(self.events.get(event_type, 0), amount)
+        else:
+            self.events[event_type] = self.events.get(event_type, 0) + amount
+        return self
+
+    async def apply(
+        self,
+        db: AsyncSession,
+        today: date,
+        week_days: Optional[list[bool]] = None,
+        user_quests: Optional[list[UserQuest]] = None,
+    ) -> list[UserQuest]:
+        """Update matching quests of the periods containing `today` (user-local) and flush.
+        Returns the quests that were completed.
+
+        `week_days` (this week's active days, if the caller already has the
+        user's calendar) saves a query for weekly "streak" quests, and
+        `user_quests` (the current quests, e.g. from the request's
+        LearningContext) the quest query.
+        """
+        if not self.events:
+            return []
+        registry = await get_registry(db)
+        quest_ids = [q.id for q in registry.quests_by_id.values() if q.requirement_type in self.events]
+        if not quest_ids:
+            return []
+        if user_quests is None:
+            periods = [*current_periods(today).values(), LIFETIME_PERIOD]
+            result = await db.execute(
+                select(UserQuest).where(
+                    UserQuest.user_id == self.user_id,
+                    UserQuest.period_key.in_(periods),
+                    UserQuest.quest_id.in_(quest_ids),
+                    UserQuest.coins_claimed == False,
+                )
+            )
+            user_quests = result.scalars().all()
+        else:
+            wanted = set(quest_ids)
+            user_quests = [uq for uq in user_quests if uq.quest_id in wanted and not uq.coins_claimed]
+
+        completed = []
+        now = datetime.utcnow()
+        for uq in user_quests:
+            quest = registry.quests_by_id[uq.quest_id]
+            event_type = quest.requirement_type
+            amount = self.events[event_type]
+
+            if event_type == "streak":
+                if quest.quest_type == "weekly":
+                    # Count unique days studied this week from the activity calendar
+                    if week_days is None:
+                        monday = today - timedelta(days=today.weekday())
+                        week_days = (await load_calendar(db, self.user_id)).week(monday)[0]
+                    uq.progress = sum(1 for d in week_days if d)
+                else:
+                    # Daily or other: use current streak value directly
+                    uq.progress = amount
+            elif event_type == "study_time":
+                # Track in minutes (round up, minimum 1 minute per session)
+                uq.progress += max(1, math.ceil(amount / 60)) if amount > 0 else 0
+            else:
+                uq.progress += amount
+
+            # Mark complete if target reached
+            if uq.progress >= quest.requirement_value and not uq.is_complete:
+                uq.is_complete = True
+                uq.completed_at = now
+                completed.append(uq)
+
+        await db.flush()
+        return completed
@@ -0,0 +1,253 @@
+"""In-memory reference data: categories, achievements, shop items and quests.
+
+These tables only change when `sync_data.py` (or the startup seeds) run, so
+they are loaded once into frozen, pre-indexed records shared by every request,
+the same way `app.catalog` serves course content. Writers bump the `reference`
+row in `content_versions`; readers probe it at most every
+`catalog_refresh_seconds` and swap in a rebuilt registry when it moves.
+"""
+import asyncio
+import json
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import get_db, async_session
+from app.models import Category, Achievement, ShopItem, Quest
+from app.catalog import _read_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_VERSION_KEY = "reference"
+
+# Repository-level data folder (calculus/data)
+DATA_DIR = Path(__file__).parent.parent.parent / "data"
+
+
+@dataclass(frozen=True)
+class CategoryRef:
+    id: int
+    name: str
+    slug: str
+    icon: Optional[str]
+
+
+@dataclass(frozen=True)
+class AchievementRef:
+    id: int
+    title: str
+    description: Optional[str]
+    icon: Optional[str]
+    category: Optional[str]
+    rarity: str
+    xp_reward: int
+    coin_reward: int
+    requirement_type: Optional[str]
+    requirement_value: int
+
+
+@dataclass(frozen=True)
+class ShopItemRef:
+    id: int
+    name: str
+    description: Optional[str]
+    icon: Optional[str]
+    price: int
+    item_type: str
+    effect_value: int
+    is_active: bool
+    order_index: int
+
+
+@dataclass(frozen=True)
+class QuestRef:
+    id: int
+    title: str
+    description: Optional[str]
+    quest_type: str
+    requirement_type: str
+    requirement_value: int
+    coin_reward: int
+    icon: Optional[str]
+    is_active: bool
+
+
+@dataclass(frozen=True)
+class ReferenceData:
+    version: int
+    # Raw categories.json, pre-encoded (GET /categories returns it verbatim)
+    categories_json: Optional[bytes]
+    categories: tuple[CategoryRef, ...]
+    categories_by_slug: Mapping[str, CategoryRef]
+    achievements: tuple[AchievementRef, ...]
+    achievements_by_id: Mapping[int, AchievementRef]
+    # requirement_type -> achievements sorted by requirement_value
+    achievements_by_type: Mapping[str, tuple[AchievementRef, ...]]
+    # requirement_type -> the matching requirement_values (bisect keys for achievements_by_type)
+    achievement_thresholds: Mapping[str, tuple[int, ...]]
+    # Active items in shop order (order_index, price)
+    shop_items: tuple[ShopItemRef, ...]
+    shop_items_by_id: Mapping[int, ShopItemRef]
+    shop_items_by_type: Mapping[str, tuple[ShopItemRef, ...]]
+    # item_type -> ids of all items (inventories still hold deactivated ones)
+    item_ids_by_type: Mapping[str, tuple[int, ...]]
+    # All quests (inactive ones are still referenced by old user_quests)
+    quests_by_id: Mapping[int, QuestRef]
+    # quest_type -> active quests, the assignment pool
+    quest_pool: Mapping[str, tuple[QuestRef, ...]]
+
+    def item_ids_of_type(self, item_type: str) -> list[int]:
+        """Ids of every item of `item_type`, inactive ones included (for inventory lookups)."""
+        return list(self.item_ids_by_type.get(item_type, ()))
+
+    def unearned_achievements(self, earned_ids: Iterable[int]) -> list[AchievementRef]:
+        earned = set(earned_ids)
+        return [ach for ach in self.achievements if ach.id not in earned]
+
+
+_registry: ReferenceData | None = None
+_last_probe: float = 0.0
+_lock = asyncio.Lock()
+
+
+def _group(records, key) -> Mapping[str, tuple]:
+    groups = defaultdict(list)
+    for rec in records:
+        groups[key(rec)].append(rec)
+    return MappingProxyType({k: tuple(v) for k, v in groups.items()})
+
+
+def _load_categories_json() -> Optional[bytes]:
+    categories_file = DATA_DIR / "categories.json"
+    if not categories_file.exists():
+        return None
+    with open(categories_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+async def build_registry(db: AsyncSession) -> ReferenceData:
+    version = await _read_version(db, REFERENCE_VERSION_KEY)
+
+    cat_rows = (await db.execute(select(Category).order_by(Category.id))).scalars().all()
+    categories = tuple(CategoryRef(id=c.id, name=c.name, slug=c.slug, icon=c.icon) for c in cat_rows)
+
+    ach_rows = (await db.execute(select(Achievement).order_by(Achievement.id))).scalars().all()
+    achievements = tuple(
+        AchievementRef(
+            id=a.id,
+            title=a.title,
+            description=a.description,
+            icon=a.icon,
+            category=a.category,
+            rarity=a.rarity or "common",
+            xp_reward=a.xp_reward or 0,
+            coin_reward=a.coin_reward or 0,
+            requirement_type=a.requirement_type,
+            requirement_value=a.requirement_value or 0,
+        )
+        for a in ach_rows
+    )
+
+    item_rows = (await db.execute(
+        select(ShopItem).order_by(ShopItem.order_index, ShopItem.price)
+    )).scalars().all()
+    all_items = tuple(
+        ShopItemRef(
+            id=i.id,
+            name=i.name,
+            description=i.description,
+            icon=i.icon,
+            price=i.price,
+            item_type=i.item_type,
+            effect_value=i.effect_value if i.effect_value is not None else 1,
+            is_active=bool(i.is_active),
+            order_index=i.order_index or 0,
+        )
+        for i in item_rows
+    )
+    shop_items = tuple(i for i in all_items if i.is_active)
+
+    quest_rows = (await db.execute(select(Quest).order_by(Quest.id))).scalars().all()
+    quests = tuple(
+        QuestRef(
+            id=q.id,
+            title=q.title,
+            description=q.description,
+            quest_type=q.quest_type,
+            requirement_type=q.requirement_type,
+            requirement_value=q.requirement_value or 0,
+            coin_reward=q.coin_reward or 0,
+            icon=q.icon,
+            is_active=bool(q.is_active),
+        )
+        for q in quest_rows
+    )
+
+    achievements_by_type = _group(
+        sorted(achievements, key=lambda a: a.requirement_value), lambda a: a.requirement_type
+    )
+    return ReferenceData(
+        version=version,
+        categories_json=_load_categories_json(),
+        categories=categories,
+        categories_by_slug=MappingProxyType({c.slug: c for c in categories}),
+        achievements=achievements,
+        achievements_by_id=MappingProxyType({a.id: a for a in achievements}),
+        achievements_by_type=achievements_by_type,
+        achievement_thresholds=MappingProxyType({
+            t: tuple(a.requirement_value for a in group) for t, group in achievements_by_type.items()
+        }),
+        shop_items=shop_items,
+        shop_items_by_id=MappingProxyType({i.id: i for i in shop_items}),
+        shop_items_by_type=_group(shop_items, lambda i: i.item_type),
+        item_ids_by_type=MappingProxyType({
+            t: tuple(i.id for i in group) for t, group in _group(all_items, lambda i: i.item_type).items()
+        }),
+        quests_by_id=MappingProxyType({q.id: q for q in quests}),
+        quest_pool=_group([q for q in quests if q.is_active], lambda q: q.quest_type),
+    )
+
+
+async def refresh_registry(db: AsyncSession | None = None, stale: ReferenceData | None = None) -> ReferenceData:
+    """Rebuild the registry and swap it in (see `app.catalog.refresh_catalog`)."""
+    global _registry, _last_probe
+    async with _lock:
+        if stale is not None and _registry is not None and _registry is not stale:
+            return _registry
+        if db is None:
+            async with async_session() as session:
+                registry = await build_registry(session)
+        else:
+            registry = await build_registry(db)
+        _registry = registry
+        _last_probe = time.monotonic()
+    logger.info("Reference registry loaded: version=%s achievements=%s shop_items=%s quests=%s",
+                registry.version, len(registry.achievements), len(registry.shop_items),
+                len(registry.quests_by_id))
+    return registry
+
+
+async def get_registry(db: AsyncSession = Depends(get_db)) -> ReferenceData:
+    """FastAPI dependency (also callable directly) returning the current reference data."""
+    global _last_probe
+    registry = _registry
+    if registry is None:
+        return await refresh_registry(db)
+
+    now = time.monotonic()
+    if now - _last_probe < settings.catalog_refresh_seconds:
+        return registry
+    _last_probe = now
+    if await _read_version(db, REFERENCE_VERSION_KEY) != registry.version:
+        return await refresh_registry(db, stale=registry)
+    return registry
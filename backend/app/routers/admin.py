@@ -6,9 +6,14 @@ from pydantic import BaseModel
 from datetime import datetime, timedelta
 
 from app.database import get_db
-from app.models import User, UserInventory, StreakWeek, ShopItem
+from app.models import User, UserInventory, SchemaMigration
+from app.streaks import load_calendar
 from app.auth import get_current_user
-from app.hearts import MAX_HEARTS, RESTORE_HOURS, sync_hearts, seconds_until_next_heart
+from app.registry import get_registry
+from app.leaderboard import rank_index, award_xp
+from app.slide_cache import slide_cache
+from app.stats_cache import stats_cache
+from app.hearts import MAX_HEARTS, RESTORE_HOURS, heart_state, set_hearts
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -25,6 +30,8 @@ HELP_TEXT = """Available commands:
   /simulate <days>       — preview what happens if you AFK for N days
   /simulate <days> <d1> <d2> ...  — same, but mark specific days as online (1=tomorrow)
   /time                  — show current server time + user timestamps
+  /cache                 — show slide response and progress stats cache counters
+  /migrations            — list applied schema migrations and their timing
   /status                — show current stats
   /help                  — show this help"""
 
@@ -50,6 +57,8 @@ async def run_command(
         return CommandResponse(output="Empty command.", ok=False)
 
     cmd = parts[0].lower()
+    # Most commands change the caller's progress; drop their cached /progress/stats
+    stats_cache.invalidate(current_user.id)
 
     # /help
     if cmd == "/help":
@@ -57,13 +66,11 @@ async def run_command(
 
     # /status
     if cmd == "/status":
-        sync_hearts(current_user)
-        await db.commit()
         lines = [
             f"User    : {current_user.username}",
             f"XP      : {current_user.xp or 0}",
             f"Coins   : {current_user.coins or 0}",
-            f"Hearts  : {current_user.hearts or 0}/{MAX_HEARTS}",
+            f"Hearts  : {heart_state(current_user).hearts}/{MAX_HEARTS}",
             f"Streak  : {current_user.current_streak or 0} days",
         ]
         return CommandResponse(output="\n".join(lines))
@@ -80,10 +87,11 @@ async def run_command(
 
         if resource == "xp":
             if cmd == "/give":
-                current_user.xp = (current_user.xp or 0) + amount
+                award_xp(db, current_user, amount, "admin")
             else:
-                current_user.xp = amount
+                award_xp(db, current_user, amount - (current_user.xp or 0), "admin")
             await db.commit()
+            rank_index.record(current_user)
             return CommandResponse(output=f"XP → {current_user.xp}")
 
         elif resource == "coins":
@@ -95,13 +103,10 @@ async def run_command(
             return CommandResponse(output=f"Coins → {current_user.coins}")
 
         elif resource == "hearts":
-            sync_hearts(current_user)
             if cmd == "/give":
-                current_user.hearts = min(MAX_HEARTS, (current_user.hearts or 0) + amount)
+                set_hearts(current_user, heart_state(current_user).hearts + amount)
             else:
-                current_user.hearts = min(MAX_HEARTS, max(0, amount))
-            if (current_user.hearts or 0) >= MAX_HEARTS:
-                current_user.last_heart_restore_at = None
+                set_hearts(current_user, amount)
             await db.commit()
             return CommandResponse(output=f"Hearts → {current_user.hearts}/{MAX_HEARTS}")
 
@@ -146,12 +151,12 @@ async def run_command(
         today = now_utc.date()
 
         # Freeze inventory snapshot
+        registry = await get_registry(db)
         freeze_res = await db.execute(
             select(UserInventory)
-            .join(ShopItem, UserInventory.item_id == ShopItem.id)
             .where(
                 UserInventory.user_id == current_user.id,
-                ShopItem.item_type == "streak_freeze",
+                UserInventory.item_id.in_(registry.item_ids_of_type("streak_freeze")),
                 UserInventory.quantity > 0,
             )
         )
@@ -159,10 +164,8 @@ async def run_command(
         freeze_count = freeze_inv.quantity if freeze_inv else 0
         freeze_acquired = freeze_inv.acquired_at.date() if (freeze_inv and freeze_inv.acquired_at) else None
 
-        # Sync hearts without committing (read-only snapshot)
-        sync_hearts(current_user)
-        h = current_user.hearts or 0
-        h_secs_left = seconds_until_next_heart(current_user)
+        # Current hearts (read-only snapshot)
+        h, h_secs_left, _ = heart_state(current_user)
         RESTORE_SECS = RESTORE_HOURS * 3600
 
         streak = current_user.current_streak or 0
@@ -254,6 +257,28 @@ async def run_command(
         lines.append(f"Final: streak={streak}  hearts={h}/{MAX_HEARTS}  freeze\u00d7{freeze_count}")
         return CommandResponse(output="\n".join(lines))
 
+    # /cache — slide response cache counters (for sizing slide_cache_max_entries)
+    if cmd == "/cache":
+        stats = slide_cache.stats()
+        lines = [f"{k:<12}: {v}" for k, v in stats.items()]
+        lines.append("Progress stats cache")
+        lines.extend(f"{k:<12}: {v}" for k, v in stats_cache.stats().items())
+        return CommandResponse(output="Slide cache\n" + "\n".join(lines))
+
+    # /migrations — applied schema versions and how long each took
+    if cmd == "/migrations":
+        from app.migrations import MIGRATIONS
+        res = await db.execute(select(SchemaMigration).order_by(SchemaMigration.version))
+        applied = {m.version: m for m in res.scalars().all()}
+        lines = []
+        for migration in MIGRATIONS:
+            row = applied.get(migration.version)
+            if row:
+                lines.append(f"  {migration.version:>3}  {migration.name:<48} {row.duration_ms or 0:>9.1f} ms  {row.applied_at:%Y-%m-%d %H:%M}")
+            else:
+                lines.append(f"  {migration.version:>3}  {migration.name:<48} pending")
+        return CommandResponse(output="Schema migrations\n" + "\n".join(lines))
+
     # /time — show current timestamps
     if cmd == "/time":
         now = datetime.utcnow()
@@ -308,13 +333,12 @@ async def run_command(
                 name = inv.item.name if inv.item else str(inv.item_id)
                 changed.append(f"  inv [{name}] acquired → {inv.acquired_at.date()}")
 
-        # Shift StreakWeek entries (updated_at only, week_start is a label)
-        sw_res = await db.execute(
-            select(StreakWeek).where(StreakWeek.user_id == current_user.id)
-        )
-        for sw in sw_res.scalars().all():
-            if sw.updated_at:
-                sw.updated_at = sw.updated_at - delta
+        # Shift active/frozen days in the streak calendar
+        calendar = await load_calendar(db, current_user.id)
+        if calendar.active or calendar.frozen:
+            calendar.shift(days)
+            calendar.save(db)
+            changed.append(f"streak calendar     → shifted {days} day(s) back")
 
         await db.commit()
 
@@ -18,6 +18,7 @@ from app.auth import (
 from datetime import timedelta
 from app.config import settings
 from app.routers.send_email import send_html_email, build_verification_email_html
+from app.leaderboard import rank_index
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 logger = logging.getLogger(__name__)
@@ -61,6 +62,7 @@ async def register(data: UserCreate, db: AsyncSession = Depends(get_db)):
     db.add(user)
     await db.commit()
     await db.refresh(user)
+    rank_index.record(user)
 
     if settings.require_email_verification:
         try:
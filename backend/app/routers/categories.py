@@ -1,17 +1,12 @@
-from fastapi import APIRouter, HTTPException
-from pathlib import Path
-import json
+from fastapi import APIRouter, Depends, HTTPException, Response
+from app.registry import ReferenceData, get_registry
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
-DATA_DIR = Path(__file__).parent.parent.parent / "data"
 
 @router.get("")
-async def get_categories():
+async def get_categories(registry: ReferenceData = Depends(get_registry)):
     """Return the raw contents of calculus/data/categories.json (keeps backward compatibility)."""
-    categories_file = DATA_DIR / "categories.json"
-    if not categories_file.exists():
+    if registry.categories_json is None:
         raise HTTPException(status_code=404, detail="categories.json not found")
-    with open(categories_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
+    return Response(registry.categories_json, media_type="application/json")
@@ -0,0 +1,120 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from typing import Optional
+import json
+from app.database import get_db
+from app.models import User, Enrollment, StepProgress
+from app.auth import get_current_user_optional
+from app.catalog import ContentCatalog, ChapterNode, get_catalog
+from app.slide_cache import slide_cache
+
+router = APIRouter(prefix="/chapters", tags=["chapters"])
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+async def stream_chapter_bundle(
+    chapter: ChapterNode,
+    catalog: ContentCatalog,
+    db: AsyncSession,
+    current_user: Optional[User],
+    focus_step_id: Optional[int] = None,
+) -> StreamingResponse:
+    """Stream a chapter's steps (metadata + slides + user completion) as one JSON document.
+
+    The document is written in chunks — header, then one chunk per step — so a
+    client can start rendering the first step before the rest arrives. When
+    `focus_step_id` is set that step is streamed first; every entry carries its
+    `order_index` so clients can restore chapter order.
+    """
+    story = catalog.stories_by_id.get(chapter.story_id)
+    # The current step is the story's first incomplete one (as in story detail), so
+    # completion is read over the whole story and only one chapter can contain it
+    story_step_ids = [st.id for ch in story.chapters for st in ch.steps] if story else [st.id for st in chapter.steps]
+    is_enrolled = False
+    completed = set()
+    if current_user:
+        enroll_res = await db.execute(
+            select(Enrollment.id).where(
+                Enrollment.user_id == current_user.id,
+                Enrollment.story_id == chapter.story_id
+            )
+        )
+        is_enrolled = enroll_res.first() is not None
+        if story_step_ids:
+            progress_res = await db.execute(
+                select(StepProgress.step_id).where(
+                    StepProgress.user_id == current_user.id,
+                    StepProgress.step_id.in_(story_step_ids),
+                    StepProgress.is_completed == True
+                )
+            )
+            completed = set(progress_res.scalars().all())
+
+    current_step_id = next((sid for sid in story_step_ids if sid not in completed), None) if is_enrolled else None
+    if current_step_id not in {st.id for st in chapter.steps}:
+        current_step_id = None
+
+    steps = list(chapter.steps)
+    if focus_step_id is not None:
+        steps.sort(key=lambda st: st.id != focus_step_id)
+
+    header = {
+        "chapter": {
+            "id": chapter.id,
+            "title": chapter.title,
+            "description": chapter.description,
+            "order_index": chapter.order_index,
+            "story_id": chapter.story_id,
+            "story_slug": story.slug if story else None,
+        },
+        "is_enrolled": is_enrolled,
+        "focus_step_id": focus_step_id,
+        "current_step_id": current_step_id,
+    }
+
+    async def body():
+        # Drop the closing brace so the steps array can be appended chunk by chunk
+        yield _dumps(header)[:-1] + b',"steps":['
+        for idx, step in enumerate(steps):
+            meta = _dumps({
+                "id": step.id,
+                "title": step.title,
+                "description": step.description,
+                "xp_reward": step.xp_reward,
+                "order_index": step.order_index,
+                "chapter_title": step.chapter_title,
+                "story_slug": step.story_slug,
+                "next_step_id": catalog.next_step_ids.get(step.id),
+                "is_completed": step.id in completed,
+                "is_current": step.id == current_step_id,
+                "content_hash": step.content_hash,
+            })
+            # Splice the pre-encoded slides body in without re-serializing it
+            slides = slide_cache.get(step, catalog.version).body
+            yield (b"," if idx else b"") + meta[:-1] + b',"slides":' + slides + b"}"
+        yield b"]}"
+
+    return StreamingResponse(
+        body(),
+        media_type="application/json",
+        headers={"Cache-Control": "private, no-cache"},
+    )
+
+
+@router.get("/{chapter_id}/bundle")
+async def get_chapter_bundle(
+    chapter_id: int,
+    db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """Every step of a chapter with its slides and the user's completion state."""
+    chapter = catalog.chapters_by_id.get(chapter_id)
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    return await stream_chapter_bundle(chapter, catalog, db, current_user)
@@ -1,91 +1,223 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy import select, func, case
+from typing import Optional
+from app.config import settings
 from app.database import get_db
-from app.models import User, Enrollment, Story, Step, StepProgress, Chapter, Achievement, UserAchievement, UserInventory, ShopItem
+from app.models import (
+    User, Enrollment, StepProgress, UserAchievement, LeaderboardSnapshot, LeaderboardSnapshotEntry, UserStoryProgress,
+)
 from app.schemas import (
-    DashboardResponse, StoryDetailResponse, ChapterResponse, StepResponse,
+    DashboardResponse, StoryDetailResponse, StorySummaryResponse, CurrentStepResponse,
     UserStatsResponse, UserProgressResponse, AchievementResponse
 )
 from app.schemas import LeaderboardResponse
 from app.auth import get_current_user
-from app.routers.stories import calculate_story_progress
+from app.routers.stories import story_progress_from_steps, build_chapter_responses
+from app.catalog import ContentCatalog, StoryNode, get_catalog
+from app.registry import get_registry
+from app.pagination import encode_cursor, decode_cursor
+from app.achievements import check_all
+from app.stats_cache import stats_cache, user_fingerprint
+from app.leaderboard import rank_index, latest_snapshot, BOARD_ALL_TIME, BOARD_WEEKLY
 import logging
 from datetime import date, timedelta, datetime, time
-from app.models import StreakWeek, SlideProgress
-from app.schemas import StreakWeekRequest, StreakWeekResponse
+from app.streaks import tz_offset_from, local_today
+from app.learning_context import LearningContext, get_learning_context
+from app.schemas import StreakWeekRequest, StreakWeekResponse, HeatmapResponse, HeatmapDay
+from app.daily_activity import activity_between
 from sqlalchemy import select
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/progress", tags=["progress"])
 
+async def _leaderboard_from_snapshot(
+    db: AsyncSession, snap: LeaderboardSnapshot, current_user: User, start: int, limit: int, around: bool,
+    cursor: Optional[str],
+) -> LeaderboardResponse:
+    current_user_rank = None
+    if cursor:
+        # Snapshot cursors are (snapshot_id, rank); ranks carry over to newer snapshots
+        _, after_rank = decode_cursor(cursor, 2)
+        start = after_rank + 1
+    elif around:
+        rank_result = await db.execute(
+            select(LeaderboardSnapshotEntry.rank).where(
+                LeaderboardSnapshotEntry.snapshot_id == snap.id,
+                LeaderboardSnapshotEntry.user_id == current_user.id,
+            )
+        )
+        current_user_rank = rank_result.scalar()
+        if current_user_rank:
+            start = max(1, current_user_rank - max(0, limit // 2))
+
+    result = await db.execute(
+        select(LeaderboardSnapshotEntry.rank, LeaderboardSnapshotEntry.user_id, LeaderboardSnapshotEntry.xp,
+               User.display_name, User.username)
+        .outerjoin(User, User.id == LeaderboardSnapshotEntry.user_id)
+        .where(
+            LeaderboardSnapshotEntry.snapshot_id == snap.id,
+            LeaderboardSnapshotEntry.rank >= start,
+            LeaderboardSnapshotEntry.rank < start + limit,
+        )
+        .order_by(LeaderboardSnapshotEntry.rank)
+    )
+    rows = result.all()
+    entries = [
+        {'id': uid, 'rank': rank, 'username': display_name or username or "", 'xp': xp}
+        for rank, uid, xp, display_name, username in rows
+    ]
+    next_cursor = None
+    if rows and rows[-1].rank < (snap.entry_count or 0):
+        next_cursor = encode_cursor(snap.id, rows[-1].rank)
+
+    return LeaderboardResponse(
+        entries=entries,
+        current_user_rank=current_user_rank,
+        total_count=snap.entry_count or 0,
+        next_cursor=next_cursor,
+        board=snap.board,
+        snapshot_at=snap.taken_at,
+    )
+
+
 @router.get("/leaderboard", response_model=LeaderboardResponse)
 async def get_leaderboard(
     start: int = 1,
     limit: int = 30,
     around: bool = False,
+    cursor: Optional[str] = None,
+    board: str = Query(default=BOARD_ALL_TIME, pattern=f"^({BOARD_ALL_TIME}|{BOARD_WEEKLY})$"),
+    snapshot: bool = False,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Return leaderboard entries ordered by XP descending."""
+    """Return leaderboard entries ordered by XP descending (ties by user id).
+
+    Pass the previous response's `next_cursor` to continue after its last entry;
+    `start`/`around` remain for offset-style paging. The live all-time board
+    comes from the in-memory rank index; only the page's names are read from
+    SQL. `board=weekly` (XP gained this week) and `snapshot=true` read the
+    newest materialized snapshot instead. Until the background job has taken
+    one, the all-time board is served live and the weekly board returns 503.
+    """
     if start < 1:
         start = 1
     if limit < 1 or limit > 200:
         limit = 30
 
-    # Total users count
-    total_result = await db.execute(select(func.count(User.id)))
-    total_count = total_result.scalar() or 0
+    if board == BOARD_WEEKLY or snapshot:
+        snap = await latest_snapshot(db, board)
+        if snap is not None:
+            return await _leaderboard_from_snapshot(db, snap, current_user, start, limit, around, cursor)
+        if board == BOARD_WEEKLY:
+            raise HTTPException(
+                status_code=503,
+                detail="Weekly leaderboard is not available yet",
+                headers={"Retry-After": str(settings.leaderboard_snapshot_seconds or 300)},
+            )
 
-    # If client requests leaderboard centered around current user, compute their rank
-    current_user_rank = None
-    if around:
-        higher_result = await db.execute(
-            select(func.count(User.id)).where(User.xp > (current_user.xp or 0))
-        )
-        higher_count = higher_result.scalar() or 0
-        current_user_rank = int(higher_count) + 1
+    index = await rank_index.ensure_fresh(db)
+    total_count = len(index)
 
-        # center the returned page around the user's rank
+    current_user_rank = None
+    if cursor:
+        after_xp, after_id = decode_cursor(cursor, 2)
+        start = index.position_after(after_xp, after_id) + 1
+    elif around:
+        # Center the returned page around the user's rank
+        current_user_rank = index.count_above(current_user.xp or 0) + 1
         half = max(0, limit // 2)
         start = max(1, current_user_rank - half)
 
-    offset = start - 1
-    result = await db.execute(
-        select(User).order_by(User.xp.desc()).offset(offset).limit(limit)
-    )
-    users = result.scalars().all()
+    page = index.slice(start - 1, limit)
+    next_cursor = None
+    if page and start - 1 + len(page) < total_count:
+        next_cursor = encode_cursor(page[-1][1], page[-1][0])
+
+    names = {}
+    if page:
+        result = await db.execute(
+            select(User.id, User.display_name, User.username).where(User.id.in_([uid for uid, _ in page]))
+        )
+        names = {uid: display_name or username for uid, display_name, username in result.all()}
 
     entries = []
-    for idx, u in enumerate(users):
+    for idx, (uid, xp) in enumerate(page):
         entries.append({
-            'id': u.id,
+            'id': uid,
             'rank': start + idx,
-            'username': u.display_name or u.username,
-            'xp': u.xp or 0
+            'username': names.get(uid, ""),
+            'xp': xp
         })
 
-    return LeaderboardResponse(entries=entries, current_user_rank=current_user_rank, total_count=total_count)
+    return LeaderboardResponse(
+        entries=entries,
+        current_user_rank=current_user_rank,
+        total_count=total_count,
+        next_cursor=next_cursor,
+    )
+
+def _story_summary(story: StoryNode, completed_steps: set[int]) -> StorySummaryResponse:
+    """Dashboard card for an enrolled story: counts and the first uncompleted step."""
+    done = len(completed_steps & story.step_ids)
+    current_step = None
+    for chapter in story.chapters:
+        step = next((st for st in chapter.steps if st.id not in completed_steps), None)
+        if step:
+            current_step = CurrentStepResponse(
+                step_id=step.id,
+                step_title=step.title,
+                chapter_id=chapter.id,
+                chapter_title=chapter.title,
+            )
+            break
+    progress = story_progress_from_steps(story, completed_steps)
+    return StorySummaryResponse(
+        id=story.id,
+        slug=story.slug,
+        title=story.title,
+        thumbnail_url=story.thumbnail_url,
+        illustration=story.illustration,
+        description=story.description,
+        icon=story.icon,
+        color=story.color,
+        category_name=story.category_name,
+        chapter_count=story.stats.chapter_count,
+        exercises=story.stats.quiz_count,
+        progress=progress,
+        is_enrolled=True,
+        is_completed=progress == 100,
+        step_count=len(story.step_ids),
+        completed_steps=done,
+        current_step=current_step,
+    )
+
 
 @router.get("/dashboard", response_model=DashboardResponse)
 async def get_dashboard(
+    view: str = Query(default="summary", pattern="^(summary|full)$"),
     db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
     current_user: User = Depends(get_current_user)
 ):
+    """Home screen data. `view=summary` (default) returns per-story counts and the
+    current step in two queries; `view=full` also returns each story's chapter/step tree."""
+    level = current_user.xp // 100 + 1
+    next_level_xp = level * 100
+
     # Get all enrollments
     result = await db.execute(
-        select(Enrollment)
+        select(Enrollment.story_id)
         .where(Enrollment.user_id == current_user.id)
         .order_by(Enrollment.enrolled_at.desc())
     )
-    enrollments = result.scalars().all()
+    enrolled_ids = result.scalars().all()
     
-    if not enrollments:
-        level = current_user.xp // 100 + 1
-        next_level_xp = level * 100
+    if not enrolled_ids:
         return DashboardResponse(
+            view=view,
             current_story=None,
             in_progress_stories=[],
             total_xp=current_user.xp,
@@ -94,20 +226,6 @@ async def get_dashboard(
             next_level_xp=next_level_xp
         )
     
-    # Get all story IDs from enrollments
-    story_ids = [e.story_id for e in enrollments]
-    
-    # Batch load all stories with chapters and steps in ONE query
-    stories_result = await db.execute(
-        select(Story)
-        .options(
-            selectinload(Story.chapters).selectinload(Chapter.steps).selectinload(Step.slides),
-            joinedload(Story.category)
-        )
-        .where(Story.id.in_(story_ids))
-    )
-    stories_map = {s.id: s for s in stories_result.unique().scalars().all()}
-    
     # Get completed steps for user (single query)
     progress_result = await db.execute(
         select(StepProgress.step_id).where(
@@ -120,90 +238,48 @@ async def get_dashboard(
     current_story = None
     in_progress_stories = []
     
-    for idx, enrollment in enumerate(enrollments):
-        story = stories_map.get(enrollment.story_id)
+    for idx, story_id in enumerate(enrolled_ids):
+        story = catalog.stories_by_id.get(story_id)
         if not story:
             continue
-            
-        # Calculate progress in-memory (no extra queries!)
-        total_steps = sum(len(ch.steps) for ch in story.chapters)
-        story_step_ids = {step.id for ch in story.chapters for step in ch.steps}
-        completed_count = len(completed_steps & story_step_ids)
-        progress = int((completed_count / total_steps) * 100) if total_steps > 0 else 0
-        
-        chapters = []
-        found_current = False
-        
-        for chapter in story.chapters:
-            steps = []
-            for step in chapter.steps:
-                is_completed = step.id in completed_steps
-                is_current = not is_completed and not found_current
-                
-                if is_current:
-                    found_current = True
-                
-                steps.append(StepResponse(
-                    id=step.id,
-                    title=step.title,
-                    description=step.description,
-                    xp_reward=step.xp_reward,
-                    is_completed=is_completed,
-                    is_current=is_current
-                ))
-            
-            chapters.append(ChapterResponse(
-                id=chapter.id,
-                title=chapter.title,
-                description=chapter.description,
-                steps=steps
-            ))
-        
-        logger.debug(f"[progress.get_dashboard] slug={story.slug} illustration={story.illustration!r} thumbnail_url={story.thumbnail_url!r}")
-
-        # Count exercises (quiz blocks) from preloaded slides
-        exercises_count = 0
-        for ch in getattr(story, 'chapters', []) or []:
-            for st in getattr(ch, 'steps', []) or []:
-                for slide in getattr(st, 'slides', []) or []:
-                    blocks = slide.blocks or []
-                    if not isinstance(blocks, list):
-                        continue
-                    for b in blocks:
-                        if not isinstance(b, dict):
-                            continue
-                        if b.get('type') == 'quiz' or b.get('block_type') == 'quiz':
-                            exercises_count += 1
-
-        story_response = StoryDetailResponse(
-            id=story.id,
-            slug=story.slug,
-            title=story.title,
-            thumbnail_url=story.thumbnail_url,
-            illustration=story.illustration,
-            description=story.description,
-            icon=story.icon,
-            color=story.color,
-            category_name=story.category.name if story.category else None,
-            chapter_count=len(chapters),
-            exercises=exercises_count,
-            progress=progress,
-            is_enrolled=True,
-            chapters=chapters
-        )
+
+        if view == "summary":
+            story_response = _story_summary(story, completed_steps)
+        else:
+            # Calculate progress in-memory (no extra queries!)
+            progress = story_progress_from_steps(story, completed_steps)
+            chapters = build_chapter_responses(story, completed_steps)
+
+            logger.debug(f"[progress.get_dashboard] slug={story.slug} illustration={story.illustration!r} thumbnail_url={story.thumbnail_url!r}")
+
+            story_response = StoryDetailResponse(
+                id=story.id,
+                slug=story.slug,
+                title=story.title,
+                thumbnail_url=story.thumbnail_url,
+                illustration=story.illustration,
+                description=story.description,
+                icon=story.icon,
+                color=story.color,
+                category_name=story.category_name,
+                chapter_count=len(chapters),
+                # Exercises (quiz blocks) are materialized at sync time
+                exercises=story.stats.quiz_count,
+                progress=progress,
+                is_enrolled=True,
+                chapters=chapters
+            )
         
         # First enrollment is the current story
         if idx == 0:
             current_story = story_response
         
         # Add to in_progress list if not 100% complete
-        if progress < 100:
+        if story_response.progress < 100:
             in_progress_stories.append(story_response)
     
-    level = current_user.xp // 100 + 1
-    next_level_xp = level * 100
-    
     return DashboardResponse(
+        view=view,
         current_story=current_story,
         in_progress_stories=in_progress_stories,
         total_xp=current_user.xp,
@@ -217,251 +293,61 @@ async def get_dashboard(
 async def get_streak_week(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    learning: LearningContext = Depends(get_learning_context),
     request: Request = None,
     week_start: str | None = None,
     tz_offset_minutes: int | None = None
 ):
     """Return the user's streak days for the requested week (YYYY-MM-DD Monday). If not present, return defaults."""
-    # Determine week_start: if provided use it, otherwise compute current week's Monday
     # prefer explicit query param, otherwise try header 'x-user-tz-offset'
     if tz_offset_minutes is None and request is not None:
-        try:
-            hdr = request.headers.get('x-user-tz-offset') or request.headers.get('x-tz-offset')
-            if hdr is not None:
-                tz_offset_minutes = int(hdr)
-        except Exception:
-            tz_offset_minutes = None
-
-    # compute user's local today using tz offset if provided
-    if tz_offset_minutes is not None:
-        today_local = (datetime.utcnow() + timedelta(minutes=tz_offset_minutes)).date()
-    else:
-        today_local = date.today()
-
+        tz_offset_minutes = tz_offset_from(request)
+    today_local = local_today(tz_offset_minutes)
+    this_monday = today_local - timedelta(days=today_local.weekday())
     if not week_start:
-        # Python weekday(): Monday==0
-        monday = today_local - timedelta(days=today_local.weekday())
-        week_start = monday.isoformat()
-
-    result = await db.execute(
-        select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == week_start)
-    )
-    entry = result.scalar_one_or_none()
-
-    # helper to compute current streak by looking at this week and previous week(s)
-    def compute_current_streak_from(week_days, week_start_date):
-        # week_days: list[bool] for Mon..Sun
-        # start from today if this is current week, or from last true day otherwise
-        streak_count = 0
-        # determine today's index relative to week_start_date using user-local today
-        monday = today_local - timedelta(days=today_local.weekday())
-        is_current_week = (monday.isoformat() == week_start_date)
-        today_idx = (today_local.weekday()) if is_current_week else 6
-        i = today_idx
-        # count backwards within this week's days
-        while i >= 0 and i < len(week_days) and week_days[i]:
-            streak_count += 1
-            i -= 1
-
-        # if we reached before Monday (i < 0) and still want to continue streak,
-        # check previous week(s) - simple single previous week lookup
-        if i < 0:
-            prev_monday = (date.fromisoformat(week_start_date) - timedelta(days=7)).isoformat()
-            prev_res = db.execute(select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == prev_monday))
-            prev_entry = (prev_res).scalar_one_or_none()
-            if prev_entry and isinstance(prev_entry.days, list):
-                j = 6
-                while j >= 0 and prev_entry.days[j]:
-                    streak_count += 1
-                    j -= 1
-
-        return streak_count, today_idx if is_current_week else None
-
-    # Determine activity-derived days for the week (from StepProgress and SlideProgress)
+        week_start = this_monday.isoformat()
     week_start_date = date.fromisoformat(week_start)
-    start_dt = datetime.combine(week_start_date, time.min)
-    end_dt = datetime.combine(week_start_date + timedelta(days=7), time.min)
-
-    activity_days = [False] * 7
-    try:
-        sp_res = await db.execute(
-            select(StepProgress.completed_at).where(
-                StepProgress.user_id == current_user.id,
-                StepProgress.is_completed == True,
-                StepProgress.completed_at >= start_dt,
-                StepProgress.completed_at < end_dt
-            )
-        )
-        for dtval in sp_res.scalars().all():
-            if not dtval:
-                continue
-            d = dtval.date()
-            if week_start_date <= d < week_start_date + timedelta(days=7):
-                activity_days[d.weekday()] = True
-
-        sl_res = await db.execute(
-            select(SlideProgress.completed_at).where(
-                SlideProgress.user_id == current_user.id,
-                SlideProgress.completed_at >= start_dt,
-                SlideProgress.completed_at < end_dt
-            )
-        )
-        for dtval in sl_res.scalars().all():
-            if not dtval:
-                continue
-            d = dtval.date()
-            if week_start_date <= d < week_start_date + timedelta(days=7):
-                activity_days[d.weekday()] = True
-    except Exception:
-        activity_days = [False] * 7
-
-    days_arr = [False] * 7
-    if entry and isinstance(entry.days, list) and len(entry.days) == 7:
-        # merge persisted days with activity-derived days (persisted OR activity)
-        days_arr = [bool(entry.days[i]) or bool(activity_days[i]) for i in range(7)]
-    else:
-        # use activity-derived days if no persisted entry
-        days_arr = activity_days
+
+    calendar = await learning.calendar()
 
     # compute today's index (relative to Monday=0..Sunday=6) using user-local today
     today_idx = today_local.weekday()  # Monday==0
-
-    # determine whether today is completed: prefer persisted days, fallback to last_activity_date
-    today_completed = False
-    if 0 <= today_idx < len(days_arr):
-        today_completed = bool(days_arr[today_idx])
+    today_completed = calendar.is_active(today_local)
     # fallback: if user.last_activity_date in user-local date equals today, consider today completed
-    if not today_completed and current_user.last_activity_date:
-        try:
-            lad = current_user.last_activity_date
-            if tz_offset_minutes is not None:
-                lad_local = lad + timedelta(minutes=tz_offset_minutes)
-                if lad_local.date() == today_local:
-                    today_completed = True
-            else:
-                if lad.date() == today_local:
-                    today_completed = True
-        except Exception:
-            pass
-
-    # compute current streak by counting consecutive trues up to today (and previous week)
-    current_streak = 0
-    # Count backwards in this week
-    i = today_idx
-    while i >= 0 and days_arr[i]:
-        current_streak += 1
-        i -= 1
-    # if we went past Monday, check previous week (relative to user-local today)
-    if i < 0:
-        prev_monday = (today_local - timedelta(days=7 + today_local.weekday())).isoformat()
-        prev_result = await db.execute(select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == prev_monday))
-        prev_entry = prev_result.scalar_one_or_none()
-        if prev_entry and isinstance(prev_entry.days, list):
-            j = 6
-            while j >= 0 and prev_entry.days[j]:
-                current_streak += 1
-                j -= 1
-
-    # Determine last activity in user-local date to avoid dropping the streak before the day ends
     last_activity_local = None
     if current_user.last_activity_date:
-        try:
-            lad = current_user.last_activity_date
-            last_activity_local = (lad + timedelta(minutes=tz_offset_minutes)).date() if tz_offset_minutes is not None else lad.date()
-        except Exception:
-            last_activity_local = current_user.last_activity_date.date()
-
-    if last_activity_local:
-        gap_days = (today_local - last_activity_local).days
-        # If today or yesterday has activity, keep the stored streak counter even if today is not yet completed
-        if gap_days <= 1 and (current_user.current_streak or 0) > current_streak:
-            current_streak = current_user.current_streak or 0
-        # If the user has been inactive for more than one full day, streak dies
-        if gap_days > 1:
-            current_streak = 0
-    else:
-        # If persisted/activity days don't indicate a streak but user's scalar counters do, prefer the user's counter
-        if (current_user.current_streak or 0) > current_streak:
-            current_streak = current_user.current_streak or 0
-
-    longest = current_user.longest_streak or 0
-
-    # Build frozen_days list (7 bools) — auto-apply streak freeze for yesterday if eligible
+        lad = current_user.last_activity_date
+        last_activity_local = (lad + timedelta(minutes=tz_offset_minutes)).date() if tz_offset_minutes is not None else lad.date()
+        if last_activity_local == today_local:
+            today_completed = True
+
+    # Auto-apply a streak freeze for yesterday if it was missed
     # Rule: freeze purchased on day N can only protect day N (i.e. applied when today = N+1).
     #       It never protects N-1 or earlier.
-    frozen_arr = list(entry.frozen_days) if (entry and entry.frozen_days and len(entry.frozen_days) == 7) else [False] * 7
-    monday = today_local - timedelta(days=today_local.weekday())
-    is_current_week = (monday.isoformat() == week_start)
-
-    if is_current_week:
-        # "yesterday" in the current week = today_idx - 1
-        # On Monday (today_idx=0), yesterday is previous week's Sunday (idx=6)
-        yesterday_current_idx = today_idx - 1  # -1 means yesterday is in the previous week
-
-        # Determine if yesterday (in current or previous week) was missed and not frozen
-        freeze_apply_current = (
-            yesterday_current_idx >= 0
-            and not days_arr[yesterday_current_idx]
-            and not frozen_arr[yesterday_current_idx]
+    yesterday = today_local - timedelta(days=1)
+    if week_start_date == this_monday and not calendar.is_active(yesterday) and not calendar.is_frozen(yesterday):
+        # Only use a freeze that was purchased BEFORE today (acquired_at < today midnight local)
+        today_midnight_utc = datetime.combine(today_local, time.min) - timedelta(minutes=(tz_offset_minutes or 0))
+        freeze_inv = await learning.inventory_item(
+            "streak_freeze", lambda inv: inv.acquired_at is not None and inv.acquired_at < today_midnight_utc
         )
-
-        freeze_prev_entry = None
-        freeze_prev_frozen_arr = None
-        if yesterday_current_idx < 0:  # today is Monday — check previous week's Sunday
-            prev_monday_str = (today_local - timedelta(days=7)).isoformat()
-            prev_res = await db.execute(
-                select(StreakWeek).where(
-                    StreakWeek.user_id == current_user.id,
-                    StreakWeek.week_start == prev_monday_str,
-                )
-            )
-            prev_entry_check = prev_res.scalar_one_or_none()
-            if prev_entry_check:
-                prev_days = list(prev_entry_check.days) if prev_entry_check.days and len(prev_entry_check.days) == 7 else [False] * 7
-                prev_frozen = list(prev_entry_check.frozen_days) if prev_entry_check.frozen_days and len(prev_entry_check.frozen_days) == 7 else [False] * 7
-                if not prev_days[6] and not prev_frozen[6]:
-                    freeze_prev_entry = prev_entry_check
-                    freeze_prev_frozen_arr = prev_frozen
-
-        if freeze_apply_current or freeze_prev_entry is not None:
-            # Only use a freeze that was purchased BEFORE today (acquired_at < today midnight local)
-            today_midnight_utc = datetime.combine(today_local, time.min) - timedelta(minutes=(tz_offset_minutes or 0))
-            freeze_res = await db.execute(
-                select(UserInventory)
-                .join(ShopItem, UserInventory.item_id == ShopItem.id)
-                .where(
-                    UserInventory.user_id == current_user.id,
-                    ShopItem.item_type == "streak_freeze",
-                    UserInventory.quantity > 0,
-                    UserInventory.acquired_at < today_midnight_utc,
-                )
-            )
-            freeze_inv = freeze_res.scalar_one_or_none()
-            if freeze_inv:
-                freeze_inv.quantity -= 1
-                if freeze_apply_current:
-                    frozen_arr[yesterday_current_idx] = True
-                    if entry:
-                        entry.frozen_days = frozen_arr
-                        entry.days = days_arr
-                    else:
-                        db.add(StreakWeek(
-                            user_id=current_user.id,
-                            week_start=week_start,
-                            days=days_arr,
-                            frozen_days=frozen_arr,
-                        ))
-                else:
-                    # Apply to previous week's Sunday
-                    freeze_prev_frozen_arr[6] = True
-                    freeze_prev_entry.frozen_days = freeze_prev_frozen_arr
-                await db.commit()
+        if freeze_inv:
+            await learning.consume_item(freeze_inv)
+            calendar.mark_frozen(yesterday)
+            await learning.flush()
+            await db.commit()
+
+    days_arr, frozen_arr = calendar.week(week_start_date)
+    current_streak = calendar.current_streak(today_local)
+    # If today or yesterday has activity, keep the stored streak counter (e.g. set by /set streak)
+    if last_activity_local and (today_local - last_activity_local).days <= 1:
+        current_streak = max(current_streak, current_user.current_streak or 0)
 
     return StreakWeekResponse(
         week_start=week_start,
         days=days_arr,
         current_streak=current_streak,
-        longest_streak=longest,
+        longest_streak=max(current_user.longest_streak or 0, calendar.longest_streak()),
         today_index=today_idx,
         today_completed=today_completed,
         frozen_days=frozen_arr,
@@ -474,138 +360,129 @@ async def post_streak_week(
     request: Request = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    learning: LearningContext = Depends(get_learning_context),
     tz_offset_minutes: int | None = None
 ):
     """Create or update the streak days for a user for a given week."""
-    week_start = payload.week_start
     # prefer explicit query param, otherwise try header
     if tz_offset_minutes is None and request is not None:
-        try:
-            hdr = request.headers.get('x-user-tz-offset') or request.headers.get('x-tz-offset')
-            if hdr is not None:
-                tz_offset_minutes = int(hdr)
-        except Exception:
-            tz_offset_minutes = None
-
-    if not week_start:
-        if tz_offset_minutes is not None:
-            today_local = (datetime.utcnow() + timedelta(minutes=tz_offset_minutes)).date()
-        else:
-            today_local = date.today()
-        monday = today_local - timedelta(days=today_local.weekday())
-        week_start = monday.isoformat()
+        tz_offset_minutes = tz_offset_from(request)
+    today_local = local_today(tz_offset_minutes)
+    this_monday = today_local - timedelta(days=today_local.weekday())
+    week_start = payload.week_start or this_monday.isoformat()
+    week_start_date = date.fromisoformat(week_start)
 
     days = payload.days or [False]*7
 
-    result = await db.execute(
-        select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == week_start)
-    )
-    entry = result.scalar_one_or_none()
-    if entry:
-        entry.days = days
-    else:
-        entry = StreakWeek(user_id=current_user.id, week_start=week_start, days=days)
-        db.add(entry)
+    calendar = await learning.calendar()
+    for i in range(7):
+        day = week_start_date + timedelta(days=i)
+        calendar.set_day(day, active=bool(i < len(days) and days[i]), frozen=calendar.is_frozen(day))
 
     # After updating, if this is the current week, recompute current and longest streak
-    today = date.today()
-    current_week_monday = (today - timedelta(days=today.weekday())).isoformat()
-    if week_start == current_week_monday:
-        # compute consecutive days up to today in this week
-        today_idx = today.weekday()
-        current = 0
-        i = today_idx
-        while i >= 0 and i < len(days) and days[i]:
-            current += 1
-            i -= 1
-
-        # continue into previous week if needed
-        if i < 0:
-            prev_monday = (today - timedelta(days=7 + today.weekday())).isoformat()
-            prev_result = await db.execute(select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == prev_monday))
-            prev_entry = prev_result.scalar_one_or_none()
-            if prev_entry and isinstance(prev_entry.days, list):
-                j = 6
-                while j >= 0 and prev_entry.days[j]:
-                    current += 1
-                    j -= 1
-
-        # update user's streak counters
+    if week_start_date == this_monday:
+        current = calendar.current_streak(today_local)
         current_user.current_streak = current
         if (current_user.longest_streak or 0) < current:
             current_user.longest_streak = current
         db.add(current_user)
 
+    await learning.flush()
     await db.commit()
 
-    # prepare response payload
-    today_idx = date.today().weekday()
-    today_completed = bool(days[today_idx]) if 0 <= today_idx < len(days) else False
-    longest = current_user.longest_streak or 0
-    # compute current streak to return (mirror above)
-    current = current_user.current_streak or 0
-
+    days_arr, frozen_arr = calendar.week(week_start_date)
+    today_idx = today_local.weekday()
     return StreakWeekResponse(
         week_start=week_start,
-        days=days,
-        current_streak=current,
-        longest_streak=longest,
+        days=days_arr,
+        current_streak=current_user.current_streak or 0,
+        longest_streak=current_user.longest_streak or 0,
         today_index=today_idx,
-        today_completed=today_completed
+        today_completed=bool(days_arr[today_idx]) if week_start_date == this_monday else False,
+        frozen_days=frozen_arr,
     )
 
 
-@router.get("/stats", response_model=UserProgressResponse)
-async def get_user_progress(
+@router.get('/heatmap', response_model=HeatmapResponse)
+async def get_heatmap(
+    request: Request,
+    year: Optional[int] = Query(None, ge=1970, le=9999),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
 ):
-    """Get detailed user stats, achievements and recent activity"""
-    
-    # Completed steps count
-    completed_steps_result = await db.execute(
-        select(func.count(StepProgress.id)).where(
-            StepProgress.user_id == current_user.id,
-            StepProgress.is_completed == True
-        )
+    """Daily activity for one year (default: the user's current year), from the daily_activity rollup."""
+    if year is None:
+        year = local_today(tz_offset_from(request)).year
+    rows = await activity_between(db, current_user.id, date(year, 1, 1), date(year, 12, 31))
+    return HeatmapResponse(
+        year=year,
+        days=[HeatmapDay.model_validate(row) for row in rows],
+        active_days=len(rows),
+        total_xp=sum(row.xp for row in rows),
+        total_seconds=sum(row.seconds for row in rows),
     )
-    completed_steps = completed_steps_result.scalar() or 0
-    
-    # Total time spent
-    time_result = await db.execute(
-        select(func.sum(StepProgress.time_spent_seconds)).where(
-            StepProgress.user_id == current_user.id
-        )
+
+
+async def _stats_totals(db: AsyncSession, user_id: int):
+    """Completed steps, time spent, enrolled and completed stories in one statement."""
+    enrolled = select(func.count(Enrollment.id)).where(Enrollment.user_id == user_id).scalar_subquery()
+    completed_stories = (
+        select(func.count())
+        .select_from(UserStoryProgress)
+        .where(UserStoryProgress.user_id == user_id, UserStoryProgress.completed_at.is_not(None))
+        .scalar_subquery()
     )
-    total_time_spent = time_result.scalar() or 0
-    
-    # Enrolled stories count
-    enrolled_result = await db.execute(
-        select(func.count(Enrollment.id)).where(
-            Enrollment.user_id == current_user.id
-        )
+    result = await db.execute(
+        select(
+            func.count(case((StepProgress.is_completed == True, StepProgress.id))),
+            func.coalesce(func.sum(StepProgress.time_spent_seconds), 0),
+            enrolled,
+            completed_stories,
+        ).where(StepProgress.user_id == user_id)
     )
-    enrolled_stories = enrolled_result.scalar() or 0
-    
-    # Completed stories (100% progress)
-    completed_stories = 0
-    enrollments_result = await db.execute(
-        select(Enrollment).where(Enrollment.user_id == current_user.id)
+    return result.one()
+
+
+async def _earned_achievements(db: AsyncSession, user_id: int) -> dict:
+    result = await db.execute(
+        select(UserAchievement.achievement_id, UserAchievement.earned_at).where(UserAchievement.user_id == user_id)
     )
-    for enrollment in enrollments_result.scalars().all():
-        progress = await calculate_story_progress(db, current_user.id, enrollment.story_id)
-        if progress >= 100:
-            completed_stories += 1
-    
-    # All achievements
-    all_achievements_result = await db.execute(select(Achievement))
-    all_achievements = all_achievements_result.scalars().all()
-    
-    # User's earned achievements
-    earned_result = await db.execute(
-        select(UserAchievement).where(UserAchievement.user_id == current_user.id)
+    return dict(result.all())
+
+
+async def _recent_completions(db: AsyncSession, user_id: int) -> list:
+    result = await db.execute(
+        select(StepProgress.step_id, StepProgress.completed_at)
+        .where(StepProgress.user_id == user_id, StepProgress.is_completed == True)
+        .order_by(StepProgress.completed_at.desc())
+        .limit(10)
     )
-    earned_achievements = {ua.achievement_id: ua.earned_at for ua in earned_result.scalars().all()}
+    return result.all()
+
+
+@router.get("/stats", response_model=UserProgressResponse)
+async def get_user_progress(
+    db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
+    current_user: User = Depends(get_current_user)
+):
+    """Get detailed user stats, achievements and recent activity.
+
+    Three reads on the request session (totals are one aggregate statement); the
+    response is cached per user (see app.stats_cache).
+    """
+    registry = await get_registry(db)
+    fingerprint = user_fingerprint(current_user, registry.version)
+    cached = stats_cache.get(current_user.id, fingerprint)
+    if cached is not None:
+        return cached
+
+    completed_steps, total_time_spent, enrolled_stories, completed_stories = await _stats_totals(db, current_user.id)
+    earned_achievements = await _earned_achievements(db, current_user.id)
+    recent = await _recent_completions(db, current_user.id)
+
+    # All achievements
+    all_achievements = registry.achievements
     
     # Build achievements list
     achievements = []
@@ -625,27 +502,16 @@ async def get_user_progress(
             requirement_value=ach.requirement_value,
         ))
     
-    # Recent activity (last 10 completed steps)
-    recent_result = await db.execute(
-        select(StepProgress)
-        .options(selectinload(StepProgress.step))
-        .where(
-            StepProgress.user_id == current_user.id,
-            StepProgress.is_completed == True
-        )
-        .order_by(StepProgress.completed_at.desc())
-        .limit(10)
-    )
-    recent_progress = recent_result.scalars().all()
-    
+    # Recent activity (last 10 completed steps); titles come from the catalog
     recent_activity = []
-    for p in recent_progress:
+    for step_id, completed_at in recent:
+        step = catalog.steps_by_id.get(step_id)
         recent_activity.append({
             "type": "step_completed",
-            "step_id": p.step_id,
-            "step_title": p.step.title if p.step else "Unknown",
-            "xp_earned": p.step.xp_reward if p.step else 0,
-            "completed_at": p.completed_at.isoformat() if p.completed_at else None
+            "step_id": step_id,
+            "step_title": step.title if step else "Unknown",
+            "xp_earned": step.xp_reward if step else 0,
+            "completed_at": completed_at.isoformat() if completed_at else None
         })
     
     # Calculate level
@@ -667,11 +533,13 @@ async def get_user_progress(
         total_achievements=len(all_achievements)
     )
     
-    return UserProgressResponse(
+    response = UserProgressResponse(
         stats=stats,
         achievements=achievements,
         recent_activity=recent_activity
     )
+    stats_cache.put(current_user.id, fingerprint, response)
+    return response
 
 
 @router.post("/check-achievements")
@@ -680,68 +548,13 @@ async def check_and_award_achievements(
     current_user: User = Depends(get_current_user)
 ):
     """Check and award any achievements the user has earned"""
-    
-    # Get all achievements not yet earned by user
-    subquery = select(UserAchievement.achievement_id).where(
-        UserAchievement.user_id == current_user.id
-    )
-    result = await db.execute(
-        select(Achievement).where(Achievement.id.notin_(subquery))
-    )
-    unearned = result.scalars().all()
-    
-    # Get user stats for checking
-    completed_steps_result = await db.execute(
-        select(func.count(StepProgress.id)).where(
-            StepProgress.user_id == current_user.id,
-            StepProgress.is_completed == True
-        )
-    )
-    completed_steps = completed_steps_result.scalar() or 0
-    
-    completed_stories = 0
-    enrollments_result = await db.execute(
-        select(Enrollment).where(Enrollment.user_id == current_user.id)
-    )
-    for enrollment in enrollments_result.scalars().all():
-        progress = await calculate_story_progress(db, current_user.id, enrollment.story_id)
-        if progress >= 100:
-            completed_stories += 1
-    
-    # Check each unearned achievement
-    newly_earned = []
-    for ach in unearned:
-        earned = False
-        
-        if ach.requirement_type == "xp" and current_user.xp >= ach.requirement_value:
-            earned = True
-        elif ach.requirement_type == "steps" and completed_steps >= ach.requirement_value:
-            earned = True
-        elif ach.requirement_type == "streak" and current_user.current_streak >= ach.requirement_value:
-            earned = True
-        elif ach.requirement_type == "stories" and completed_stories >= ach.requirement_value:
-            earned = True
-        
-        if earned:
-            user_ach = UserAchievement(
-                user_id=current_user.id,
-                achievement_id=ach.id
-            )
-            db.add(user_ach)
-            current_user.xp += ach.xp_reward
-            coins_awarded = getattr(ach, 'coin_reward', 0) or 0
-            current_user.coins = (current_user.coins or 0) + coins_awarded
-            newly_earned.append({
-                "id": ach.id,
-                "title": ach.title,
-                "icon": ach.icon,
-                "rarity": ach.rarity,
-                "xp_reward": ach.xp_reward,
-                "coin_reward": coins_awarded,
-            })
+    registry = await get_registry(db)
+    newly_earned = await check_all(db, current_user, registry)
     
     if newly_earned:
         await db.commit()
+        rank_index.record(current_user)
+        stats_cache.invalidate(current_user.id)
     
     return {
         "newly_earned": newly_earned,
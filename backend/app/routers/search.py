@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.schemas import SearchResponse, SearchHitResponse
+from app.catalog import ContentCatalog, get_catalog
+from app.search import search_documents, KIND_STEP
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+@router.get("", response_model=SearchResponse)
+async def search(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=20, ge=1, le=50),
+    offset: int = Query(default=0, ge=0),
+    db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
+):
+    """Ranked step-level hits across lesson titles and slide text, accent-insensitive."""
+    matches = await search_documents(db, q, kind=KIND_STEP, limit=limit, offset=offset)
+    results = []
+    for match in matches:
+        step = catalog.steps_by_id.get(match.step_id)
+        story = catalog.stories_by_id.get(match.story_id)
+        # Unpublished or not-yet-reloaded content is skipped
+        if not step or not story or not story.is_published:
+            continue
+        results.append(SearchHitResponse(
+            step_id=step.id,
+            step_title=step.title,
+            chapter_id=step.chapter_id,
+            chapter_title=step.chapter_title,
+            story_id=story.id,
+            story_slug=story.slug,
+            story_title=story.title,
+            snippet=match.snippet,
+            score=match.score,
+        ))
+    return SearchResponse(query=q, results=results)
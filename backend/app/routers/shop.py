@@ -5,39 +5,35 @@ from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
 
 from app.database import get_db
-from app.models import User, ShopItem, UserInventory
+from app.models import User, UserInventory
 from app.schemas import ShopItemResponse, BuyItemResponse, InventoryItemResponse, UserResponse, HeartsResponse
 from app.auth import get_current_user
-from app.hearts import sync_hearts, seconds_until_next_heart, MAX_HEARTS
+from app.registry import ReferenceData, get_registry
+from app.hearts import heart_state, set_hearts, MAX_HEARTS
+from app.learning_context import LearningContext, get_learning_context
 
 router = APIRouter(prefix="/shop", tags=["shop"])
 
 
 @router.get("/items", response_model=list[ShopItemResponse])
 async def list_shop_items(
-    db: AsyncSession = Depends(get_db),
+    registry: ReferenceData = Depends(get_registry),
     current_user: User = Depends(get_current_user),
 ):
     """Return all active shop items."""
-    result = await db.execute(
-        select(ShopItem)
-        .where(ShopItem.is_active == True)
-        .order_by(ShopItem.order_index, ShopItem.price)
-    )
-    return result.scalars().all()
+    return registry.shop_items
 
 
 @router.post("/buy/{item_id}", response_model=BuyItemResponse)
 async def buy_item(
     item_id: int,
     db: AsyncSession = Depends(get_db),
+    registry: ReferenceData = Depends(get_registry),
     current_user: User = Depends(get_current_user),
+    learning: LearningContext = Depends(get_learning_context),
 ):
     """Purchase a shop item with coins."""
-    result = await db.execute(
-        select(ShopItem).where(ShopItem.id == item_id, ShopItem.is_active == True)
-    )
-    item = result.scalar_one_or_none()
+    item = registry.shop_items_by_id.get(item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
@@ -53,45 +49,12 @@ async def buy_item(
 
     # Hearts always pool into one inventory row (any heart item), using effect_value as count
     if item.item_type == "heart":
-        qty_to_add = item.effect_value or 1
-        # Find any existing heart inventory row for this user
-        heart_inv_result = await db.execute(
-            select(UserInventory)
-            .join(ShopItem, UserInventory.item_id == ShopItem.id)
-            .where(
-                UserInventory.user_id == current_user.id,
-                ShopItem.item_type == "heart",
-            )
-        )
-        existing_heart = heart_inv_result.scalar_one_or_none()
-        if existing_heart:
-            existing_heart.quantity += qty_to_add
-        else:
-            db.add(UserInventory(
-                user_id=current_user.id,
-                item_id=3,
-                quantity=qty_to_add,
-                is_active=True,
-            ))
+        await learning.add_item("heart", item_id, item.effect_value or 1, pooled=True)
     else:
         # All other stackable items: stack by item_id
-        inv_result = await db.execute(
-            select(UserInventory).where(
-                UserInventory.user_id == current_user.id,
-                UserInventory.item_id == item_id,
-            )
-        )
-        existing = inv_result.scalar_one_or_none()
-        if existing:
-            existing.quantity += 1
-        else:
-            db.add(UserInventory(
-                user_id=current_user.id,
-                item_id=item_id,
-                quantity=1,
-                is_active=True,
-            ))
+        await learning.add_item(item.item_type, item_id)
 
+    await learning.flush()
     await db.commit()
     await db.refresh(current_user)
 
@@ -174,13 +137,12 @@ async def get_hearts(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Return current heart count and time until next restore."""
-    sync_hearts(current_user)
-    await db.commit()
+    """Return current heart count and time until next restore (computed, nothing is written)."""
+    state = heart_state(current_user)
     return HeartsResponse(
-        hearts=current_user.hearts if current_user.hearts is not None else MAX_HEARTS,
+        hearts=state.hearts,
         max_hearts=MAX_HEARTS,
-        seconds_until_restore=seconds_until_next_heart(current_user),
+        seconds_until_restore=state.seconds_until_restore,
     )
 
 
@@ -188,42 +150,31 @@ async def get_hearts(
 async def use_heart(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    learning: LearningContext = Depends(get_learning_context),
 ):
     """Use one heart from inventory to restore +1 heart."""
-    sync_hearts(current_user)
-    if (current_user.hearts or 0) >= MAX_HEARTS:
+    hearts = heart_state(current_user).hearts
+    if hearts >= MAX_HEARTS:
         raise HTTPException(status_code=400, detail="Tim đã đầy!")
 
     # Find a heart item in inventory
-    result = await db.execute(
-        select(UserInventory)
-        .options(selectinload(UserInventory.item))
-        .where(
-            UserInventory.user_id == current_user.id,
-            UserInventory.quantity > 0,
-        )
-    )
-    inv_rows = result.scalars().all()
-    heart_inv = next((r for r in inv_rows if r.item and r.item.item_type == "heart"), None)
+    heart_inv = await learning.inventory_item("heart")
     if not heart_inv:
         raise HTTPException(status_code=400, detail="Không có tim trong kho!")
 
     # Consume one from inventory
-    if heart_inv.quantity > 1:
-        heart_inv.quantity -= 1
-    else:
-        await db.delete(heart_inv)
+    await learning.consume_item(heart_inv)
 
     # Restore one heart
-    current_user.hearts = (current_user.hearts or 0) + 1
-    if (current_user.hearts or 0) >= MAX_HEARTS:
-        current_user.last_heart_restore_at = None
+    set_hearts(current_user, hearts + 1)
 
+    await learning.flush()
     await db.commit()
     await db.refresh(current_user)
+    state = heart_state(current_user)
     return HeartsResponse(
-        hearts=current_user.hearts,
+        hearts=state.hearts,
         max_hearts=MAX_HEARTS,
-        seconds_until_restore=seconds_until_next_heart(current_user),
+        seconds_until_restore=state.seconds_until_restore,
     )
 
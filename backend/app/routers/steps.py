@@ -1,82 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
-from datetime import datetime, date, timedelta
+from sqlalchemy import select
+from datetime import datetime
+from typing import Optional
 from app.database import get_db
-from app.models import Step, Slide, StepProgress, Chapter, Story, User, Enrollment, SlideProgress, StreakWeek, Achievement, UserAchievement, UserInventory, ShopItem
+from app.models import User, SlideProgress
 from app.schemas import StepDetailResponse, SlideResponse, StepCompleteRequest, SlideCompleteRequest
-from app.auth import get_current_user
-from app.routers.quests import tick_quest_progress
-from app.hearts import sync_hearts, deduct_heart, seconds_until_next_heart
+from app.auth import get_current_user, get_current_user_optional
+from app.hearts import heart_state, deduct_heart
+from app.catalog import ContentCatalog, get_catalog
+from app.learning_context import LearningContext, get_learning_context
+from app.registry import get_registry
+from app.leaderboard import rank_index
+from app.achievements import AchievementEvent, process_events, STREAK_CHANGED
+from app.streaks import tz_offset_from, remember_tz_offset, local_today, update_streak, mark_active_day
+from app.daily_activity import record_activity
+from app import step_completion
+from app.config import settings
+from app.http_cache import make_etag, coding_etag, etag_matches, not_modified
+from app.slide_cache import slide_cache
+from app.stats_cache import stats_cache
+from app.routers.chapters import stream_chapter_bundle
+
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/steps", tags=["steps"])
 
 
-def update_streak(user: User, tz_offset_minutes: int | None = None) -> dict:
-    """Update user's streak based on activity dates.
-    Returns dict with streak info."""
-    # compute user-local today using tz offset (minutes) if provided, otherwise server local date
-    if tz_offset_minutes is not None:
-        now = datetime.utcnow() + timedelta(minutes=tz_offset_minutes)
-        today = now.date()
-    else:
-        today = date.today()
-
-    last_activity = None
-    if user.last_activity_date:
-        try:
-            # store last_activity_date in UTC; convert to user-local date for comparison
-            lad = user.last_activity_date
-            if tz_offset_minutes is not None:
-                lad_local = lad + timedelta(minutes=tz_offset_minutes)
-                last_activity = lad_local.date()
-            else:
-                last_activity = lad.date()
-        except Exception:
-            last_activity = user.last_activity_date.date()
-    
-    streak_increased = False
-    streak_reset = False
-    
-    if last_activity is None:
-        # First activity ever
-        user.current_streak = 1
-        streak_increased = True
-    elif last_activity == today:
-        # Already active today, no change
-        pass
-    elif last_activity == today - timedelta(days=1):
-        # Active yesterday, continue streak
-        user.current_streak += 1
-        streak_increased = True
-    else:
-        # Missed at least one day, reset streak
-        user.current_streak = 1
-        streak_reset = True
-    
-    # Update longest streak if needed
-    if user.current_streak > user.longest_streak:
-        user.longest_streak = user.current_streak
-    
-    # Update last activity date (store in UTC)
-    user.last_activity_date = datetime.utcnow()
-    
-    return {
-        "current_streak": user.current_streak,
-        "longest_streak": user.longest_streak,
-        "streak_increased": streak_increased,
-        "streak_reset": streak_reset
-    }
-
 @router.get("/{step_id}", response_model=StepDetailResponse)
-async def get_step(step_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Step)
-        .options(selectinload(Step.chapter).selectinload(Chapter.story))
-        .where(Step.id == step_id)
-    )
-    step = result.scalar_one_or_none()
+async def get_step(step_id: int, catalog: ContentCatalog = Depends(get_catalog)):
+    step = catalog.steps_by_id.get(step_id)
     
     if not step:
         raise HTTPException(status_code=404, detail="Step not found")
@@ -85,21 +40,44 @@ async def get_step(step_id: int, db: AsyncSession = Depends(get_db)):
         id=step.id,
         title=step.title,
         description=step.description,
-        chapter_title=step.chapter.title,
-        story_slug=step.chapter.story.slug,
+        chapter_title=step.chapter_title,
+        story_slug=step.story_slug,
         xp_reward=step.xp_reward
     )
 
 @router.get("/{step_id}/slides", response_model=list[SlideResponse])
-async def get_slides(step_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Slide)
-        .where(Slide.step_id == step_id)
-        .order_by(Slide.order_index)
-    )
-    slides = result.scalars().all()
-    
-    return [SlideResponse.model_validate(s) for s in slides]
+async def get_slides(
+    step_id: int,
+    request: Request,
+    catalog: ContentCatalog = Depends(get_catalog)
+):
+    step = catalog.steps_by_id.get(step_id)
+    if not step:
+        return []
+
+    # Serve pre-encoded (and precompressed) bytes straight from the LRU
+    encoded = slide_cache.get(step, catalog.version)
+    coding, body = encoded.select(request.headers.get("accept-encoding"))
+
+    # Slides are user-independent: the sync-time content hash (per content coding) is the ETag
+    etag = coding_etag(make_etag(step.content_hash), coding)
+    if etag_matches(request, etag):
+        return not_modified(etag, settings.content_cache_control, vary="Accept-Encoding")
+    return encoded.to_response(coding, body, {"ETag": etag, "Cache-Control": settings.content_cache_control})
+
+@router.get("/{step_id}/bundle")
+async def get_step_bundle(
+    step_id: int,
+    db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """Bundle of the step's chapter, streaming the requested step first."""
+    step = catalog.steps_by_id.get(step_id)
+    if not step:
+        raise HTTPException(status_code=404, detail="Step not found")
+    chapter = catalog.chapters_by_id[step.chapter_id]
+    return await stream_chapter_bundle(chapter, catalog, db, current_user, focus_step_id=step.id)
 
 @router.post("/{step_id}/complete")
 async def complete_step(
@@ -107,241 +85,16 @@ async def complete_step(
     data: StepCompleteRequest,
     request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    catalog: ContentCatalog = Depends(get_catalog),
+    current_user: User = Depends(get_current_user),
+    learning: LearningContext = Depends(get_learning_context),
 ):
-    # Get step (include chapter/story so we can validate enrollment)
-    result = await db.execute(
-        select(Step)
-        .options(selectinload(Step.chapter).selectinload(Chapter.story))
-        .where(Step.id == step_id)
-    )
-    step = result.scalar_one_or_none()
-    
-    if not step:
-        raise HTTPException(status_code=404, detail="Step not found")
-
-    # Require enrollment in the parent story before allowing completion
-    enroll_res = await db.execute(
-        select(Enrollment).where(
-            Enrollment.user_id == current_user.id,
-            Enrollment.story_id == step.chapter.story_id
-        )
-    )
-    if enroll_res.scalar_one_or_none() is None:
-        raise HTTPException(status_code=403, detail="You must enroll in the course to study this lesson")
-
-    # Check/create progress
-    progress_result = await db.execute(
-        select(StepProgress).where(
-            StepProgress.user_id == current_user.id,
-            StepProgress.step_id == step_id
-        )
+    """Complete a step: rewards, streak, quests and achievements in one transaction
+    (see app.step_completion)."""
+    completion = await step_completion.complete_step(
+        db, catalog, current_user, step_id, data, tz_offset=tz_offset_from(request), learning=learning
     )
-    progress = progress_result.scalar_one_or_none()
-    
-    xp_earned = 0
-    coins_earned = 0
-    
-    xp_boost_active = False
-
-    async def _apply_boost_and_reward(base_xp: int, base_coins: int):
-        """Apply xp boost if available, then credit user. Returns (xp_earned, coins_earned, boost_used)."""
-        nonlocal xp_boost_active
-        boost_res = await db.execute(
-            select(UserInventory)
-            .join(ShopItem, UserInventory.item_id == ShopItem.id)
-            .where(
-                UserInventory.user_id == current_user.id,
-                ShopItem.item_type == "xp_boost",
-                UserInventory.quantity > 0,
-            )
-        )
-        boost_inv = boost_res.scalar_one_or_none()
-        xp = base_xp
-        if boost_inv:
-            xp *= 2
-            boost_inv.quantity -= 1
-            xp_boost_active = True
-        current_user.xp += xp
-        current_user.coins = (current_user.coins or 0) + base_coins
-        return xp, base_coins
-
-    if not progress:
-        progress = StepProgress(
-            user_id=current_user.id,
-            step_id=step_id,
-            is_completed=True,
-            score=data.score,
-            time_spent_seconds=data.time_spent_seconds,
-            completed_at=datetime.utcnow()
-        )
-        db.add(progress)
-        base_xp = step.xp_reward + data.quizzes_correct * 15
-        xp_earned, coins_earned = await _apply_boost_and_reward(base_xp, step.coin_reward)
-    elif not progress.is_completed:
-        progress.is_completed = True
-        progress.score = data.score
-        progress.time_spent_seconds = data.time_spent_seconds
-        progress.completed_at = datetime.utcnow()
-        base_xp = step.xp_reward + data.quizzes_correct * 15
-        xp_earned, coins_earned = await _apply_boost_and_reward(base_xp, step.coin_reward)
-
-    # Deduct 1 heart if more than half of quizzes were wrong (first completion only)
-    if xp_earned > 0 and data.quizzes_total > 0:
-        wrong = data.quizzes_total - data.quizzes_correct
-        if wrong / data.quizzes_total > 0.5:
-            deduct_heart(current_user)
-
-    # Update streak (in-memory fields)
-    # read tz offset header if present (minutes offset from UTC)
-    tz_offset = None
-    try:
-        hdr = request.headers.get('x-user-tz-offset') or request.headers.get('x-tz-offset')
-        if hdr is not None:
-            tz_offset = int(hdr)
-    except Exception:
-        tz_offset = None
-
-    streak_info = update_streak(current_user, tz_offset)
-
-    # Streak milestone bonus: every 7-day streak = +20 coins
-    streak_bonus = 0
-    cur_streak = current_user.current_streak or 0
-    if coins_earned > 0 and cur_streak > 0 and cur_streak % 7 == 0:
-        streak_bonus = 20
-        current_user.coins = (current_user.coins or 0) + streak_bonus
-        coins_earned += streak_bonus
-
-    # Persist today's completion into StreakWeek for the current week using user-local date
-    try:
-        if tz_offset is not None:
-            now = datetime.utcnow() + timedelta(minutes=tz_offset)
-            today_local = now.date()
-        else:
-            today_local = date.today()
-
-        monday = today_local - timedelta(days=today_local.weekday())
-        week_start = monday.isoformat()
-        today_idx = today_local.weekday()
-
-        sw_res = await db.execute(select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == week_start))
-        sw_entry = sw_res.scalar_one_or_none()
-        if sw_entry:
-            days = sw_entry.days or [False]*7
-            if 0 <= today_idx < 7:
-                days[today_idx] = True
-            sw_entry.days = days
-        else:
-            days = [False]*7
-            if 0 <= today_idx < 7:
-                days[today_idx] = True
-            sw_entry = StreakWeek(user_id=current_user.id, week_start=week_start, days=days)
-            db.add(sw_entry)
-    except Exception:
-        # don't break step completion on streak persistence errors
-        pass
-
-    # Tick quest progress for lesson completion
-    if xp_earned > 0:
-        try:
-            await tick_quest_progress(current_user.id, "lessons", 1, db)
-            await tick_quest_progress(current_user.id, "slides", 1, db)
-            if data.time_spent_seconds > 0:
-                await tick_quest_progress(current_user.id, "study_time", data.time_spent_seconds, db)
-            if data.quizzes_correct > 0:
-                await tick_quest_progress(current_user.id, "quizzes", data.quizzes_correct, db)
-            if data.quizzes_total >= 1 and data.quizzes_correct == data.quizzes_total:
-                await tick_quest_progress(current_user.id, "perfect_quiz", 1, db)
-            # Check streak-based quests
-            await tick_quest_progress(current_user.id, "streak", current_user.current_streak or 0, db)
-        except Exception:
-            pass
-
-    # Auto-check achievements after each step (awards XP + coins for milestones)
-    try:
-        from app.routers.progress import check_and_award_achievements as _check_ach
-        from fastapi import Request as _Req
-        await _check_ach(db=db, current_user=current_user)
-    except Exception:
-        pass
-
-    await db.commit()
-
-    # ── Auto-check and award achievements ─────────────────────────────────
-    newly_earned = []
-    try:
-        # Grab all achievements the user hasn't earned yet
-        subq = select(UserAchievement.achievement_id).where(
-            UserAchievement.user_id == current_user.id
-        )
-        unearned_res = await db.execute(
-            select(Achievement).where(Achievement.id.notin_(subq))
-        )
-        unearned = unearned_res.scalars().all()
-
-        if unearned:
-            # Count completed steps for this user
-            steps_res = await db.execute(
-                select(func.count(StepProgress.id)).where(
-                    StepProgress.user_id == current_user.id,
-                    StepProgress.is_completed == True
-                )
-            )
-            completed_steps = steps_res.scalar() or 0
-
-            # Count completed stories
-            completed_stories = 0
-            enroll_res2 = await db.execute(
-                select(Enrollment).where(Enrollment.user_id == current_user.id)
-            )
-            from app.routers.stories import calculate_story_progress
-            for enr in enroll_res2.scalars().all():
-                prog = await calculate_story_progress(db, current_user.id, enr.story_id)
-                if prog >= 100:
-                    completed_stories += 1
-
-            for ach in unearned:
-                earned = False
-                if ach.requirement_type == "xp" and current_user.xp >= ach.requirement_value:
-                    earned = True
-                elif ach.requirement_type == "steps" and completed_steps >= ach.requirement_value:
-                    earned = True
-                elif ach.requirement_type == "streak" and current_user.current_streak >= ach.requirement_value:
-                    earned = True
-                elif ach.requirement_type == "stories" and completed_stories >= ach.requirement_value:
-                    earned = True
-
-                if earned:
-                    db.add(UserAchievement(
-                        user_id=current_user.id,
-                        achievement_id=ach.id
-                    ))
-                    current_user.xp += ach.xp_reward
-                    newly_earned.append({
-                        "id": ach.id,
-                        "title": ach.title,
-                        "icon": ach.icon,
-                        "xp_reward": ach.xp_reward
-                    })
-
-            if newly_earned:
-                await db.commit()
-    except Exception as e:
-        # Don't break step completion if achievement check fails
-        import logging
-        logging.getLogger(__name__).warning("Achievement check failed: %s", e)
-
-    return {
-        "success": True,
-        "xp_earned": xp_earned,
-        "coins_earned": coins_earned,
-        "total_xp": current_user.xp,
-        "total_coins": current_user.coins or 0,
-        "hearts": current_user.hearts if current_user.hearts is not None else 5,
-        "xp_boost_active": xp_boost_active,
-        "streak": streak_info,
-        "newly_earned_achievements": newly_earned
-    }
+    return completion.response()
 
 
 @router.post("/{step_id}/slides/{slide_id}/complete")
@@ -351,31 +104,20 @@ async def complete_slide(
     data: SlideCompleteRequest,
     request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    catalog: ContentCatalog = Depends(get_catalog),
+    current_user: User = Depends(get_current_user),
+    learning: LearningContext = Depends(get_learning_context),
 ):
     # Verify step and slide
-    result = await db.execute(
-        select(Step)
-        .options(selectinload(Step.chapter).selectinload(Chapter.story))
-        .where(Step.id == step_id)
-    )
-    step = result.scalar_one_or_none()
+    step = catalog.steps_by_id.get(step_id)
     if not step:
         raise HTTPException(status_code=404, detail="Step not found")
 
-    slide_res = await db.execute(select(Slide).where(Slide.id == slide_id, Slide.step_id == step_id))
-    slide = slide_res.scalar_one_or_none()
-    if not slide:
+    if not any(sl.id == slide_id for sl in step.slides):
         raise HTTPException(status_code=404, detail="Slide not found")
 
     # Require enrollment
-    enroll_res = await db.execute(
-        select(Enrollment).where(
-            Enrollment.user_id == current_user.id,
-            Enrollment.story_id == step.chapter.story_id
-        )
-    )
-    if enroll_res.scalar_one_or_none() is None:
+    if not await learning.is_enrolled(step.story_id):
         raise HTTPException(status_code=403, detail="You must enroll in the course to study this lesson")
 
     # Check if already completed
@@ -388,6 +130,9 @@ async def complete_slide(
     sp = sp_res.scalar_one_or_none()
 
     xp_earned = 0
+    newly_earned = []
+    streak_before = current_user.current_streak or 0
+    xp_before = current_user.xp or 0
     if sp is None:
         sp = SlideProgress(
             user_id=current_user.id,
@@ -398,117 +143,35 @@ async def complete_slide(
         db.add(sp)
         # Quiz XP is consolidated at step completion — not awarded per slide
 
-        # Only update streak once per day: skip if user was already active today
-        tz_offset = None
-        try:
-            hdr = request.headers.get('x-user-tz-offset') or request.headers.get('x-tz-offset')
-            if hdr is not None:
-                tz_offset = int(hdr)
-        except Exception:
-            tz_offset = None
-
-        if tz_offset is not None:
-            now_local = datetime.utcnow() + timedelta(minutes=tz_offset)
-            today_local = now_local.date()
-        else:
-            today_local = date.today()
-
-        already_active_today = False
-        if current_user.last_activity_date:
-            try:
-                lad = current_user.last_activity_date
-                lad_local = (lad + timedelta(minutes=tz_offset)).date() if tz_offset is not None else lad.date()
-                already_active_today = (lad_local == today_local)
-            except Exception:
-                pass
-
-        streak_info = update_streak(current_user, tz_offset)
+        tz_offset = remember_tz_offset(current_user, tz_offset_from(request))
+        calendar = None
         try:
-            if tz_offset is not None:
-                now = datetime.utcnow() + timedelta(minutes=tz_offset)
-                today_local = now.date()
-            else:
-                today_local = date.today()
-            monday = today_local - timedelta(days=today_local.weekday())
-            week_start = monday.isoformat()
-            today_idx = today_local.weekday()
-            sw_res = await db.execute(select(StreakWeek).where(StreakWeek.user_id == current_user.id, StreakWeek.week_start == week_start))
-            sw_entry = sw_res.scalar_one_or_none()
-            if sw_entry:
-                days = sw_entry.days or [False]*7
-                if 0 <= today_idx < 7:
-                    days[today_idx] = True
-                sw_entry.days = days
-            else:
-                days = [False]*7
-                if 0 <= today_idx < 7:
-                    days[today_idx] = True
-                sw_entry = StreakWeek(user_id=current_user.id, week_start=week_start, days=days)
-                db.add(sw_entry)
+            async with db.begin_nested():
+                calendar = await mark_active_day(db, current_user.id, tz_offset, await learning.calendar())
         except Exception:
             pass
+        update_streak(current_user, tz_offset, calendar)
 
         # slides quest is now tracked at lesson (step) completion level
 
+        # Award streak achievements crossed by this slide (same transaction)
+        if (current_user.current_streak or 0) > streak_before:
+            try:
+                event = AchievementEvent(STREAK_CHANGED, current_user.current_streak or 0, streak_before)
+                async with db.begin_nested():
+                    newly_earned = await process_events(db, current_user, [event], await get_registry(db))
+            except Exception as e:
+                logger.warning("Achievement check failed on slide complete: %s", e)
+                newly_earned = []
+
+        await record_activity(
+            db, current_user.id, local_today(tz_offset), slides=1, xp=(current_user.xp or 0) - xp_before
+        )
+        await learning.flush()
         await db.commit()
-    else:
-        # already completed — idempotent
-        xp_earned = 0
-        streak_info = {"current_streak": current_user.current_streak, "longest_streak": current_user.longest_streak}
-
-    # ── Auto-check and award achievements ─────────────────────────────────
-    newly_earned = []
-    try:
-        from sqlalchemy import func
-        from app.models import Achievement, UserAchievement, StepProgress, Enrollment
-        subq = select(UserAchievement.achievement_id).where(UserAchievement.user_id == current_user.id)
-        unearned_res = await db.execute(select(Achievement).where(Achievement.id.notin_(subq)))
-        unearned = unearned_res.scalars().all()
-
-        if unearned:
-            steps_res = await db.execute(
-                select(func.count(StepProgress.id)).where(
-                    StepProgress.user_id == current_user.id,
-                    StepProgress.is_completed == True
-                )
-            )
-            completed_steps = steps_res.scalar() or 0
-
-            completed_stories = 0
-            enroll_res2 = await db.execute(select(Enrollment).where(Enrollment.user_id == current_user.id))
-            from app.routers.stories import calculate_story_progress
-            for enr in enroll_res2.scalars().all():
-                prog = await calculate_story_progress(db, current_user.id, enr.story_id)
-                if prog >= 100:
-                    completed_stories += 1
-
-            for ach in unearned:
-                earned = False
-                if ach.requirement_type == "xp" and current_user.xp >= ach.requirement_value:
-                    earned = True
-                elif ach.requirement_type == "steps" and completed_steps >= ach.requirement_value:
-                    earned = True
-                elif ach.requirement_type == "streak" and current_user.current_streak >= ach.requirement_value:
-                    earned = True
-                elif ach.requirement_type == "stories" and completed_stories >= ach.requirement_value:
-                    earned = True
-
-                if earned:
-                    db.add(UserAchievement(user_id=current_user.id, achievement_id=ach.id))
-                    current_user.xp += ach.xp_reward
-                    newly_earned.append({
-                        "id": ach.id,
-                        "title": ach.title,
-                        "icon": ach.icon,
-                        "xp_reward": ach.xp_reward
-                    })
-
-            if newly_earned:
-                await db.commit()
-    except Exception as e:
-        import logging
-        logging.getLogger(__name__).warning("Achievement check failed on slide complete: %s", e)
 
+    rank_index.record(current_user)
+    stats_cache.invalidate(current_user.id)
     return {
         "success": True,
         "xp_earned": xp_earned,
@@ -521,21 +184,22 @@ async def complete_slide(
 async def quit_step(
     step_id: int,
     db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
     current_user: User = Depends(get_current_user),
 ):
     """Called when user quits a lesson mid-way. Deducts 1 heart."""
     # Verify the step exists
-    result = await db.execute(select(Step).where(Step.id == step_id))
-    if not result.scalar_one_or_none():
+    if step_id not in catalog.steps_by_id:
         raise HTTPException(status_code=404, detail="Step not found")
 
-    sync_hearts(current_user)
     heart_deducted = deduct_heart(current_user)
-    await db.commit()
+    if heart_deducted:
+        await db.commit()
 
+    state = heart_state(current_user)
     return {
         "success": True,
-        "hearts": current_user.hearts if current_user.hearts is not None else 5,
+        "hearts": state.hearts,
         "heart_deducted": heart_deducted,
-        "seconds_until_restore": seconds_until_next_heart(current_user),
+        "seconds_until_restore": state.seconds_until_restore,
     }
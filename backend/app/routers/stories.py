@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy import select
 from typing import Optional
 from app.database import get_db
-from app.models import Story, Chapter, Step, Enrollment, StepProgress, User, Category
+from app.models import Enrollment, StepProgress, User
 from app.schemas import StoryListResponse, StoryDetailResponse, ChapterResponse, StepResponse
 from app.auth import get_current_user_optional, get_current_user
+from app.catalog import ContentCatalog, StoryNode, get_catalog
+from app.config import settings
+from app.http_cache import make_etag, etag_matches, set_cache_headers, not_modified
+from app.search import search_documents, KIND_STORY
+from app.pagination import encode_cursor, decode_cursor
+from app.story_progress import completed_steps_by_story
+from app.stats_cache import stats_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,87 +20,123 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/stories", tags=["stories"])
 
 
-def _count_quiz_blocks_in_story(story) -> int:
-    """Count quiz blocks across all slides in a Story object (in-memory)."""
-    total = 0
-    for ch in getattr(story, 'chapters', []) or []:
-        for st in getattr(ch, 'steps', []) or []:
-            for slide in getattr(st, 'slides', []) or []:
-                blocks = slide.blocks or []
-                if not isinstance(blocks, list):
-                    continue
-                for b in blocks:
-                    if not isinstance(b, dict):
-                        continue
-                    if b.get('type') == 'quiz' or b.get('block_type') == 'quiz':
-                        total += 1
-    return total
+def story_progress_from_steps(story: StoryNode, completed_steps: set[int]) -> int:
+    """Progress % of a catalog story given the user's completed step ids."""
+    story_step_ids = story.step_ids
+    if not story_step_ids:
+        return 0
+    return int((len(completed_steps & story_step_ids) / len(story_step_ids)) * 100)
+
+
+def build_chapter_responses(story: StoryNode, completed_steps: set[int], mark_current: bool = True) -> list[ChapterResponse]:
+    """Overlay the user's completion state on the catalog chapter/step tree."""
+    chapters = []
+    found_current = False
+
+    for chapter in story.chapters:
+        steps = []
+        for step in chapter.steps:
+            is_completed = step.id in completed_steps
+            is_current = not is_completed and not found_current and mark_current
+
+            if is_current:
+                found_current = True
+
+            steps.append(StepResponse(
+                id=step.id,
+                title=step.title,
+                description=step.description,
+                xp_reward=step.xp_reward,
+                is_completed=is_completed,
+                is_current=is_current
+            ))
+
+        chapters.append(ChapterResponse(
+            id=chapter.id,
+            title=chapter.title,
+            description=chapter.description,
+            steps=steps
+        ))
+    return chapters
+
 
 @router.get("", response_model=list[StoryListResponse])
 async def get_stories(
+    response: Response,
     search: Optional[str] = None,
     featured: Optional[bool] = None,
     enrolled: Optional[bool] = None,
     limit: int = Query(default=20, le=100),
     offset: int = 0,
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
-    # Use joinedload to eagerly load category and slides so we can compute exercise count
-    query = select(Story).options(
-        joinedload(Story.category),
-        selectinload(Story.chapters).selectinload(Chapter.steps).selectinload(Step.slides)
-    ).where(Story.is_published == True)
-    
+    """Published stories. Page with `cursor` (from the X-Next-Cursor header) or legacy `offset`."""
+    # Content comes from the in-memory catalog (already ordered by (order_index, id))
+    stories = [s for s in catalog.stories if s.is_published]
+
+    if cursor:
+        after = decode_cursor(cursor, 2)
+        stories = [s for s in stories if (s.order_index or 0, s.id) > after]
+        offset = 0
+
     if search:
-        query = query.where(Story.title.ilike(f"%{search}%"))
-    
+        # Accent-insensitive full-text match on title/description (see app.search)
+        matches = await search_documents(db, search, kind=KIND_STORY, limit=max(len(catalog.stories), 1))
+        matched_ids = {m.story_id for m in matches}
+        stories = [s for s in stories if s.id in matched_ids]
+
     if featured:
-        query = query.where(Story.is_featured == True)
-    
-    query = query.order_by(Story.order_index).offset(offset).limit(limit)
-    result = await db.execute(query)
-    stories = result.unique().scalars().all()
-    
-    response = []
-    for story in stories:
-        # Get chapter count
-        chapter_result = await db.execute(
-            select(func.count(Chapter.id)).where(Chapter.story_id == story.id)
-        )
-        chapter_count = chapter_result.scalar() or 0
-        
-        # Check enrollment and progress
-        is_enrolled = False
-        progress = 0
-        
-        if current_user:
+        stories = [s for s in stories if s.is_featured]
+
+    # Enrollment lookup: one IN query. When filtering by `enrolled` it runs over
+    # every candidate before pagination so pages stay stable.
+    enrolled_ids = set()
+    if current_user:
+        candidates = stories if enrolled is not None else stories[offset:offset + limit]
+        if candidates:
             enrollment_result = await db.execute(
-                select(Enrollment).where(
+                select(Enrollment.story_id).where(
                     Enrollment.user_id == current_user.id,
-                    Enrollment.story_id == story.id
+                    Enrollment.story_id.in_([s.id for s in candidates])
                 )
             )
-            is_enrolled = enrollment_result.scalar_one_or_none() is not None
-            
-            if is_enrolled:
-                progress = await calculate_story_progress(db, current_user.id, story.id)
-        
-        if enrolled is not None and is_enrolled != enrolled:
-            continue
-        
-        # Access category safely - already loaded
-        category_name = story.category.name if story.category else None
+            enrolled_ids = set(enrollment_result.scalars().all())
+
+    if enrolled is not None:
+        stories = [s for s in stories if (s.id in enrolled_ids) == enrolled]
+
+    has_more = len(stories) > offset + limit
+    stories = stories[offset:offset + limit]
+    if has_more and stories:
+        last = stories[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.order_index or 0, last.id)
+
+    # Completed steps per story for the page: one read of user_story_progress
+    completed_by_story = {}
+    if current_user:
+        page_enrolled = [s.id for s in stories if s.id in enrolled_ids]
+        completed_by_story = await completed_steps_by_story(db, current_user.id, page_enrolled)
+    
+    results = []
+    for story in stories:
+        chapter_count = story.stats.chapter_count
+        is_enrolled = story.id in enrolled_ids
+        progress = 0
+        if is_enrolled and story.stats.step_count > 0:
+            progress = int((completed_by_story.get(story.id, 0) / story.stats.step_count) * 100)
         
-        # Count exercises (quiz blocks) from preloaded slides
-        exercises_count = _count_quiz_blocks_in_story(story)
+        # Exercises (quiz blocks) are materialized at sync time
+        exercises_count = story.stats.quiz_count
         
         # Story is completed when progress is 100%
         is_completed = progress == 100
 
         logger.debug(f"[stories.get_stories] slug={story.slug} illustration={story.illustration!r} thumbnail_url={story.thumbnail_url!r} exercises={exercises_count}")
         
-        response.append(StoryListResponse(
+        results.append(StoryListResponse(
             id=story.id,
             slug=story.slug,
             title=story.title,
@@ -103,7 +145,7 @@ async def get_stories(
             description=story.description,
             icon=story.icon,
             color=story.color,
-            category_name=category_name,
+            category_name=story.category_name,
             chapter_count=chapter_count,
             exercises=exercises_count,
             progress=progress,
@@ -111,23 +153,18 @@ async def get_stories(
             is_completed=is_completed
         ))
     
-    return response
+    return results
 
 @router.get("/{slug}", response_model=StoryDetailResponse)
 async def get_story(
     slug: str,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
-    result = await db.execute(
-        select(Story)
-        .options(
-            joinedload(Story.category),
-            selectinload(Story.chapters).selectinload(Chapter.steps).selectinload(Step.slides)
-        )
-        .where(Story.slug == slug)
-    )
-    story = result.unique().scalar_one_or_none()
+    story = catalog.stories_by_slug.get(slug)
     
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
@@ -147,8 +184,6 @@ async def get_story(
         is_enrolled = enrollment_result.scalar_one_or_none() is not None
         
         if is_enrolled:
-            progress = await calculate_story_progress(db, current_user.id, story.id)
-            
             # Get completed steps
             progress_result = await db.execute(
                 select(StepProgress.step_id).where(
@@ -157,46 +192,24 @@ async def get_story(
                 )
             )
             completed_steps = set(progress_result.scalars().all())
+            progress = story_progress_from_steps(story, completed_steps)
+
+    # ETag = sync-time content hash, plus the user's overlay when signed in
+    if current_user:
+        etag = make_etag(story.content_hash, is_enrolled, sorted(completed_steps & story.step_ids))
+        cache_control = "private, no-cache"
+    else:
+        etag = make_etag(story.content_hash)
+        cache_control = settings.content_cache_control
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control, vary="Authorization, Cookie")
+    set_cache_headers(response, etag, cache_control, vary="Authorization, Cookie")
     
-    # Build chapters with steps
-    chapters = []
-    found_current = False
-    
-    # Sort chapters and steps by order_index
-    sorted_chapters = sorted(story.chapters, key=lambda c: c.order_index or 0)
-    
-    for chapter in sorted_chapters:
-        steps = []
-        sorted_steps = sorted(chapter.steps, key=lambda s: s.order_index or 0)
-        
-        for step in sorted_steps:
-            is_completed = step.id in completed_steps
-            is_current = not is_completed and not found_current and is_enrolled
-            
-            if is_current:
-                found_current = True
-            
-            steps.append(StepResponse(
-                id=step.id,
-                title=step.title,
-                description=step.description,
-                xp_reward=step.xp_reward,
-                is_completed=is_completed,
-                is_current=is_current
-            ))
-        
-        chapters.append(ChapterResponse(
-            id=chapter.id,
-            title=chapter.title,
-            description=chapter.description,
-            steps=steps
-        ))
-    
-    # Access category safely
-    category_name = story.category.name if story.category else None
+    # Build chapters with steps (catalog is already sorted by order_index)
+    chapters = build_chapter_responses(story, completed_steps, mark_current=is_enrolled)
 
-    # Count exercises (quiz blocks)
-    exercises_count = _count_quiz_blocks_in_story(story)
+    # Exercises (quiz blocks) are materialized at sync time
+    exercises_count = story.stats.quiz_count
     
     # Story is completed when progress is 100%
     is_completed = progress == 100
@@ -212,7 +225,7 @@ async def get_story(
         description=story.description,
         icon=story.icon,
         color=story.color,
-        category_name=category_name,
+        category_name=story.category_name,
         chapter_count=len(chapters),
         exercises=exercises_count,
         progress=progress,
@@ -225,10 +238,10 @@ async def get_story(
 async def enroll_story(
     slug: str,
     db: AsyncSession = Depends(get_db),
+    catalog: ContentCatalog = Depends(get_catalog),
     current_user: User = Depends(get_current_user)
 ):
-    result = await db.execute(select(Story).where(Story.slug == slug))
-    story = result.scalar_one_or_none()
+    story = catalog.stories_by_slug.get(slug)
     
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
@@ -246,32 +259,6 @@ async def enroll_story(
     enrollment = Enrollment(user_id=current_user.id, story_id=story.id)
     db.add(enrollment)
     await db.commit()
+    stats_cache.invalidate(current_user.id)
     
     return {"success": True}
-
-async def calculate_story_progress(db: AsyncSession, user_id: int, story_id: int) -> int:
-    # Get total steps
-    total_result = await db.execute(
-        select(func.count(Step.id))
-        .join(Chapter)
-        .where(Chapter.story_id == story_id)
-    )
-    total_steps = total_result.scalar() or 0
-    
-    if total_steps == 0:
-        return 0
-    
-    # Get completed steps
-    completed_result = await db.execute(
-        select(func.count(StepProgress.id))
-        .join(Step)
-        .join(Chapter)
-        .where(
-            Chapter.story_id == story_id,
-            StepProgress.user_id == user_id,
-            StepProgress.is_completed == True
-        )
-    )
-    completed_steps = completed_result.scalar() or 0
-    
-    return int((completed_steps / total_steps) * 100)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, Field, EmailStr, AliasChoices
+from typing import Optional, Union
+from datetime import date, datetime
 
 # Auth
 class UserCreate(BaseModel):
@@ -28,8 +28,11 @@ class UserResponse(BaseModel):
     current_streak: int
     longest_streak: int
     is_active: bool = True  # Email verification status
-    hearts: int = 5
-    last_heart_restore_at: Optional[datetime] = None
+    # Hearts are stored as an anchor; report the restored values
+    hearts: int = Field(5, validation_alias=AliasChoices("current_hearts", "hearts"))
+    last_heart_restore_at: Optional[datetime] = Field(
+        None, validation_alias=AliasChoices("heart_restore_started_at", "last_heart_restore_at")
+    )
     
     class Config:
         from_attributes = True
@@ -81,6 +84,18 @@ class StoryListResponse(BaseModel):
 class StoryDetailResponse(StoryListResponse):
     chapters: list[ChapterResponse] = []
 
+class CurrentStepResponse(BaseModel):
+    step_id: int
+    step_title: str
+    chapter_id: int
+    chapter_title: str
+
+class StorySummaryResponse(StoryListResponse):
+    """Dashboard card: progress counts and the next step instead of the full tree."""
+    step_count: int = 0
+    completed_steps: int = 0
+    current_step: Optional[CurrentStepResponse] = None
+
 # Steps
 class StepDetailResponse(BaseModel):
     id: int
@@ -103,8 +118,9 @@ class SlideResponse(BaseModel):
 
 # Progress
 class DashboardResponse(BaseModel):
-    current_story: Optional[StoryDetailResponse]
-    in_progress_stories: list[StoryDetailResponse] = []
+    view: str = "summary"  # "summary" | "full"
+    current_story: Optional[Union[StoryDetailResponse, StorySummaryResponse]]
+    in_progress_stories: list[Union[StoryDetailResponse, StorySummaryResponse]] = []
     total_xp: int
     coins: int = 0
     level: int
@@ -171,6 +187,9 @@ class LeaderboardResponse(BaseModel):
     entries: list[LeaderboardEntry]
     current_user_rank: Optional[int] = None
     total_count: Optional[int] = None
+    next_cursor: Optional[str] = None
+    board: str = "all_time"
+    snapshot_at: Optional[datetime] = None  # set when served from a materialized snapshot
 
 
 class StreakWeekRequest(BaseModel):
@@ -192,6 +211,25 @@ class StreakWeekResponse(BaseModel):
         from_attributes = True
 
 
+class HeatmapDay(BaseModel):
+    day: date
+    steps: int = 0
+    slides: int = 0
+    xp: int = 0
+    seconds: int = 0
+
+    class Config:
+        from_attributes = True
+
+
+class HeatmapResponse(BaseModel):
+    year: int
+    days: list[HeatmapDay]  # only days with activity, in order
+    active_days: int = 0
+    total_xp: int = 0
+    total_seconds: int = 0
+
+
 class HeartsResponse(BaseModel):
     hearts: int
     max_hearts: int = 5
@@ -286,4 +324,21 @@ class ClaimQuestResponse(BaseModel):
     success: bool
     coins_awarded: int
     total_coins: int
-    message: Optional[str] = None
\ No newline at end of file
+    message: Optional[str] = None
+
+# Search
+class SearchHitResponse(BaseModel):
+    step_id: int
+    step_title: str
+    chapter_id: int
+    chapter_title: str
+    story_id: int
+    story_slug: str
+    story_title: str
+    snippet: str
+    score: float
+
+
+class SearchResponse(BaseModel):
+    query: str
+    results: list[SearchHitResponse]
@@ -0,0 +1,253 @@
+"""Full-text search over course content.
+
+Text is extracted at sync time into `search_documents`: one row per story
+(title + description) and one per step (title, description and the text of
+its text/quiz/callout blocks). Matching runs on accent-folded copies of the
+text ("Đạo hàm" -> "dao ham"), indexed by an FTS5 table on SQLite or a
+generated `tsvector` column on Postgres. Folding maps every character to
+exactly one character, so match offsets in the folded text are also offsets
+into the original, which is what snippets are cut from.
+"""
+import html
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+
+from sqlalchemy import select, delete, text
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
+from sqlalchemy.orm import selectinload
+
+from app.models import Story, Chapter, Step, SearchDocument
+import logging
+
+logger = logging.getLogger(__name__)
+
+KIND_STORY = "story"
+KIND_STEP = "step"
+SNIPPET_CHARS = 160
+
+_TAG_RE = re.compile(r"</?[a-zA-Z][^<>]*>")
+_SPACE_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"\w+")
+
+# Set by init_search_index once the FTS5 table exists; LIKE is the fallback
+_fts_ready = False
+
+
+@lru_cache(maxsize=4096)
+def _fold_char(ch: str) -> str:
+    if ch in "đĐ":
+        return "d"
+    base = unicodedata.normalize("NFD", ch)[0].lower()
+    return base if len(base) == 1 else ch
+
+
+def normalize(value: str | None) -> str:
+    """NFC, tags stripped, whitespace collapsed — the form stored and folded."""
+    value = _TAG_RE.sub(" ", unicodedata.normalize("NFC", value or ""))
+    return _SPACE_RE.sub(" ", value).strip()
+
+
+def fold(value: str) -> str:
+    """Lowercase and strip diacritics, one output character per input character."""
+    return "".join(_fold_char(ch) for ch in value)
+
+
+def query_tokens(query: str) -> list[str]:
+    return _TOKEN_RE.findall(fold(normalize(query)))
+
+
+def block_text(blocks) -> list[str]:
+    """Searchable strings from text, quiz and callout blocks."""
+    parts = []
+    for b in blocks or []:
+        if not isinstance(b, dict):
+            continue
+        content = b.get("content") or {}
+        if not isinstance(content, dict):
+            continue
+        block_type = b.get("type") or b.get("block_type")
+        if block_type == "text":
+            parts.append(content.get("heading"))
+            parts.extend(content.get("paragraphs") or [])
+        elif block_type == "quiz":
+            parts.append(content.get("question"))
+            parts.extend(o.get("label") for o in content.get("options") or [] if isinstance(o, dict))
+            parts.append(content.get("explanation"))
+        elif block_type == "callout":
+            parts.append(content.get("title"))
+            parts.append(content.get("text") or content.get("body"))
+            parts.extend(content.get("paragraphs") or [])
+    return [p for p in parts if isinstance(p, str) and p]
+
+
+def _document(kind: str, story_id: int, step_id: int | None, title: str, body_parts) -> SearchDocument:
+    title = normalize(title)
+    body = " ".join(filter(None, (normalize(p) for p in body_parts)))
+    return SearchDocument(
+        kind=kind,
+        story_id=story_id,
+        step_id=step_id,
+        title=title,
+        body=body,
+        title_folded=fold(title),
+        body_folded=fold(body),
+    )
+
+
+async def index_story(db: AsyncSession, story_id: int) -> int:
+    """Replace a story's search documents. Caller runs `rebuild_search_index` and commits."""
+    result = await db.execute(
+        select(Story)
+        .options(selectinload(Story.chapters).selectinload(Chapter.steps).selectinload(Step.slides))
+        .where(Story.id == story_id)
+    )
+    story = result.scalar_one()
+    await db.execute(delete(SearchDocument).where(SearchDocument.story_id == story_id))
+
+    docs = [_document(KIND_STORY, story.id, None, story.title, [story.description])]
+    for chapter in story.chapters:
+        for step in chapter.steps:
+            slides = sorted(step.slides, key=lambda s: s.order_index or 0)
+            parts = [step.description]
+            for slide in slides:
+                parts.extend(block_text(slide.blocks))
+            docs.append(_document(KIND_STEP, story.id, step.id, step.title, parts))
+    db.add_all(docs)
+    await db.flush()
+    return len(docs)
+
+
+async def index_all_stories(db: AsyncSession, only_missing: bool = False) -> int:
+    """Index every story (or only those without documents). Returns stories touched."""
+    query = select(Story.id)
+    if only_missing:
+        query = query.where(Story.id.notin_(select(SearchDocument.story_id)))
+    story_ids = list((await db.execute(query)).scalars().all())
+    for story_id in story_ids:
+        await index_story(db, story_id)
+    return len(story_ids)
+
+
+async def clear_search_index(db: AsyncSession) -> None:
+    await db.execute(delete(SearchDocument))
+
+
+async def rebuild_search_index(db: AsyncSession) -> None:
+    """Resync the FTS5 table with `search_documents` after writes (no-op on Postgres)."""
+    if _fts_ready and db.bind.dialect.name == "sqlite":
+        await db.execute(text("INSERT INTO search_fts(search_fts) VALUES ('rebuild')"))
+
+
+async def init_search_index(engine: AsyncEngine) -> None:
+    """Create the dialect-specific full-text index over `search_documents`."""
+    global _fts_ready
+    dialect = engine.dialect.name
+    try:
+        async with engine.begin() as conn:
+            if dialect == "sqlite":
+                await conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+                    "title_folded, body_folded, content='search_documents', content_rowid='id', "
+                    "tokenize='unicode61 remove_diacritics 2')"
+                ))
+                _fts_ready = True
+            elif dialect == "postgresql":
+                await conn.execute(text(
+                    "ALTER TABLE search_documents ADD COLUMN IF NOT EXISTS tsv tsvector "
+                    "GENERATED ALWAYS AS (setweight(to_tsvector('simple', coalesce(title_folded, '')), 'A') "
+                    "|| setweight(to_tsvector('simple', coalesce(body_folded, '')), 'B')) STORED"
+                ))
+                await conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_search_documents_tsv ON search_documents USING GIN (tsv)"
+                ))
+                _fts_ready = True
+    except Exception as e:
+        logger.warning("Full-text index unavailable, search falls back to LIKE: %s", e)
+
+
+@dataclass(frozen=True)
+class SearchMatch:
+    kind: str
+    story_id: int
+    step_id: int | None
+    title: str
+    snippet: str
+    score: float
+
+
+def make_snippet(body: str, body_folded: str, tokens: list[str], width: int = SNIPPET_CHARS) -> str:
+    """Cut a window around the first match and wrap matched words in <mark>."""
+    if not body:
+        return ""
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in tokens) + r")\w*") if tokens else None
+    first = pattern.search(body_folded) if pattern else None
+    start = max(0, first.start() - width // 3) if first else 0
+    end = min(len(body), start + width)
+    out = ["…" if start else ""]
+    pos = start
+    for m in pattern.finditer(body_folded, start, end) if pattern else ():
+        out.append(html.escape(body[pos:m.start()]))
+        out.append("<mark>" + html.escape(body[m.start():m.end()]) + "</mark>")
+        pos = m.end()
+    out.append(html.escape(body[pos:end]))
+    out.append("…" if end < len(body) else "")
+    return "".join(out)
+
+
+async def search_documents(
+    db: AsyncSession, query: str, kind: str | None = None, limit: int = 20, offset: int = 0
+) -> list[SearchMatch]:
+    """Ranked matches for `query`; every token must match (as a word prefix)."""
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    dialect = db.bind.dialect.name
+    params = {"limit": limit, "offset": offset}
+    kind_filter = ""
+    if kind:
+        params["kind"] = kind
+        kind_filter = "AND d.kind = :kind"
+
+    if _fts_ready and dialect == "sqlite":
+        params["q"] = " ".join(f'"{t}"*' for t in tokens)
+        sql = (
+            "SELECT d.kind, d.story_id, d.step_id, d.title, d.body, d.body_folded, "
+            "bm25(search_fts, 5.0, 1.0) AS rank "
+            "FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid "
+            f"WHERE search_fts MATCH :q {kind_filter} "
+            "ORDER BY rank LIMIT :limit OFFSET :offset"
+        )
+    elif _fts_ready and dialect == "postgresql":
+        params["q"] = " & ".join(f"{t}:*" for t in tokens)
+        sql = (
+            "SELECT d.kind, d.story_id, d.step_id, d.title, d.body, d.body_folded, "
+            "-ts_rank(d.tsv, to_tsquery('simple', :q)) AS rank "
+            "FROM search_documents d "
+            f"WHERE d.tsv @@ to_tsquery('simple', :q) {kind_filter} "
+            "ORDER BY rank LIMIT :limit OFFSET :offset"
+        )
+    else:
+        clauses = []
+        for i, token in enumerate(tokens):
+            params[f"t{i}"] = f"%{token}%"
+            clauses.append(f"(d.title_folded LIKE :t{i} OR d.body_folded LIKE :t{i})")
+        sql = (
+            "SELECT d.kind, d.story_id, d.step_id, d.title, d.body, d.body_folded, 0 AS rank "
+            f"FROM search_documents d WHERE {' AND '.join(clauses)} {kind_filter} "
+            "ORDER BY d.id LIMIT :limit OFFSET :offset"
+        )
+
+    rows = (await db.execute(text(sql), params)).all()
+    return [
+        SearchMatch(
+            kind=row.kind,
+            story_id=row.story_id,
+            step_id=row.step_id,
+            title=row.title,
+            snippet=make_snippet(row.body, row.body_folded, tokens),
+            score=round(-float(row.rank or 0), 4),
+        )
+        for row in rows
+    ]
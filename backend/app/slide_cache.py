@@ -0,0 +1,141 @@
+"""Bounded LRU of pre-encoded `GET /steps/{id}/slides` responses.
+
+Slide payloads only change on sync, so each step's JSON body is encoded once
+(plus gzip, and brotli when the optional `brotli` package is installed) and
+served as raw bytes, skipping Pydantic validation and re-serialization.
+Entries are tagged with the catalog version and dropped when it moves.
+"""
+import gzip
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import Response
+
+from app.catalog import ContentCatalog, StepNode
+from app.config import settings
+import logging
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 512
+
+
+def accepted_encodings(accept_encoding: str | None) -> dict[str, float]:
+    """{coding: q} of an Accept-Encoding header, without codings refused with q=0."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    # "*" covers codings not listed explicitly
+    wildcard = accepted.pop("*", 0.0)
+    for coding in ("br", "gzip"):
+        accepted.setdefault(coding, wildcard)
+    return {coding: q for coding, q in accepted.items() if q > 0}
+
+
+@dataclass(frozen=True)
+class EncodedSlides:
+    version: int
+    body: bytes
+    gzip_body: bytes | None = None
+    br_body: bytes | None = None
+
+    def select(self, accept_encoding: str | None) -> tuple[str | None, bytes]:
+        """(coding, body) of the precompressed variant the client prefers (highest q, brotli on ties);
+        coding is None for the identity body."""
+        accepted = accepted_encodings(accept_encoding)
+        variants = [(coding, body) for coding, body in (("br", self.br_body), ("gzip", self.gzip_body))
+                    if body is not None and coding in accepted]
+        if variants:
+            return max(variants, key=lambda v: accepted[v[0]])
+        return None, self.body
+
+    def to_response(self, coding: str | None, body: bytes, headers: dict[str, str]) -> Response:
+        headers = {**headers, "Vary": "Accept-Encoding"}
+        if coding is not None:
+            headers["Content-Encoding"] = coding
+        return Response(body, media_type="application/json", headers=headers)
+
+
+def encode_slides(step: StepNode, version: int) -> EncodedSlides:
+    # Same shape and separators FastAPI's JSONResponse would produce for list[SlideResponse]
+    payload = [{"id": sl.id, "order_index": sl.order_index, "blocks": sl.blocks} for sl in step.slides]
+    body = json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    if len(body) < MIN_COMPRESS_BYTES:
+        return EncodedSlides(version=version, body=body)
+    return EncodedSlides(
+        version=version,
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+        br_body=brotli.compress(body) if brotli is not None else None,
+    )
+
+
+class SlideResponseCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, EncodedSlides] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, step: StepNode, version: int) -> EncodedSlides:
+        entry = self._entries.get(step.id)
+        if entry is not None and entry.version == version:
+            self.hits += 1
+            self._entries.move_to_end(step.id)
+            return entry
+        self.misses += 1
+        entry = encode_slides(step, version)
+        self._put(step.id, entry)
+        return entry
+
+    def _put(self, step_id: int, entry: EncodedSlides) -> None:
+        self._entries[step_id] = entry
+        self._entries.move_to_end(step_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def warm(self, catalog: ContentCatalog) -> int:
+        """Pre-encode steps (in course order) up to capacity. Returns entries filled."""
+        filled = 0
+        for step in catalog.steps_by_id.values():
+            if filled >= self.max_entries:
+                break
+            self._put(step.id, encode_slides(step, catalog.version))
+            filled += 1
+        logger.info("Slide cache warmed: %s entries (brotli=%s)", filled, brotli is not None)
+        return filled
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "bytes": sum(len(e.body) + len(e.gzip_body or b"") + len(e.br_body or b"") for e in self._entries.values()),
+        }
+
+
+slide_cache = SlideResponseCache(settings.slide_cache_max_entries)
@@ -0,0 +1,65 @@
+"""Compressed storage codec for `Slide.blocks`.
+
+Slides of one course share most of their structure (block types, interaction
+specs, repeated keys), so each story gets a zlib preset dictionary sampled
+from its own slides. Blobs are raw deflate streams that need that dictionary
+to decode, so they are decoded by the model layer (`Slide.blocks`) rather than
+served to clients as-is; HTTP compression goes through `app.slide_cache`.
+"""
+import json
+import re
+import zlib
+from collections import Counter
+
+CODEC_ZLIB = "zlib"
+ZLIB_LEVEL = 9
+# zlib only looks back 32 KiB, so a larger dictionary is wasted
+DICT_MAX_BYTES = 32 * 1024
+
+# JSON string literals, optionally followed by the colon that makes them a key
+_FRAGMENT_RE = re.compile(rb'"(?:[^"\\]|\\.)*"\s*:?')
+
+
+def encode_json(blocks) -> bytes:
+    return json.dumps(blocks or [], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def build_dictionary(samples: list[bytes]) -> bytes:
+    """Build a preset dictionary from the fragments that repeat across `samples`.
+
+    Fragments are ranked by count × length; the best ones go last because
+    zlib encodes matches closer to the data more cheaply.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(_FRAGMENT_RE.findall(sample))
+    ranked = sorted(
+        (frag for frag, n in counts.items() if n > 1),
+        key=lambda frag: counts[frag] * len(frag),
+        reverse=True,
+    )
+    chosen = []
+    size = 0
+    for frag in ranked:
+        if size + len(frag) > DICT_MAX_BYTES:
+            continue
+        chosen.append(frag)
+        size += len(frag)
+    return b"".join(reversed(chosen))
+
+
+def compress_blocks(blocks, zdict: bytes | None = None) -> bytes:
+    if zdict:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(encode_json(blocks)) + compressor.flush()
+
+
+def decompress_blocks(blob: bytes, zdict: bytes | None = None) -> list:
+    if zdict:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+    else:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    raw = decompressor.decompress(blob) + decompressor.flush()
+    return json.loads(raw.decode("utf-8"))
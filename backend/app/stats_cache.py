@@ -0,0 +1,62 @@
+"""Per-user cache of `GET /progress/stats` responses.
+
+Entries are tagged with a fingerprint of the user row (XP, coins, streaks,
+updated_at) and the reference registry version, so most changes miss the
+cache on their own. Writes that don't touch the user row (enrolling,
+completing a step that awards nothing) call `invalidate(user_id)`. Entries
+also expire after `progress_stats_cache_seconds`, which bounds staleness
+across workers that didn't see the invalidation.
+"""
+import time
+from collections import OrderedDict
+
+from app.config import settings
+from app.models import User
+
+
+def user_fingerprint(user: User, registry_version: int) -> tuple:
+    return (
+        registry_version,
+        user.xp or 0,
+        user.coins or 0,
+        user.current_streak or 0,
+        user.longest_streak or 0,
+        user.updated_at,
+    )
+
+
+class UserStatsCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, tuple[tuple, float, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, fingerprint: tuple):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] == fingerprint and entry[1] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(user_id)
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, user_id: int, fingerprint: tuple, value) -> None:
+        if self.max_entries <= 0 or settings.progress_stats_cache_seconds <= 0:
+            return
+        self._entries[user_id] = (fingerprint, time.monotonic() + settings.progress_stats_cache_seconds, value)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+stats_cache = UserStatsCache(settings.progress_stats_cache_max_entries)
@@ -0,0 +1,253 @@
+"""`POST /steps/{id}/complete` as an explicit pipeline.
+
+    validate -> reward -> streak -> quests -> achievements -> activity -> commit
+
+Every stage works on one `StepCompletion` holding the already-loaded user,
+the catalog step/story, the request's `LearningContext` (enrollments,
+inventory, calendar and quests, each loaded once) and the rows loaded by
+earlier stages, and adds its writes to the session. Nothing is
+committed until the end, so a completion is applied atomically with one
+commit. `STATEMENT_BUDGET` is the most SQL statements a first completion may
+issue (including the auth lookup); `bench_step_complete.py` checks it.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.achievements import (
+    AchievementEvent, process_events, count_completed_steps,
+    XP_CHANGED, STEP_COMPLETED, STREAK_CHANGED, STORY_COMPLETED,
+)
+from app.catalog import ContentCatalog, StepNode, StoryNode
+from app.daily_activity import record_activity
+from app.hearts import deduct_heart, current_hearts
+from app.leaderboard import award_xp, rank_index
+from app.learning_context import LearningContext, ENROLLMENTS, INVENTORY, CALENDAR, QUESTS
+from app.models import User, StepProgress
+from app.registry import ReferenceData, get_registry
+from app.quest_progress import QuestProgressBatch
+from app.schemas import StepCompleteRequest
+from app.stats_cache import stats_cache
+from app.story_progress import record_step_completion, count_completed_stories
+from app.streaks import ActivityCalendar, update_streak, mark_active_day, local_today, remember_tz_offset
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A first completion takes 24 statements plus one UPDATE per quest it advances
+# (at most the 5 current quests); 2 spare so small additions don't fail the bench
+STATEMENT_BUDGET = 31
+
+# Bonus XP per correctly answered quiz, and coins for each 7-day streak milestone
+QUIZ_XP = 15
+STREAK_MILESTONE_COINS = 20
+
+
+@dataclass
+class StepCompletion:
+    user: User
+    step: StepNode
+    story: StoryNode
+    data: StepCompleteRequest
+    registry: ReferenceData
+    learning: LearningContext
+    tz_offset: Optional[int] = None
+
+    progress: Optional[StepProgress] = None
+    calendar: Optional[ActivityCalendar] = None
+    first_completion: bool = False
+    story_completed: bool = False
+    # The user's completed steps, if a stage already counted them
+    completed_steps: Optional[int] = None
+    xp_before: int = 0
+    streak_before: int = 0
+    xp_earned: int = 0
+    coins_earned: int = 0
+    xp_boost_active: bool = False
+    streak_info: dict = field(default_factory=dict)
+    newly_earned: list = field(default_factory=list)
+
+    def response(self) -> dict:
+        user = self.user
+        return {
+            "success": True,
+            "xp_earned": self.xp_earned,
+            "coins_earned": self.coins_earned,
+            "total_xp": user.xp,
+            "total_coins": user.coins or 0,
+            "hearts": current_hearts(user),
+            "xp_boost_active": self.xp_boost_active,
+            "streak": self.streak_info,
+            "newly_earned_achievements": self.newly_earned,
+        }
+
+
+async def validate(db: AsyncSession, ctx: StepCompletion) -> None:
+    """The user's progress row for the step, the learning state the pipeline needs and the enrollment check."""
+    progress_result = await db.execute(
+        select(StepProgress).where(
+            StepProgress.user_id == ctx.user.id,
+            StepProgress.step_id == ctx.step.id
+        )
+    )
+    ctx.progress = progress_result.scalar_one_or_none()
+
+    # A repeat completion doesn't use the boost inventory or quests
+    parts = (ENROLLMENTS, CALENDAR)
+    if ctx.progress is None or not ctx.progress.is_completed:
+        parts += (INVENTORY, QUESTS)
+    await ctx.learning.load(*parts, today=local_today(ctx.tz_offset))
+    if not await ctx.learning.is_enrolled(ctx.story.id):
+        raise HTTPException(status_code=403, detail="You must enroll in the course to study this lesson")
+    ctx.xp_before = ctx.user.xp or 0
+    ctx.streak_before = ctx.user.current_streak or 0
+
+
+async def reward(db: AsyncSession, ctx: StepCompletion) -> None:
+    """Mark the step completed; on the first completion credit XP (boosted) and coins."""
+    if ctx.progress is not None and ctx.progress.is_completed:
+        return
+    user, data = ctx.user, ctx.data
+    if ctx.progress is None:
+        ctx.progress = StepProgress(user_id=user.id, step_id=ctx.step.id)
+        db.add(ctx.progress)
+    ctx.progress.is_completed = True
+    ctx.progress.score = data.score
+    ctx.progress.time_spent_seconds = data.time_spent_seconds
+    ctx.progress.completed_at = datetime.utcnow()
+    ctx.first_completion = True
+
+    xp = ctx.step.xp_reward + data.quizzes_correct * QUIZ_XP
+    boost_inv = await ctx.learning.inventory_item("xp_boost")
+    if boost_inv:
+        xp *= 2
+        await ctx.learning.consume_item(boost_inv)
+        ctx.xp_boost_active = True
+    award_xp(db, user, xp, "step")
+    user.coins = (user.coins or 0) + ctx.step.coin_reward
+    ctx.xp_earned = xp
+    ctx.coins_earned = ctx.step.coin_reward
+
+    ctx.story_completed, ctx.completed_steps = await record_step_completion(db, user.id, ctx.story)
+
+    # Deduct 1 heart if more than half of quizzes were wrong (first completion only)
+    if data.quizzes_total > 0:
+        wrong = data.quizzes_total - data.quizzes_correct
+        if wrong / data.quizzes_total > 0.5:
+            deduct_heart(user)
+
+
+async def streak(db: AsyncSession, ctx: StepCompletion) -> None:
+    """Mark today in the activity calendar, advance the streak and pay the 7-day milestone bonus."""
+    user = ctx.user
+    try:
+        async with db.begin_nested():
+            ctx.calendar = await mark_active_day(db, user.id, ctx.tz_offset, await ctx.learning.calendar())
+    except Exception as e:
+        # don't break step completion on streak persistence errors
+        logger.warning("Streak calendar update failed: %s", e)
+    ctx.streak_info = update_streak(user, ctx.tz_offset, ctx.calendar)
+
+    # Streak milestone bonus: every 7-day streak = +20 coins
+    cur_streak = user.current_streak or 0
+    if ctx.coins_earned > 0 and cur_streak > 0 and cur_streak % 7 == 0:
+        user.coins = (user.coins or 0) + STREAK_MILESTONE_COINS
+        ctx.coins_earned += STREAK_MILESTONE_COINS
+
+
+async def quests(db: AsyncSession, ctx: StepCompletion) -> None:
+    """Apply every quest event of a first completion as one batch."""
+    if not ctx.first_completion:
+        return
+    data = ctx.data
+    batch = QuestProgressBatch(ctx.user.id)
+    batch.add("lessons").add("slides").add("streak", ctx.user.current_streak or 0)
+    if data.time_spent_seconds > 0:
+        batch.add("study_time", data.time_spent_seconds)
+    if data.quizzes_correct > 0:
+        batch.add("quizzes", data.quizzes_correct)
+    if data.quizzes_total >= 1 and data.quizzes_correct == data.quizzes_total:
+        batch.add("perfect_quiz")
+    today = local_today(ctx.tz_offset)
+    week_days = None
+    if ctx.calendar is not None:
+        week_days = ctx.calendar.week(today - timedelta(days=today.weekday()))[0]
+    try:
+        async with db.begin_nested():
+            await batch.apply(db, today, week_days=week_days, user_quests=await ctx.learning.active_quests(today))
+    except Exception as e:
+        logger.warning("Quest progress update failed: %s", e)
+
+
+async def achievements(db: AsyncSession, ctx: StepCompletion) -> None:
+    """Award achievements whose thresholds this completion crossed."""
+    user = ctx.user
+    events = [
+        AchievementEvent(XP_CHANGED, user.xp or 0, ctx.xp_before),
+        AchievementEvent(STREAK_CHANGED, user.current_streak or 0, ctx.streak_before),
+    ]
+    if ctx.first_completion:
+        steps_done = ctx.completed_steps
+        if steps_done is None:
+            steps_done = await count_completed_steps(db, user.id)
+        events.append(AchievementEvent(STEP_COMPLETED, steps_done, steps_done - 1))
+        if ctx.story_completed:
+            stories_done = await count_completed_stories(db, user.id)
+            events.append(AchievementEvent(STORY_COMPLETED, stories_done, stories_done - 1))
+    try:
+        async with db.begin_nested():
+            ctx.newly_earned = await process_events(db, user, events, ctx.registry)
+    except Exception as e:
+        # Don't break step completion if achievement check fails
+        logger.warning("Achievement check failed: %s", e)
+        ctx.newly_earned = []
+
+
+async def activity(db: AsyncSession, ctx: StepCompletion) -> None:
+    """Add a first completion with its time spent, and all XP gained, to today's daily_activity row."""
+    await record_activity(
+        db, ctx.user.id, local_today(ctx.tz_offset),
+        steps=int(ctx.first_completion),
+        xp=(ctx.user.xp or 0) - ctx.xp_before,
+        seconds=ctx.data.time_spent_seconds if ctx.first_completion else 0,
+    )
+
+
+STAGES = (validate, reward, streak, quests, achievements, activity)
+
+
+async def complete_step(
+    db: AsyncSession,
+    catalog: ContentCatalog,
+    user: User,
+    step_id: int,
+    data: StepCompleteRequest,
+    tz_offset: Optional[int] = None,
+    learning: Optional[LearningContext] = None,
+) -> StepCompletion:
+    """Run the pipeline and commit once."""
+    step = catalog.steps_by_id.get(step_id)
+    if not step:
+        raise HTTPException(status_code=404, detail="Step not found")
+
+    ctx = StepCompletion(
+        user=user,
+        step=step,
+        story=catalog.stories_by_id[step.story_id],
+        data=data,
+        registry=await get_registry(db),
+        learning=learning or LearningContext(db, user),
+        tz_offset=remember_tz_offset(user, tz_offset),
+    )
+    for stage in STAGES:
+        await stage(db, ctx)
+    await ctx.learning.flush()
+    await db.commit()
+
+    rank_index.record(user)
+    stats_cache.invalidate(user.id)
+    return ctx
@@ -0,0 +1,132 @@
+"""Per-user story progress, maintained incrementally.
+
+`user_story_progress` holds one row per (user, story) with the number of
+completed steps, so "progress %" and "completed stories" are single-row or
+single-index reads instead of COUNT joins over `step_progress`.
+
+`record_step_completion` is called by the step-completion endpoint in the
+same transaction that marks the `StepProgress` row completed. The table can
+always be recomputed from `step_progress` with `rebuild_story_progress`:
+after content syncs (step ids and totals change), by migration 7 for
+existing databases, and by `sync_data.py --repair progress`.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, update, delete, insert, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.catalog import StoryNode
+from app.models import Chapter, Step, StepProgress, UserStoryProgress
+
+
+class RecordedCompletion(NamedTuple):
+    story_completed: bool
+    # The user's completed steps across all stories, when they had to be counted anyway
+    completed_steps: Optional[int] = None
+
+
+async def record_step_completion(db: AsyncSession, user_id: int, story: StoryNode) -> RecordedCompletion:
+    """Count a newly completed step of `story`. Caller commits."""
+    total = story.stats.step_count or len(story.step_ids)
+    now = datetime.utcnow()
+    completed = UserStoryProgress.completed_steps + 1
+    result = await db.execute(
+        update(UserStoryProgress)
+        .where(UserStoryProgress.user_id == user_id, UserStoryProgress.story_id == story.id)
+        .values(
+            completed_steps=completed,
+            total_steps=total,
+            completed_at=case(
+                (UserStoryProgress.completed_at.is_(None) & (completed >= total), now),
+                else_=UserStoryProgress.completed_at,
+            ),
+        )
+        .returning(UserStoryProgress.completed_at)
+    )
+    row = result.first()
+    if row is not None:
+        return RecordedCompletion(row.completed_at == now)
+
+    # First completion in this story (or a row lost to a rebuild): count from step_progress,
+    # which already includes the pending completion via autoflush
+    count, all_count = (await db.execute(
+        select(
+            func.count(StepProgress.id).filter(StepProgress.step_id.in_(story.step_ids)),
+            func.count(StepProgress.id),
+        ).where(
+            StepProgress.user_id == user_id,
+            StepProgress.is_completed == True,
+        )
+    )).one()
+    completed = bool(total) and count >= total
+    db.add(UserStoryProgress(
+        user_id=user_id,
+        story_id=story.id,
+        completed_steps=count,
+        total_steps=total,
+        completed_at=now if completed else None,
+    ))
+    return RecordedCompletion(completed, all_count)
+
+
+async def completed_steps_by_story(db: AsyncSession, user_id: int, story_ids: list[int] | None = None) -> dict[int, int]:
+    """{story_id: completed step count} for the user (all stories, or only `story_ids`)."""
+    query = select(UserStoryProgress.story_id, UserStoryProgress.completed_steps).where(
+        UserStoryProgress.user_id == user_id
+    )
+    if story_ids is not None:
+        if not story_ids:
+            return {}
+        query = query.where(UserStoryProgress.story_id.in_(story_ids))
+    return {story_id: count for story_id, count in (await db.execute(query)).all()}
+
+
+async def count_completed_stories(db: AsyncSession, user_id: int) -> int:
+    result = await db.execute(
+        select(func.count()).select_from(UserStoryProgress).where(
+            UserStoryProgress.user_id == user_id,
+            UserStoryProgress.completed_at.is_not(None),
+        )
+    )
+    return result.scalar() or 0
+
+
+async def rebuild_story_progress(db, user_id: int | None = None) -> int:
+    """Recompute rows from `step_progress` (all users or one). Accepts a session or connection.
+
+    Returns the number of rows written. Caller commits.
+    """
+    totals = (
+        select(Chapter.story_id.label("story_id"), func.count(Step.id).label("total"))
+        .join(Step, Step.chapter_id == Chapter.id)
+        .group_by(Chapter.story_id)
+        .subquery()
+    )
+    completed = func.count(StepProgress.id)
+    query = (
+        select(
+            StepProgress.user_id,
+            Chapter.story_id,
+            completed,
+            totals.c.total,
+            case((completed >= totals.c.total, func.max(StepProgress.completed_at)), else_=None),
+        )
+        .join(Step, StepProgress.step_id == Step.id)
+        .join(Chapter, Step.chapter_id == Chapter.id)
+        .join(totals, totals.c.story_id == Chapter.story_id)
+        .where(StepProgress.is_completed == True)
+        .group_by(StepProgress.user_id, Chapter.story_id, totals.c.total)
+    )
+    clear = delete(UserStoryProgress)
+    if user_id is not None:
+        query = query.where(StepProgress.user_id == user_id)
+        clear = clear.where(UserStoryProgress.user_id == user_id)
+
+    await db.execute(clear)
+    result = await db.execute(
+        insert(UserStoryProgress).from_select(
+            ["user_id", "story_id", "completed_steps", "total_steps", "completed_at"], query
+        )
+    )
+    return max(result.rowcount or 0, 0)
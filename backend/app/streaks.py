@@ -0,0 +1,323 @@
+"""Daily streak bookkeeping shared by the step and slide completion endpoints.
+
+A user's activity is an `ActivityCalendar`: active days and days covered by
+a streak freeze as two Python ints, bit i being day `base + i`. They are
+stored per year in `streak_calendars` (one 366-bit bitmap each) and loaded
+with a single query. Streak lengths come from bit operations instead of
+walking 7-day lists week by week: the current streak is the run of covered
+(active or frozen) days ending today or yesterday, counting active days
+only, so a freeze bridges a missed day without adding to the streak.
+
+`mark_active_day` records today (in the user's timezone); `update_streak`
+advances the user's streak counters in memory. `rebuild_streak_calendars`
+recomputes the table from the legacy `StreakWeek` rows and step/slide
+completion dates (migration 9, `sync_data.py --repair streaks`).
+"""
+from datetime import datetime, date, timedelta
+
+from fastapi import Request
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import User, StreakWeek, StreakCalendar, StepProgress, SlideProgress
+
+# 366 bits
+CALENDAR_BYTES = 46
+
+
+def tz_offset_from(request: Request) -> int | None:
+    """Client timezone offset in minutes from UTC (X-User-TZ-Offset / X-TZ-Offset), if sent."""
+    try:
+        hdr = request.headers.get('x-user-tz-offset') or request.headers.get('x-tz-offset')
+        if hdr is not None:
+            return int(hdr)
+    except Exception:
+        pass
+    return None
+
+
+def remember_tz_offset(user: User, tz_offset_minutes: int | None) -> int | None:
+    """The request's offset, stored on the user when it changed; the last known one if none was sent."""
+    if tz_offset_minutes is None:
+        return user.tz_offset_minutes
+    if user.tz_offset_minutes != tz_offset_minutes:
+        user.tz_offset_minutes = tz_offset_minutes
+    return tz_offset_minutes
+
+
+def local_today(tz_offset_minutes: int | None = None) -> date:
+    if tz_offset_minutes is not None:
+        return (datetime.utcnow() + timedelta(minutes=tz_offset_minutes)).date()
+    return date.today()
+
+
+def _bits(data: bytes | None) -> int:
+    return int.from_bytes(data or b"", "little")
+
+
+def _bytes(bits: int) -> bytes:
+    return bits.to_bytes(CALENDAR_BYTES, "little")
+
+
+class ActivityCalendar:
+    """A user's active and frozen days as bitmaps; bit i is day `base + i`."""
+
+    def __init__(self, user_id: int, rows=()):
+        self.user_id = user_id
+        self.rows = {row.year: row for row in rows}
+        self.base = date(min(self.rows), 1, 1) if self.rows else None
+        self.active = 0
+        self.frozen = 0
+        for row in self.rows.values():
+            offset = (date(row.year, 1, 1) - self.base).days
+            self.active |= _bits(row.active_days) << offset
+            self.frozen |= _bits(row.frozen_days) << offset
+        self._dirty: set[int] = set()
+
+    def _index(self, day: date) -> int:
+        """Bit index of `day`, -1 if it is before the first stored year."""
+        if self.base is None or day < self.base:
+            return -1
+        return (day - self.base).days
+
+    def _rebase(self, day: date) -> None:
+        new_base = date(day.year, 1, 1)
+        if self.base is not None:
+            if new_base >= self.base:
+                return
+            shift = (self.base - new_base).days
+            self.active <<= shift
+            self.frozen <<= shift
+        self.base = new_base
+
+    def set_day(self, day: date, active: bool = True, frozen: bool = False) -> None:
+        """Set (or clear) the active and frozen flags of one day."""
+        self._rebase(day)
+        bit = 1 << self._index(day)
+        self.active = self.active | bit if active else self.active & ~bit
+        self.frozen = self.frozen | bit if frozen else self.frozen & ~bit
+        self._dirty.add(day.year)
+
+    def mark_active(self, day: date) -> None:
+        self.set_day(day, active=True, frozen=self.is_frozen(day))
+
+    def mark_frozen(self, day: date) -> None:
+        self.set_day(day, active=self.is_active(day), frozen=True)
+
+    def is_active(self, day: date) -> bool:
+        i = self._index(day)
+        return i >= 0 and bool(self.active >> i & 1)
+
+    def is_frozen(self, day: date) -> bool:
+        i = self._index(day)
+        return i >= 0 and bool(self.frozen >> i & 1)
+
+    def week(self, monday: date) -> tuple[list[bool], list[bool]]:
+        """(active, frozen) flags for Mon..Sun of the week starting `monday`."""
+        days = [monday + timedelta(days=i) for i in range(7)]
+        return [self.is_active(d) for d in days], [self.is_frozen(d) for d in days]
+
+    def current_streak(self, today: date) -> int:
+        """Active days in the run of covered days ending today (or yesterday, if today isn't done yet)."""
+        end = self._index(today)
+        covered = self.active | self.frozen
+        if end >= 0 and not covered >> end & 1:
+            end -= 1
+        if end < 0 or not covered >> end & 1:
+            return 0
+        mask = (1 << (end + 1)) - 1
+        # The highest uncovered bit at or below `end` precedes the run
+        start = (~covered & mask).bit_length()
+        return ((self.active & mask) >> start).bit_count()
+
+    def longest_streak(self) -> int:
+        """Most active days in any run of covered days. One step per run."""
+        covered = self.active | self.frozen
+        active = self.active
+        longest = 0
+        while covered:
+            start = (covered & -covered).bit_length() - 1
+            covered >>= start
+            active >>= start
+            length = (covered ^ (covered + 1)).bit_length() - 1
+            longest = max(longest, (active & ((1 << length) - 1)).bit_count())
+            covered >>= length
+            active >>= length
+        return longest
+
+    def shift(self, days: int) -> None:
+        """Move all activity `days` earlier (admin fast-forward)."""
+        if self.base is None or days <= 0:
+            return
+        self._dirty.update(self.years())
+        self.active >>= days
+        self.frozen >>= days
+
+    def years(self) -> range:
+        if self.base is None:
+            return range(0)
+        last = self.base + timedelta(days=max((self.active | self.frozen).bit_length() - 1, 0))
+        return range(self.base.year, last.year + 1)
+
+    def year_bits(self, year: int) -> tuple[bytes, bytes]:
+        """(active, frozen) bitmaps of one calendar year."""
+        offset = self._index(date(year, 1, 1))
+        mask = (1 << (date(year + 1, 1, 1) - date(year, 1, 1)).days) - 1
+        return _bytes(self.active >> offset & mask), _bytes(self.frozen >> offset & mask)
+
+    def save(self, db: AsyncSession) -> None:
+        """Write the changed years back to their StreakCalendar rows (added if new). Caller commits."""
+        for year in sorted(self._dirty):
+            active, frozen = self.year_bits(year)
+            row = self.rows.get(year)
+            if row is None:
+                row = StreakCalendar(user_id=self.user_id, year=year, active_days=active, frozen_days=frozen)
+                self.rows[year] = row
+                db.add(row)
+            else:
+                row.active_days = active
+                row.frozen_days = frozen
+        self._dirty.clear()
+
+
+async def load_calendar(db: AsyncSession, user_id: int) -> ActivityCalendar:
+    result = await db.execute(select(StreakCalendar).where(StreakCalendar.user_id == user_id))
+    return ActivityCalendar(user_id, result.scalars().all())
+
+
+def update_streak(user: User, tz_offset_minutes: int | None = None, calendar: ActivityCalendar | None = None) -> dict:
+    """Update user's streak based on activity dates.
+    Returns dict with streak info.
+
+    With the user's `calendar` (today already marked), a missed day covered by
+    a streak freeze continues the streak instead of resetting it."""
+    # compute user-local today using tz offset (minutes) if provided, otherwise server local date
+    if tz_offset_minutes is not None:
+        now = datetime.utcnow() + timedelta(minutes=tz_offset_minutes)
+        today = now.date()
+    else:
+        today = date.today()
+
+    last_activity = None
+    if user.last_activity_date:
+        try:
+            # store last_activity_date in UTC; convert to user-local date for comparison
+            lad = user.last_activity_date
+            if tz_offset_minutes is not None:
+                lad_local = lad + timedelta(minutes=tz_offset_minutes)
+                last_activity = lad_local.date()
+            else:
+                last_activity = lad.date()
+        except Exception:
+            last_activity = user.last_activity_date.date()
+    
+    streak_increased = False
+    streak_reset = False
+    
+    if last_activity is None:
+        # First activity ever
+        user.current_streak = 1
+        streak_increased = True
+    elif last_activity == today:
+        # Already active today, no change
+        pass
+    elif last_activity == today - timedelta(days=1):
+        # Active yesterday, continue streak
+        user.current_streak += 1
+        streak_increased = True
+    else:
+        # Missed at least one day: reset streak unless the gap was frozen
+        user.current_streak = max(calendar.current_streak(today), 1) if calendar is not None else 1
+        streak_reset = user.current_streak == 1
+        streak_increased = not streak_reset
+    
+    # Update longest streak if needed
+    if user.current_streak > user.longest_streak:
+        user.longest_streak = user.current_streak
+    
+    # Update last activity date (store in UTC)
+    user.last_activity_date = datetime.utcnow()
+    
+    return {
+        "current_streak": user.current_streak,
+        "longest_streak": user.longest_streak,
+        "streak_increased": streak_increased,
+        "streak_reset": streak_reset
+    }
+
+
+async def mark_active_day(
+    db: AsyncSession, user_id: int, tz_offset_minutes: int | None = None, calendar: ActivityCalendar | None = None
+) -> ActivityCalendar:
+    """Mark today active in the user's calendar (loaded unless given). Caller commits."""
+    if calendar is None:
+        calendar = await load_calendar(db, user_id)
+    calendar.mark_active(local_today(tz_offset_minutes))
+    calendar.save(db)
+    return calendar
+
+
+async def rebuild_streak_calendars(db, user_id: int | None = None) -> int:
+    """Merge StreakWeek rows and step/slide completion dates into the calendars. Accepts a session or connection.
+
+    Days already in a calendar are kept: freezes and /streak-week edits made
+    since StreakWeek stopped being written exist only there.
+
+    Returns the number of rows written. Caller commits.
+    """
+    existing = select(StreakCalendar.user_id, StreakCalendar.year, StreakCalendar.active_days, StreakCalendar.frozen_days)
+    if user_id is not None:
+        existing = existing.where(StreakCalendar.user_id == user_id)
+    rows_by_user: dict[int, list] = {}
+    for row in (await db.execute(existing)).all():
+        rows_by_user.setdefault(row.user_id, []).append(row)
+    calendars = {uid: ActivityCalendar(uid, rows) for uid, rows in rows_by_user.items()}
+
+    def calendar_of(uid: int) -> ActivityCalendar:
+        if uid not in calendars:
+            calendars[uid] = ActivityCalendar(uid)
+        return calendars[uid]
+
+    weeks = select(StreakWeek.user_id, StreakWeek.week_start, StreakWeek.days, StreakWeek.frozen_days)
+    if user_id is not None:
+        weeks = weeks.where(StreakWeek.user_id == user_id)
+    for uid, week_start, days, frozen_days in (await db.execute(weeks)).all():
+        try:
+            monday = date.fromisoformat(week_start)
+        except (TypeError, ValueError):
+            continue
+        for i in range(7):
+            active = bool(days and i < len(days) and days[i])
+            frozen = bool(frozen_days and i < len(frozen_days) and frozen_days[i])
+            if active or frozen:
+                calendar, day = calendar_of(uid), monday + timedelta(days=i)
+                calendar.set_day(day, active=active or calendar.is_active(day), frozen=frozen or calendar.is_frozen(day))
+
+    completions = (
+        select(StepProgress.user_id, func.date(StepProgress.completed_at))
+        .where(StepProgress.is_completed == True, StepProgress.completed_at.is_not(None))
+        .distinct(),
+        select(SlideProgress.user_id, func.date(SlideProgress.completed_at))
+        .where(SlideProgress.completed_at.is_not(None))
+        .distinct(),
+    )
+    for query in completions:
+        if user_id is not None:
+            query = query.where(query.selected_columns[0] == user_id)
+        for uid, day in (await db.execute(query)).all():
+            if day is None:
+                continue
+            calendar_of(uid).mark_active(day if isinstance(day, date) else date.fromisoformat(str(day)[:10]))
+
+    clear = delete(StreakCalendar)
+    if user_id is not None:
+        clear = clear.where(StreakCalendar.user_id == user_id)
+    await db.execute(clear)
+    rows = []
+    for uid, calendar in calendars.items():
+        for year in calendar.years():
+            active, frozen = calendar.year_bits(year)
+            rows.append({"user_id": uid, "year": year, "active_days": active, "frozen_days": frozen})
+    if rows:
+        await db.execute(insert(StreakCalendar), rows)
+    return len(rows)
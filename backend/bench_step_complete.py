@@ -0,0 +1,169 @@
+"""Statement budget and latency benchmark for step completion (app.step_completion).
+
+Runs against a throwaway SQLite database seeded from data/, never the
+configured DATABASE_URL:
+
+    python bench_step_complete.py [--users 40] [--concurrency 8]
+
+1. Counts the SQL statements of one first-time completion by a user with
+   this period's quests assigned (including the user lookup that
+   authentication does) and fails if it exceeds `STATEMENT_BUDGET`.
+2. Has every user complete every step of the first course, `--concurrency`
+   users at a time, and prints p50/p99 latency per completion.
+
+Exits non-zero when the budget is exceeded. The budget alone is also
+checked by tests/test_step_completion_budget.py.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def use_scratch_database() -> None:
+    """Point the app at a throwaway SQLite database. Call before importing app modules."""
+    workdir = tempfile.mkdtemp(prefix="bench_step_complete_")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ["DEBUG"] = "false"
+    os.environ["LEADERBOARD_SNAPSHOT_SECONDS"] = "0"
+    os.environ["QUEST_SCHEDULE_SECONDS"] = "0"
+    os.environ.setdefault("SENDER_EMAIL", "bench@example.com")
+    os.environ.setdefault("SENDER_PASSWORD", "unused")
+    os.environ.setdefault("JWT_SECRET_KEY", "bench")
+
+
+@asynccontextmanager
+async def completion_bench(users: int):
+    """Start the app and seed `users` + 1 enrolled users with this period's quests.
+
+    Yields (complete, user_ids, step_ids); `complete(user_id, step_id)` runs
+    one completion the way the endpoint does, in its own session.
+    """
+    from sqlalchemy import select
+
+    from app.catalog import get_catalog
+    from app.database import async_session
+    from app.main import app, lifespan
+    from app.models import User, Enrollment
+    from app.schemas import StepCompleteRequest
+    from app import step_completion
+    from app.quest_assignment import ensure_quests
+    from app.streaks import local_today
+
+    # app.main turns on SQL echo
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+    logging.getLogger("sqlalchemy.engine.Engine").setLevel(logging.WARNING)
+
+    async with lifespan(app):
+        async with async_session() as db:
+            catalog = await get_catalog(db)
+        story = next(s for s in catalog.stories if s.step_ids)
+        step_ids = [step.id for chapter in story.chapters for step in chapter.steps]
+
+        async with async_session() as db:
+            seeded = [
+                User(username=f"bench{i}", email=f"bench{i}@example.com", hashed_password="x")
+                for i in range(users + 1)
+            ]
+            db.add_all(seeded)
+            await db.flush()
+            db.add_all(Enrollment(user_id=u.id, story_id=story.id) for u in seeded)
+            # Current quests, so completions also pay for quest progress
+            for u in seeded:
+                await ensure_quests(db, u.id, local_today())
+            await db.commit()
+            user_ids = [u.id for u in seeded]
+
+        data = StepCompleteRequest(score=100, time_spent_seconds=90, quizzes_correct=2, quizzes_total=3)
+
+        async def complete(user_id: int, step_id: int) -> None:
+            async with async_session() as db:
+                # What get_current_user does for an authenticated request
+                user = (await db.execute(select(User).where(User.id == user_id))).scalar_one()
+                await step_completion.complete_step(db, catalog, user, step_id, data)
+
+        yield complete, user_ids, step_ids
+
+
+async def first_completion_statements(complete, user_id: int, step_id: int) -> list[str]:
+    """SQL statements executed by `complete(user_id, step_id)`."""
+    from sqlalchemy import event
+
+    from app.database import engine
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    try:
+        await complete(user_id, step_id)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count)
+    return statements
+
+
+async def run(args) -> int:
+    from app import step_completion
+
+    async with completion_bench(args.users) as (complete, user_ids, step_ids):
+        # 1. Statement budget of a first completion
+        statements = await first_completion_statements(complete, user_ids[0], step_ids[0])
+        budget = step_completion.STATEMENT_BUDGET
+        print(f"first completion: {len(statements)} statements (budget {budget})")
+        if args.verbose:
+            for statement in statements:
+                print("  " + " ".join(statement.split())[:120])
+
+        # 2. Concurrent load
+        latencies = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def learner(user_id: int) -> None:
+            async with semaphore:
+                for step_id in step_ids:
+                    started = time.perf_counter()
+                    await complete(user_id, step_id)
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(learner(uid) for uid in user_ids[1:]))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        print(
+            f"{len(latencies)} completions, {args.users} users, concurrency {args.concurrency}: "
+            f"p50={percentile(latencies, 50):.1f} ms  p99={percentile(latencies, 99):.1f} ms  "
+            f"({len(latencies) / elapsed:.0f}/s)"
+        )
+
+    if len(statements) > budget:
+        print(f"FAIL: {len(statements)} statements exceeds the budget of {budget}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--verbose", action="store_true", help="print the statements of the first completion")
+    args = parser.parse_args()
+
+    use_scratch_database()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ Data Sync Script - Import JSON data to SQLite database
 This script reads from /data/ folder and syncs to database
 """
 
+import argparse
 import json
 import asyncio
 import runpy
@@ -17,6 +18,14 @@ sys.stderr.reconfigure(encoding='utf-8')
 
 from app.models import Base, Category, Story, Chapter, Step, Achievement, ShopItem, Quest
 from app.config import settings
+from app.catalog import bump_content_version
+from app.registry import REFERENCE_VERSION_KEY
+from app.content_stats import materialize_story_stats, store_story_slides
+from app.migrations import run_migrations
+from app.story_progress import rebuild_story_progress
+from app.streaks import rebuild_streak_calendars
+from app.daily_activity import rebuild_daily_activity
+from app.search import init_search_index, index_story, clear_search_index, rebuild_search_index
 import logging
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -90,6 +99,8 @@ async def sync_data():
     
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
+    await init_search_index(engine)
 
     await ensure_course_jsons()
 
@@ -97,7 +108,11 @@ async def sync_data():
         # 0. Clean all existing course data so deleted folders are removed from DB
         from sqlalchemy import text
         logger.debug("🧹 Cleaning existing course data...")
+        await clear_search_index(session)
+        await session.execute(text("DELETE FROM chapter_stats"))
+        await session.execute(text("DELETE FROM story_stats"))
         await session.execute(text("DELETE FROM slides"))
+        await session.execute(text("DELETE FROM slide_dictionaries"))
         await session.execute(text("DELETE FROM steps"))
         await session.execute(text("DELETE FROM chapters"))
         await session.execute(text("DELETE FROM stories"))
@@ -168,7 +183,12 @@ async def sync_data():
                             course_data["chapters"].sort(key=lambda x: x.get("order_index", 0))
                         
                         await process_course(session, course_data)
-        
+
+        await rebuild_search_index(session)
+        # Step ids and totals changed: recount per-user story progress
+        await rebuild_story_progress(session)
+        # Running servers pick this up and rebuild their content catalog
+        await bump_content_version(session)
         await session.commit()
         logger.debug("\n✨ Data sync completed!")
 
@@ -241,6 +261,10 @@ async def process_course(session, course_data):
                     session.add(slide)
                 logger.debug(f"      🔁 Resynced slides for step: {step_data['title']}")
 
+        await session.flush()
+        await store_story_slides(session, story.id)
+        await materialize_story_stats(session, story.id)
+        await index_story(session, story.id)
         return
 
     # Create new story
@@ -299,6 +323,12 @@ async def process_course(session, course_data):
                 )
                 session.add(slide)
 
+    # Aggregates read by the stories/progress endpoints
+    await session.flush()
+    await store_story_slides(session, story.id)
+    await materialize_story_stats(session, story.id)
+    await index_story(session, story.id)
+
 
 async def sync_achievements():
     """Upsert achievements from data/achievements.json."""
@@ -330,6 +360,7 @@ async def sync_achievements():
             else:
                 db.add(Achievement(**ach_data))
                 logger.debug(f"  ✅ Added achievement: {ach_data['title']}")
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
         await db.commit()
     logger.debug("✅ Achievements synced!")
 
@@ -395,6 +426,7 @@ async def sync_shop_items():
             else:
                 db.add(ShopItem(**item_data, is_active=True))
                 logger.debug(f"  ✅ Added shop item: {item_data['name']}")
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
         await db.commit()
     logger.debug("✅ Shop items synced!")
 
@@ -443,9 +475,35 @@ async def sync_quests():
                     is_active=True,
                 ))
                 logger.debug(f"  ✅ Added quest: {q['title']}")
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
         await db.commit()
     logger.debug("✅ Quests synced!")
 
 
+REPAIRS = {
+    "progress": ("user_story_progress", rebuild_story_progress),
+    "streaks": ("streak_calendars", rebuild_streak_calendars),
+    "activity": ("daily_activity", rebuild_daily_activity),
+}
+
+
+async def repair(target):
+    """Recompute one derived table for all users from its sources."""
+    engine = create_async_engine(settings.database_url, echo=False)
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    table, rebuild = REPAIRS[target]
+    async with async_session() as db:
+        rows = await rebuild(db)
+        # Running servers drop their cached /progress/stats (keyed by this version)
+        await bump_content_version(db, REFERENCE_VERSION_KEY)
+        await db.commit()
+    logger.info(f"✅ Rebuilt {table}: {rows} rows")
+
+
 if __name__ == "__main__":
-    asyncio.run(sync_data())
+    parser = argparse.ArgumentParser(description="Sync data/ into the database")
+    parser.add_argument("--repair", choices=REPAIRS,
+                        help="only rebuild a derived table (progress, streaks or activity) for all users")
+    args = parser.parse_args()
+    asyncio.run(repair(args.repair) if args.repair else sync_data())
@@ -0,0 +1,21 @@
+"""Statement budget of a first step completion (see bench_step_complete.py)."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_step_complete  # noqa: E402
+
+bench_step_complete.use_scratch_database()
+
+from app import step_completion  # noqa: E402
+
+
+def test_first_completion_within_statement_budget():
+    async def measure() -> list[str]:
+        async with bench_step_complete.completion_bench(users=0) as (complete, user_ids, step_ids):
+            return await bench_step_complete.first_completion_statements(complete, user_ids[0], step_ids[0])
+
+    statements = asyncio.run(measure())
+    assert len(statements) <= step_completion.STATEMENT_BUDGET, "\n".join(statements)